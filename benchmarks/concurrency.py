@@ -0,0 +1,109 @@
+"""Latency of the decision endpoints under many concurrent clients.
+
+Runs ``--clients`` concurrent HTTP/1.1 clients against a running server
+for ``--duration`` seconds, each polling a random patient's decision
+endpoint, and reports throughput and p50/p99 latency. Run it once
+against each deployment to compare, e.g. with a database seeded by
+``benchmarks.synthetic``:
+
+    # sync views, WSGI
+    gunicorn -w 4 -b 127.0.0.1:8001 myeloma_api.wsgi
+    # async views, ASGI
+    ASYNC_DECISION_VIEWS=True CONN_MAX_AGE=0 WEB_CONCURRENCY=4 PORT=8002 \\
+        gunicorn -c gunicorn-asgi.conf.py myeloma_api.asgi:application
+
+    python -m benchmarks.concurrency --url http://127.0.0.1:8001 --url http://127.0.0.1:8002
+
+Only the standard library is used so the client itself is not the
+bottleneck; connections are kept alive unless the server closes them.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from urllib.parse import urlsplit
+
+ENDPOINTS = ('staging', 'next-tests', 'treatment-recommendations', 'treatment-recommendations?framework=nice')
+
+
+async def _request(reader, writer, host, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n'.encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Server closed the connection')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(status_line.split()[1]), headers.get('connection', '').lower() == 'close'
+
+
+async def _client(url, patient_ids, deadline, latencies, errors):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    rng = random.Random()
+    connection = None
+    while time.perf_counter() < deadline:
+        path = f'/patients/{rng.choice(patient_ids)}/{rng.choice(ENDPOINTS)}'
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            status, close = await _request(*connection, f'{host}:{port}', path)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            errors.append(path)
+            connection = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status >= 500:
+            errors.append(path)
+        if close:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def run(url, patient_ids, clients, duration):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(_client(url, patient_ids, deadline, latencies, errors) for _ in range(clients)))
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', action='append', required=True, help='Base URL of a server; may be repeated.')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--patients', default='S0000100-S0001099',
+                        help='Range of synthetic patient ids to poll (default: %(default)s).')
+    args = parser.parse_args()
+
+    first, last = args.patients.split('-')
+    width = len(first) - 1
+    patient_ids = [f'{first[0]}{n:0{width}d}' for n in range(int(first[1:]), int(last[1:]) + 1)]
+
+    for url in args.url:
+        latencies, errors = asyncio.run(run(url, patient_ids, args.clients, args.duration))
+        if not latencies:
+            print(f'{url}: no successful requests ({len(errors)} errors)')
+            continue
+        latencies.sort()
+        print(
+            f'{url}: {len(latencies) / args.duration:8.1f} req/s  '
+            f'p50 {statistics.median(latencies) * 1000:7.1f} ms  '
+            f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms  '
+            f'errors {len(errors)}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Django setup shared by the benchmarks that need the ORM.
+
+Benchmarks never touch the configured database: ``scratch_database``
+creates Django's test database (``test_<NAME>``, in memory for SQLite)
+and destroys it on exit.
+"""
+import os
+from contextlib import contextmanager
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myeloma_api.settings')
+    django.setup()
+
+
+@contextmanager
+def scratch_database():
+    setup()
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+    setup_test_environment(debug=False)
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
@@ -0,0 +1,340 @@
+"""Throughput, latency and queries per request of every endpoint.
+
+Seeds a scratch database with synthetic patients, then replays a request
+mix against the API twice: through the Django test client (which also
+counts the SQL queries of each request) and over HTTP against a real
+server running in-process. Results can be saved as a JSON baseline and
+compared with an earlier one:
+
+    python -m benchmarks.endpoints --patients 10000 --output before.json
+    # ... change something ...
+    python -m benchmarks.endpoints --patients 10000 --compare before.json
+
+Compare runs made on the same machine at the same scale; latency moves
+with the host's load, query counts don't. Scales of 100k or 1M patients are best run with DATABASE_URL pointing at
+Postgres (the scratch database is created next to the configured one).
+
+A mix is a JSON Lines file, one endpoint per line (see ``mixes/``)::
+
+    {"name": "staging", "method": "GET", "path": "/patients/{patient_id}/staging", "weight": 20}
+
+``weight`` sets how often the entry is picked. ``body`` is sent as JSON,
+or as one JSON line per item with ``"content_type": "application/x-ndjson"``.
+``{patient_id}`` (a random seeded patient), ``{job_id}`` (one of the jobs
+run before the replay, see ``seed_jobs``) and ``{today}`` are substituted
+in the path and in body strings.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.django_setup import scratch_database
+
+DEFAULT_MIX = os.path.join(os.path.dirname(__file__), 'mixes', 'default.jsonl')
+MODES = ('client', 'live')
+MATERIALIZE_CHUNK_SIZE = 1000
+MIN_SAMPLES = 30
+
+
+def load_mix(path):
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    for entry in entries:
+        entry.setdefault('method', 'GET')
+        entry.setdefault('weight', 1)
+    return [entry for entry in entries if entry['weight'] > 0]
+
+
+def _substitute(value, context):
+    if isinstance(value, str):
+        return value.format_map(context)
+    if isinstance(value, list):
+        return [_substitute(v, context) for v in value]
+    if isinstance(value, dict):
+        return {k: _substitute(v, context) for k, v in value.items()}
+    return value
+
+
+def seed_jobs():
+    """Run one job of each kind to completion; returns their ids for ``{job_id}``."""
+    from patients import jobs
+    from patients.models import JobKind
+
+    ids = [jobs.enqueue(JobKind.RECOMPUTE_FLAGS, {'dryRun': True}).pk, jobs.enqueue(JobKind.EXPORT_DECISIONS).pk]
+    jobs.work(worker='benchmark', burst=True)
+    return ids
+
+
+def plan(mix, patient_ids, count, seed=0, job_ids=(None,)):
+    """``count`` concrete requests ``(name, method, path, content_type, body)`` drawn from ``mix``."""
+    rng = random.Random(seed)
+    today = datetime.date.today().isoformat()
+    requests = []
+    for entry in rng.choices(mix, weights=[e['weight'] for e in mix], k=count):
+        context = {'patient_id': rng.choice(patient_ids), 'job_id': rng.choice(job_ids), 'today': today}
+        body = entry.get('body')
+        content_type = entry.get('content_type', 'application/json')
+        if body is not None:
+            body = _substitute(body, context)
+            if content_type == 'application/x-ndjson':
+                body = '\n'.join(json.dumps(item) for item in body)
+            else:
+                body = json.dumps(body)
+        requests.append((entry['name'], entry['method'], _substitute(entry['path'], context), content_type, body))
+    return requests
+
+
+# -------
+# Runners
+# -------
+
+def run_client(requests):
+    """Replay through the test client; returns ``[(name, seconds, status, queries)]``."""
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client(raise_request_exception=False)
+    samples = []
+    for name, method, path, content_type, body in requests:
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            if method == 'GET':
+                response = client.get(path)
+            else:
+                response = client.generic(method, path, body or '', content_type=content_type)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        samples.append((name, elapsed, response.status_code, len(queries)))
+    return samples
+
+
+def run_live(requests, concurrency):
+    """Replay over HTTP against an in-process server; queries are not counted."""
+    from django.db import connections
+    from django.test.testcases import LiveServerThread, _StaticFilesHandler
+
+    # Share in-memory SQLite databases with the server thread, as LiveServerTestCase does.
+    overrides = {}
+    for conn in connections.all():
+        if conn.vendor == 'sqlite' and conn.is_in_memory_db():
+            overrides[conn.alias] = conn
+            conn.inc_thread_sharing()
+    if overrides and concurrency > 1:
+        print('in-memory SQLite is shared by every server thread; using --concurrency 1')
+        concurrency = 1
+
+    server = LiveServerThread('localhost', _StaticFilesHandler, connections_override=overrides, port=0)
+    server.daemon = True
+    server.start()
+    server.is_ready.wait()
+    if server.error:
+        raise server.error
+    base = f'http://localhost:{server.port}'
+
+    def send(request):
+        name, method, path, content_type, body = request
+        data = body.encode() if body is not None else None
+        http_request = urllib.request.Request(base + path, data=data, method=method)
+        if data is not None:
+            http_request.add_header('Content-Type', content_type)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        return name, time.perf_counter() - start, status, None
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(send, requests))
+    finally:
+        server.terminate()
+        for conn in overrides.values():
+            conn.dec_thread_sharing()
+
+
+# ---------
+# Reporting
+# ---------
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples, wall_time):
+    by_name = defaultdict(list)
+    for sample in samples:
+        by_name[sample[0]].append(sample)
+
+    endpoints = {}
+    for name, group in sorted(by_name.items()):
+        seconds = sorted(s[1] for s in group)
+        queries = [s[3] for s in group if s[3] is not None]
+        statuses = defaultdict(int)
+        for s in group:
+            statuses[str(s[2])] += 1
+        endpoints[name] = {
+            'requests': len(group),
+            # Requests per second one worker sustains on this endpoint alone.
+            'throughput': len(group) / sum(seconds),
+            'p50_ms': 1000 * statistics.median(seconds),
+            'p95_ms': 1000 * _percentile(seconds, 0.95),
+            'p99_ms': 1000 * _percentile(seconds, 0.99),
+            'queries': statistics.mean(queries) if queries else None,
+            'statuses': dict(statuses),
+        }
+    return {'throughput': len(samples) / wall_time, 'endpoints': endpoints}
+
+
+def print_report(mode, report):
+    print(f'\n{mode}: {report["throughput"]:.1f} req/s overall')
+    print(f'{"endpoint":<32} {"n":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8}  statuses')
+    for name, r in report['endpoints'].items():
+        queries = f'{r["queries"]:8.1f}' if r['queries'] is not None else f'{"-":>8}'
+        statuses = ' '.join(f'{code}x{n}' for code, n in sorted(r['statuses'].items()))
+        print(f'{name:<32} {r["requests"]:6d} {r["throughput"]:8.1f} {r["p50_ms"]:8.2f} {r["p95_ms"]:8.2f} '
+              f'{r["p99_ms"]:8.2f} {queries}  {statuses}')
+
+
+def compare(baseline, current, tolerance):
+    """Print the change of every metric against ``baseline``; returns the regressions found.
+
+    Any increase in queries per request is a regression. Latency is only
+    judged for endpoints with at least ``MIN_SAMPLES`` requests in both runs.
+    """
+    regressions = []
+    for mode, report in current['results'].items():
+        old_report = baseline.get('results', {}).get(mode)
+        if old_report is None:
+            continue
+        print(f'\n{mode} vs baseline ({baseline["meta"].get("commit", "?")}):')
+        print(f'{"endpoint":<32} {"p50":>16} {"p95":>16} {"queries":>12}')
+        for name, new in report['endpoints'].items():
+            old = old_report['endpoints'].get(name)
+            if old is None:
+                print(f'{name:<32} (new)')
+                continue
+            cells = []
+            for key in ('p50_ms', 'p95_ms'):
+                change = (new[key] - old[key]) / old[key] if old[key] else 0
+                cells.append(f'{new[key]:7.2f} {change:+6.0%}')
+                if change > tolerance and min(new['requests'], old['requests']) >= MIN_SAMPLES:
+                    regressions.append(f'{mode} {name} {key} {old[key]:.2f} -> {new[key]:.2f}')
+            if new['queries'] is not None and old['queries'] is not None:
+                cells.append(f'{old["queries"]:5.1f}->{new["queries"]:<5.1f}')
+                if new['queries'] > old['queries']:
+                    regressions.append(f'{mode} {name} queries {old["queries"]:.1f} -> {new["queries"]:.1f}')
+            print(f'{name:<32} {cells[0]:>16} {cells[1]:>16} {cells[2] if len(cells) > 2 else "":>12}')
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=10000, help='e.g. 10000, 100000 or 1000000')
+    parser.add_argument('--diagnostics', type=int, default=3, help='Diagnostics per patient.')
+    parser.add_argument('--monitoring', type=int, default=6, help='Monitoring results per patient.')
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per mode.')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--cold', action='store_true',
+                        help='Start without materialized decisions (every first read computes them).')
+    parser.add_argument('--mode', choices=MODES, action='append', help='Default: both.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Concurrent clients in live mode.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Compare with the results in this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Latency increase reported as a regression (default: %(default)s).')
+    args = parser.parse_args()
+
+    mix = load_mix(args.mix)
+    modes = args.mode or list(MODES)
+
+    with scratch_database():
+        import django
+        from benchmarks import synthetic
+        from patients import decisions
+        from patients.models import Patient
+
+        start = time.perf_counter()
+        pks = synthetic.seed(args.patients, args.diagnostics, args.monitoring)
+        print(f'seeded {args.patients} patients in {time.perf_counter() - start:.1f}s')
+        if not args.cold:
+            start = time.perf_counter()
+            for offset in range(0, len(pks), MATERIALIZE_CHUNK_SIZE):
+                decisions.refresh_many(Patient.objects.filter(pk__in=pks[offset:offset + MATERIALIZE_CHUNK_SIZE]))
+            print(f'materialized decisions in {time.perf_counter() - start:.1f}s')
+        patient_ids = list(Patient.objects.values_list('patient_id', flat=True))
+        start = time.perf_counter()
+        job_ids = seed_jobs()
+        print(f'ran {len(job_ids)} jobs in {time.perf_counter() - start:.1f}s')
+
+        results = {}
+        for n, mode in enumerate(modes):
+            requests = plan(mix, patient_ids, args.warmup + args.requests, seed=n, job_ids=job_ids)
+            warmup, measured = requests[:args.warmup], requests[args.warmup:]
+            run = run_client if mode == 'client' else lambda r: run_live(r, args.concurrency)
+            run(warmup)
+            start = time.perf_counter()
+            samples = run(measured)
+            results[mode] = summarize(samples, time.perf_counter() - start)
+            print_report(mode, results[mode])
+
+    current = {
+        'meta': {
+            'commit': _commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'patients': args.patients,
+            'diagnostics_per_patient': args.diagnostics,
+            'monitoring_per_patient': args.monitoring,
+            'mix': os.path.basename(args.mix),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': django.db.connection.vendor,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f'\nwrote {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('patients') != args.patients:
+            print(f'\nnote: baseline was measured with {baseline["meta"].get("patients")} patients')
+        regressions = compare(baseline, current, args.tolerance)
+        if regressions:
+            print('\nregressions:')
+            for line in regressions:
+                print(f'  {line}')
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Row size and load latency of the decision projection versus full rows.
+
+Seeds a scratch database with synthetic patients, then compares loading
+patients with ``Patient.objects.for_decisions()`` against loading the full
+row (both with the latest diagnostic joined) and evaluating every
+decision for them, as the live fallback of the decision endpoints does.
+
+    python -m benchmarks.projection [--patients 1000000] [--lookups 2000]
+
+Bytes per row are the summed text length of the column values returned
+to Django, which tracks what the database sends over the wire.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.django_setup import scratch_database
+
+
+def row_bytes(queryset, fields, pks):
+    total = 0
+    for row in queryset.filter(pk__in=pks).values_list(*fields):
+        total += sum(len(str(value).encode()) for value in row if value is not None)
+    return total / len(pks)
+
+
+def latencies(load, patient_ids):
+    from patients import decisions
+
+    timings = []
+    for patient_id in patient_ids:
+        start = time.perf_counter()
+        patient = load(patient_id)
+        decisions.evaluate_all(patient, patient.latest_diagnostic)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    with scratch_database():
+        from benchmarks import synthetic
+        from patients.models import DECISION_PATIENT_FIELDS, Patient
+
+        start = time.perf_counter()
+        pks = synthetic.seed(args.patients, diagnostics_per_patient=2)
+        print(f'seeded {args.patients} patients in {time.perf_counter() - start:.1f}s')
+
+        rng = random.Random(1)
+        sample = rng.sample(pks, min(args.lookups, len(pks)))
+        patient_ids = list(Patient.objects.filter(pk__in=sample).values_list('patient_id', flat=True))
+
+        all_fields = [f.attname for f in Patient._meta.concrete_fields]
+        projected_fields = ['id'] + [Patient._meta.get_field(name).attname for name in DECISION_PATIENT_FIELDS]
+        full_bytes = row_bytes(Patient.objects, all_fields, sample)
+        projected_bytes = row_bytes(Patient.objects, projected_fields, sample)
+        print(f'columns/row   full {len(all_fields):6d}     projected {len(projected_fields):6d}')
+        print(f'bytes/row     full {full_bytes:6.0f}     projected {projected_bytes:6.0f}   '
+              f'({100 * (1 - projected_bytes / full_bytes):.0f}% less)')
+
+        def load_full(patient_id):
+            return Patient.objects.with_latest_diagnostic().get(patient_id=patient_id)
+
+        def load_projected(patient_id):
+            return Patient.objects.for_decisions().get(patient_id=patient_id)
+
+        for name, load in (('full', load_full), ('projected', load_projected)):
+            latencies(load, patient_ids[:100])  # warm up
+            p50, p95 = latencies(load, patient_ids)
+            print(f'{name:<10} load+evaluate p50 {p50:.3f} ms  p95 {p95:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Decode-plus-validate cost of the write endpoint payloads.
+
+Encodes batches of random diagnostics payloads as JSON, then measures
+``json.loads`` followed by ``schemas.DIAGNOSTICS_BATCH_ITEM.decode`` per
+payload, against the per-field model path the views used before (kept
+below as the reference). Single monitoring payloads are measured the
+same way against ``MONITORING``.
+
+    python -m benchmarks.schemas [--batches 1,100,5000] [--strings 0.1]
+
+``--strings`` is the share of numeric values sent as strings, which take
+the coercion path instead of the type check.
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.django_setup import setup
+
+
+def legacy_coerce(item, fields, persisted, unit_fields):
+    from django.core.exceptions import ValidationError
+    from patients.engine import units
+    from patients.models import Patient
+
+    values = {}
+    for name in fields:
+        if name not in item:
+            continue
+        value = item[name]
+        if name in persisted:
+            field = Patient._meta.get_field(name)
+            if value is None and not field.null:
+                raise ValidationError(f'{name} may not be null.')
+            try:
+                value = field.to_python(value)
+            except ValidationError as e:
+                raise ValidationError(f'{name}: {" ".join(e.messages)}')
+        if name in unit_fields:
+            try:
+                units.factor(unit_fields[name], value)
+            except units.UnitError as e:
+                raise ValidationError(f'{name}: {e}')
+        values[name] = value
+    return values
+
+
+def random_item(rng, index, strings):
+    def number(value):
+        return str(value) if rng.random() < strings else value
+
+    return {
+        'patient_id': f'S{index:07d}',
+        'karnofsky_performance_score': number(rng.choice([40, 60, 70, 80, 90, 100])),
+        'ecog_performance_status': number(rng.randrange(5)),
+        'stem_cell_transplant_history': rng.choice([[], ['autologous']]),
+        'cytogenic_markers': rng.choice([None, 'del17p', 't(4;14), gain1q']),
+        'peripheral_neuropathy_grade': number(rng.randrange(4)),
+        'serum_creatinine_level': number(round(rng.uniform(0.5, 4), 2)),
+        'serum_creatinine_level_units': 'MG/DL',
+        'creatinine_clearance_rate': number(rng.randrange(20, 120)),
+        'serum_calcium_level': number(round(rng.uniform(8, 13), 2)),
+        'serum_calcium_level_units': 'MG/DL',
+        'hemoglobin_level': number(round(rng.uniform(7, 15), 1)),
+        'hemoglobin_level_units': rng.choice(['G/DL', 'G/L']),
+        'bone_lesions': rng.choice(['0', '1', 'more than 2']),
+        'bone_imaging_result': rng.random() < 0.3,
+        'clonal_bone_marrow_plasma_cells_percentage': number(round(rng.uniform(0, 80), 1)),
+        'kappa_flc': number(rng.randrange(5, 800)),
+        'lambda_flc': number(rng.randrange(5, 50)),
+        'beta2_microglobulin': number(round(rng.uniform(1, 9), 1)),
+        'albumin': number(round(rng.uniform(2.5, 4.5), 1)),
+        'lactate_dehydrogenase_level': number(rng.randrange(100, 400)),
+    }
+
+
+def measure(body, decode, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = json.loads(body)['patients']
+        for item in items:
+            decode(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batches', default='1,100,5000', help='Comma separated batch sizes.')
+    parser.add_argument('--strings', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=0, help='Runs per batch (default: enough for ~20000 payloads).')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup()
+    from patients import schemas
+
+    rng = random.Random(args.seed)
+    fields = schemas.DIAGNOSTIC_FIELDS
+    persisted = set(fields)
+
+    def legacy(item):
+        return legacy_coerce(item, fields, persisted, schemas.UNIT_FIELDS)
+
+    def compiled(item):
+        return schemas.DIAGNOSTICS_BATCH_ITEM.decode(item, partial=True)
+
+    print(f'diagnostics, {args.strings:.0%} numbers as strings (us/payload, best of runs)')
+    for size in (int(size) for size in args.batches.split(',')):
+        body = json.dumps({'patients': [random_item(rng, i, args.strings) for i in range(size)]})
+        repeat = args.repeat or max(3, 20000 // size)
+        before = measure(body, legacy, repeat)
+        after = measure(body, compiled, repeat)
+        print(f'  batch {size:>5}   legacy {before:7.2f}   schema {after:7.2f}   ({before / after:.2f}x)')
+
+    monitoring = json.dumps({'patients': [
+        {'date': '2024-01-01', 'mProtein': round(rng.uniform(0, 3), 2), 'mrDStatus': 'negative', 'symptoms': []}
+        for _ in range(1000)
+    ]})
+    print(f'monitoring  schema {measure(monitoring, schemas.MONITORING.decode, 20):7.2f} us/payload')
+
+
+if __name__ == '__main__':
+    main()
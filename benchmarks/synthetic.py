@@ -0,0 +1,152 @@
+"""Synthetic patient population for benchmarks.
+
+``seed`` fills the database with patients whose wide rows look like real
+ones (long free-text therapy fields, lab values in both unit systems)
+plus a history of diagnostics and monitoring results per patient.
+"""
+import datetime
+import random
+
+from patients.engine import kinetics
+
+PRIOR_THERAPY = (
+    'VRd x4 cycles followed by autologous SCT and lenalidomide maintenance; '
+    'progressed after 26 months, then DRd with partial response. '
+)
+MARKERS = ('del17p', 't(4;14)', 't(14;16)', 't(11;14)', 'gain1q', 'del13q', 'hyperdiploidy')
+
+
+def make_patient(rng, index):
+    from patients.models import Patient
+
+    return Patient(
+        patient_id=f'S{index:07d}',
+        name=f'Synthetic Patient {index}',
+        date_of_birth=datetime.date(1940, 1, 1) + datetime.timedelta(days=rng.randrange(25000)),
+        gender=rng.choice(['M', 'F']),
+        weight=rng.uniform(45, 110),
+        height=rng.uniform(150, 195),
+        country=rng.choice(['UK', 'US', 'DE', 'FR']),
+        region=rng.choice(['North', 'South', 'East', 'West']),
+        postal_code=f'{rng.randrange(10000, 99999)}',
+        stage=rng.choice(['I', 'II', 'III', None]),
+        karnofsky_performance_score=rng.choice([None, 40, 60, 70, 80, 90, 100]),
+        ecog_performance_status=rng.choice([None, 0, 1, 2, 3]),
+        peripheral_neuropathy_grade=rng.choice([None, 0, 1, 2, 3]),
+        cytogenic_markers=', '.join(rng.sample(MARKERS, rng.randrange(0, 3))) or None,
+        molecular_markers='KRAS, NRAS' if rng.random() < 0.3 else None,
+        stem_cell_transplant_history=rng.choice([[], ['autologous']]),
+        progression=rng.choice([None, 'Stable', 'Biochemical progression']),
+        prior_therapy=PRIOR_THERAPY * rng.randrange(1, 6),
+        first_line_therapy='Bortezomib, lenalidomide and dexamethasone (VRd) induction',
+        second_line_therapy='Daratumumab, lenalidomide and dexamethasone (DRd)' if rng.random() < 0.5 else None,
+        later_therapy='Carfilzomib, pomalidomide and dexamethasone (KPd)' if rng.random() < 0.2 else None,
+        relapse_count=rng.randrange(0, 4),
+        treatment_refractory_status=rng.choice([None, None, 'lenalidomide', 'bortezomib']),
+        absolute_neutrophile_count=round(rng.uniform(500, 6000), 2),
+        platelet_count=rng.randrange(50000, 400000),
+        white_blood_cell_count=round(rng.uniform(2, 11), 2),
+        red_blood_cell_count=round(rng.uniform(3, 6), 2),
+        serum_calcium_level=round(rng.uniform(8, 13), 2),
+        creatinine_clearance_rate=rng.randrange(15, 120),
+        serum_creatinine_level=round(rng.uniform(0.5, 4), 2),
+        hemoglobin_level=round(rng.uniform(7, 15), 2),
+        bone_lesions=rng.choice(['0', '1', '2', 'more than 2', None]),
+        bone_imaging_result=rng.random() < 0.4,
+        clonal_bone_marrow_plasma_cells_percentage=round(rng.uniform(0, 90), 2),
+        kappa_flc=rng.randrange(0, 500),
+        lambda_flc=rng.randrange(0, 500),
+        meets_crab=rng.random() < 0.5,
+        meets_slim=rng.random() < 0.3,
+        lactate_dehydrogenase_level=rng.randrange(100, 400),
+        beta2_microglobulin=round(rng.uniform(1, 9), 2),
+        albumin=round(rng.uniform(2.5, 4.8), 1),
+        monoclonal_protein_serum=round(rng.uniform(0, 4), 2),
+    )
+
+
+def make_diagnostic(rng, patient_pk):
+    from patients.models import Diagnostic
+
+    diag = Diagnostic(
+        patient_id=patient_pk,
+        cbc={'hemoglobin': round(rng.uniform(7, 15), 1), 'platelets': rng.randrange(50, 400)},
+        calcium=round(rng.uniform(8, 13), 2),
+        creatinine=round(rng.uniform(0.5, 4), 2),
+        beta2_microglobulin=round(rng.uniform(1, 9), 2),
+        ldh=rng.randrange(100, 400),
+        imaging_results={'pet_ct': rng.choice(['negative', 'focal lesions'])},
+        biomarkers={'cytogenetics': rng.sample(['del(17p)', 't(4;14)', 't(11;14)'], rng.randrange(0, 2))},
+    )
+    diag.extract_fields()
+    return diag
+
+
+def make_monitoring(rng, patient_pk, date):
+    from patients.models import Monitoring
+
+    return Monitoring(
+        patient_id=patient_pk,
+        date=date,
+        m_protein=round(rng.uniform(0, 3), 2),
+        mrD_status=rng.choice(['negative', 'positive']),
+        symptoms=[],
+    )
+
+
+def seed(patients, diagnostics_per_patient=3, monitoring_per_patient=0, batch_size=2000, seed=0, progress=None):
+    """Insert ``patients`` synthetic patients with their history and return their pks.
+
+    Rows are inserted with ``bulk_create``, which skips ``Patient.save`` and
+    the signals, so the derived columns, ``Patient.latest_diagnostic`` and
+    the markers it carries, the marker rows and the monitoring summaries are
+    set here explicitly.
+    """
+    from django.db import transaction
+    from patients.models import Diagnostic, Monitoring, MonitoringSummary, Patient, PatientCytogeneticMarker
+
+    rng = random.Random(seed)
+    pks = []
+    start = Patient.objects.count()
+    for offset in range(0, patients, batch_size):
+        with transaction.atomic():
+            batch = [make_patient(rng, start + i) for i in range(offset, min(offset + batch_size, patients))]
+            for patient in batch:
+                patient.derive_fields()
+            masks = {p.patient_id: p.cytogenetic_mask for p in batch}
+            batch = Patient.objects.bulk_create(batch)
+            if batch[0].pk is None:
+                batch = list(Patient.objects.filter(patient_id__in=masks).only('pk', 'patient_id'))
+            batch_pks = [p.pk for p in batch]
+            PatientCytogeneticMarker.sync({p.pk: masks[p.patient_id] for p in batch})
+
+            Diagnostic.objects.bulk_create(
+                [make_diagnostic(rng, pk) for pk in batch_pks for _ in range(diagnostics_per_patient)]
+            )
+            if diagnostics_per_patient:
+                latest = {}
+                for diag in Diagnostic.objects.filter(patient_id__in=batch_pks).only('pk', 'patient_id').order_by('pk'):
+                    latest[diag.patient_id] = diag.pk
+                Patient.objects.bulk_update(
+                    [Patient(pk=pk, latest_diagnostic_id=latest[pk]) for pk in batch_pks],
+                    ['latest_diagnostic'],
+                    batch_size=batch_size,
+                )
+                Patient.objects.filter(pk__in=batch_pks).sync_diagnostic_markers()
+
+            today = datetime.date.today()
+            monitoring = Monitoring.objects.bulk_create([
+                make_monitoring(rng, pk, today - datetime.timedelta(days=30 * (monitoring_per_patient - n)))
+                for pk in batch_pks for n in range(monitoring_per_patient)
+            ])
+            summaries = []
+            for n in range(0, len(monitoring), max(monitoring_per_patient, 1)):
+                results = monitoring[n:n + monitoring_per_patient]
+                summary = MonitoringSummary(patient_id=results[0].patient_id)
+                summary.kinetics = kinetics.from_history((m.date, m.m_protein) for m in results)
+                summaries.append(summary)
+            MonitoringSummary.objects.bulk_create(summaries)
+        pks += batch_pks
+        if progress:
+            progress(len(pks), patients)
+    return pks
@@ -0,0 +1,195 @@
+"""Per-evaluation latency of the treatment recommendation rules.
+
+Compares the compiled decision tables in ``patients.engine.treatment``
+with the original hand-written if/else implementation (kept below as the
+reference) and checks that both produce identical output on randomly
+generated patients. The tables also recognize alias spellings of the
+markers ("del(17p)", "17p-"), which the reference does not: it is given
+the markers spelled as vocabulary codes.
+
+    python -m benchmarks.treatment [--patients N]
+
+The same equivalence is checked on fewer patients by the test suite
+(patients.tests.TreatmentTablesTests).
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from patients.engine import cytogenetics, treatment
+
+
+def legacy_treatment_recommendations(patient, framework):
+    recommendations = []
+    notes = []
+
+    # === ✅ NICE FRAMEWORK PATH ===
+    if framework == "nice":
+        # 1️⃣ Fit vs frail
+        if patient.karnofsky_performance_score and patient.karnofsky_performance_score >= 70:
+            recommendations.append("NICE: Fit for intensive treatment → Offer bortezomib + thalidomide + dexamethasone (VTD).")
+        else:
+            recommendations.append("NICE: Frail or transplant-ineligible → Offer lenalidomide + dexamethasone (Rd) or VMP if fit enough.")
+
+        # 2️⃣ Stem cell transplant
+        if not patient.stem_cell_transplant_history:
+            if patient.karnofsky_performance_score and patient.karnofsky_performance_score >= 70:
+                recommendations.append("NICE: Consider autologous stem cell transplant following induction with VTD.")
+            else:
+                notes.append("Not eligible for stem cell transplant under NICE criteria.")
+        else:
+            notes.append("Stem cell transplant already performed.")
+
+        # 3️⃣ Disease activity
+        if patient.meets_crab or patient.meets_slim:
+            recommendations.append("NICE: Meets SLiM-CRAB criteria → Initiate systemic therapy.")
+
+        # 4️⃣ Relapsed/Refractory
+        if patient.treatment_refractory_status or (patient.progression and "progression" in patient.progression.lower()):
+            recommendations.append("NICE: Relapse → Offer daratumumab + lenalidomide + dexamethasone (DRd), or carfilzomib-based regimen if previously treated.")
+
+        # 5️⃣ Renal Impairment
+        if patient.serum_creatinine_level and patient.serum_creatinine_level > 2.0:
+            recommendations.append("NICE: Renal impairment → Consider bortezomib-based treatment (VCD or VMP). Dose-adjust lenalidomide.")
+
+        # 6️⃣ Cytogenetics
+        high_risk_markers = ["del17p", "t(4;14)", "t(14;16)"]
+        if patient.cytogenic_markers:
+            markers = [m.strip().lower() for m in patient.cytogenic_markers.split(',')]
+            if any(marker in markers for marker in high_risk_markers):
+                recommendations.append("NICE: High-risk cytogenetics → Consider clinical trial or more aggressive triplet/quadruplet regimen.")
+
+        # 7️⃣ Peripheral neuropathy
+        if patient.peripheral_neuropathy_grade and patient.peripheral_neuropathy_grade >= 2:
+            recommendations.append("NICE: Avoid thalidomide and bortezomib due to neuropathy — consider lenalidomide-based regimens.")
+
+        # Default note
+        if not recommendations:
+            recommendations.append("NICE: No specific recommendation found — refer to haematology MDT.")
+
+    # === ✅ DEFAULT LOGIC from consensus practice and literature ===
+    else:
+        if patient.ecog_performance_status is not None and patient.ecog_performance_status <= 2:
+            recommendations.append("Eligible for aggressive treatment options (VRd, KRd).")
+        elif patient.karnofsky_performance_score is not None and patient.karnofsky_performance_score >= 70:
+            recommendations.append("Consider standard induction therapy with lenalidomide-based regimens.")
+        else:
+            recommendations.append("Consider less intensive therapy (Rd-lite, DRd).")
+
+        if not patient.stem_cell_transplant_history:
+            transplant_eligible = (
+                (patient.karnofsky_performance_score and patient.karnofsky_performance_score >= 70) or
+                (patient.ecog_performance_status and patient.ecog_performance_status <= 2)
+            )
+            if transplant_eligible:
+                recommendations.append("Transplant Eligible → Induction therapy with Daratumumab + VRd (preferred).")
+            else:
+                recommendations.append("Transplant Ineligible → Consider DRd or lenalidomide + dexamethasone (Rd).")
+        else:
+            notes.append("Stem cell transplant already performed.")
+
+        high_risk_markers = ["del17p", "t(4;14)", "t(14;16)"]
+        if patient.cytogenic_markers:
+            markers = [m.strip().lower() for m in patient.cytogenic_markers.split(',')]
+            if any(marker in markers for marker in high_risk_markers):
+                recommendations.append("High-risk cytogenetics: consider quadruplet regimens (Dara-KRd).")
+            else:
+                notes.append("Standard-risk cytogenetics detected.")
+
+        if patient.meets_crab or patient.meets_slim:
+            recommendations.append("Initiate systemic therapy per IMWG criteria (meets SLiM-CRAB).")
+        else:
+            recommendations.append("Consider observation or clinical trial enrollment.")
+
+        if patient.peripheral_neuropathy_grade and patient.peripheral_neuropathy_grade >= 2:
+            recommendations.append("Avoid bortezomib; consider carfilzomib or ixazomib instead.")
+
+        if patient.serum_creatinine_level and patient.serum_creatinine_level > 2.0:
+            recommendations.append("Renal impairment detected: dose-adjust lenalidomide and avoid nephrotoxic agents.")
+
+        if patient.treatment_refractory_status:
+            notes.append(f"Refractory to: {patient.treatment_refractory_status}. Consider next-line salvage regimens (DPd, IsaPd, Selinexor combinations).")
+
+        if patient.progression and "progression" in patient.progression.lower():
+            recommendations.append("Disease progression detected: initiate relapse/refractory regimen.")
+
+        if patient.karnofsky_performance_score and patient.karnofsky_performance_score < 60:
+            recommendations.append("Consider frailty-adapted treatment: low-dose dexamethasone, avoid triplet regimens.")
+
+        if not recommendations:
+            recommendations.append("No immediate treatment recommendation. Recommend multidisciplinary board discussion.")
+
+    return recommendations, notes
+
+
+def random_patient(rng):
+    values = {
+        'karnofsky_performance_score': rng.choice([None, 0, 40, 50, 60, 70, 90, 100]),
+        'ecog_performance_status': rng.choice([None, 0, 1, 2, 3, 4]),
+        'stem_cell_transplant_history': rng.choice([None, [], ['autologous 2021']]),
+        'cytogenic_markers': rng.choice([
+            None, '', 'del17p', 't(4;14), t(11;14)', 'T(14;16)', 'hyperdiploidy', 'gain1q, del13q',
+            'del(17p)', '17p-, +1q', 'monosomy 13', 'DEL(17P), t(11;14)', 'amp(1q), unknown',
+        ]),
+        'peripheral_neuropathy_grade': rng.choice([None, 0, 1, 2, 3]),
+        'serum_creatinine_level': rng.choice([None, Decimal('0.90'), Decimal('2.00'), Decimal('3.40')]),
+        'meets_crab': rng.choice([None, False, True]),
+        'meets_slim': rng.choice([None, False, True]),
+        'treatment_refractory_status': rng.choice([None, '', 'lenalidomide']),
+        'progression': rng.choice([None, '', 'Stable', 'Biochemical progression']),
+    }
+    values['cytogenetic_mask'] = cytogenetics.mask(values['cytogenic_markers'])
+    values['serum_creatinine_level_canonical'] = values['serum_creatinine_level']
+    return values
+
+
+def reference_markers(text):
+    """``text`` with each marker of the vocabulary spelled as its code."""
+    if not text:
+        return text
+    names = []
+    for name in text.split(','):
+        codes = cytogenetics.codes(cytogenetics.mask(name))
+        names.append(codes[0] if codes else name)
+    return ','.join(names)
+
+
+def measure(function, patients, framework, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for patient in patients:
+            function(patient, framework)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(patients) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    values = [random_patient(rng) for _ in range(args.patients)]
+    objects = [SimpleNamespace(**{**v, 'cytogenic_markers': reference_markers(v['cytogenic_markers'])}) for v in values]
+
+    for framework in ('nice', 'consensus'):
+        for v, obj in zip(values, objects):
+            expected = legacy_treatment_recommendations(obj, framework)
+            actual = treatment.evaluate(v, framework)
+            if expected != actual:
+                raise AssertionError(f'{framework}: {v}\n  legacy: {expected}\n  tables: {actual}')
+
+        legacy = measure(legacy_treatment_recommendations, objects, framework, args.repeat)
+        tables = measure(treatment.evaluate, values, framework, args.repeat)
+        print(f'{framework:<10} legacy {legacy:6.2f} us/eval   tables {tables:6.2f} us/eval   '
+              f'({legacy / tables:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
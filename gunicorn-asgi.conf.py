@@ -0,0 +1,25 @@
+"""Gunicorn settings for serving the API through ASGI with Uvicorn workers.
+
+    ASYNC_DECISION_VIEWS=True CONN_MAX_AGE=0 \
+        gunicorn -c gunicorn-asgi.conf.py myeloma_api.asgi:application
+
+Each Uvicorn worker runs an event loop, so one process keeps serving
+other requests while the async decision views wait on the database. One
+worker per core is enough; put PgBouncer (or similar) in front of
+Postgres since CONN_MAX_AGE=0 opens a connection per request.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Keep connections from polling dashboards open between requests.
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+
+# Recycle workers periodically to bound memory growth.
+max_requests = 10000
+max_requests_jitter = 1000
@@ -40,6 +40,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'patients.instrumentation.TimingMiddleware',
+    'patients.routing.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -60,10 +62,39 @@ WSGI_APPLICATION = 'myeloma_api.wsgi.application'
 
 # DATABASE CONFIGURATION
 DATABASE_URL = config('DATABASE_URL')
+# Set CONN_MAX_AGE=0 when serving through ASGI: async views run their
+# queries in short-lived threads, so persistent connections would pile up.
+CONN_MAX_AGE = config('CONN_MAX_AGE', default=600, cast=int)
 DATABASES = {
-    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600)
+    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=CONN_MAX_AGE)
 }
 
+# Read replicas: comma separated database URLs, added to DATABASES as
+# replica1, replica2, ... The GET decision and cohort endpoints read from
+# them (see patients.routing); everything else uses the primary. Test
+# databases mirror the primary. Two local SQLite files work too: migrate
+# both, or copy the primary's file over the replica's.
+DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+DATABASE_REPLICAS = []
+for index, url in enumerate(DATABASE_REPLICA_URLS, 1):
+    DATABASES[f'replica{index}'] = {
+        **dj_database_url.parse(url, conn_max_age=CONN_MAX_AGE),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['patients.routing.ReplicaRouter']
+
+# Seconds a client reads from the primary after writing, so that replica
+# lag never hides its own writes from it (0 disables the pinning)
+READ_YOUR_WRITES_SECONDS = config('READ_YOUR_WRITES_SECONDS', default=10, cast=int)
+
+# Route the GET decision endpoints to their async versions (patients.async_views)
+ASYNC_DECISION_VIEWS = config('ASYNC_DECISION_VIEWS', default=False, cast=bool)
+
+# Report per-request db/rules/serialize timings in a Server-Timing header
+# (they are recorded for /metrics either way)
+SERVER_TIMING = config('SERVER_TIMING', default=True, cast=bool)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
+from patients import instrumentation
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('patients/', include('patients.urls')),
+    path('metrics', instrumentation.metrics),
 ]
@@ -0,0 +1,99 @@
+"""Cohort aggregates computed in the database.
+
+The conditions below restate the rules of ``engine.crab_slim`` as ORM
+expressions over the same columns, so counting patients that meet a
+criterion is one aggregate query instead of loading every patient into
+Python. Keep them in step with the rules they mirror. Stages are stored
+on the patient (see ``engine.staging``) and grouped on as they are.
+"""
+from django.db import models
+from django.db.models.functions import Greatest
+
+from .engine import crab_slim, cytogenetics, staging
+from .models import STAGE_FIELDS
+
+
+def crab_conditions(thresholds=crab_slim.DEFAULT_THRESHOLDS):
+    """``Q`` per CRAB criterion, mirroring ``crab_slim.crab_criteria``."""
+    return {
+        'C': models.Q(serum_calcium_level_canonical__gt=thresholds.calcium),
+        'R': (
+            models.Q(serum_creatinine_level_canonical__gt=thresholds.creatinine) |
+            models.Q(creatinine_clearance_rate__lt=thresholds.creatinine_clearance)
+        ),
+        'A': models.Q(hemoglobin_level_canonical__lt=thresholds.hemoglobin),
+        'B': models.Q(bone_lesions__isnull=False) & ~models.Q(
+            *(models.Q(bone_lesions__iexact=value) for value in crab_slim.NO_LESIONS), _connector=models.Q.OR
+        ),
+    }
+
+
+def slim_conditions(thresholds=crab_slim.DEFAULT_THRESHOLDS):
+    """``Q`` per SLiM criterion, mirroring ``crab_slim.slim_criteria``."""
+    # kappa / max(lambda, 1) >= ratio, without dividing integers in SQL
+    return {
+        'S': models.Q(clonal_bone_marrow_plasma_cells_percentage__gte=thresholds.plasma_cells),
+        'Li': models.Q(kappa_flc__isnull=False, lambda_flc__isnull=False) & (
+            models.Q(kappa_flc__gte=Greatest('lambda_flc', 1) * thresholds.flc_ratio) |
+            models.Q(lambda_flc__gte=Greatest('kappa_flc', 1) * thresholds.flc_ratio)
+        ),
+        'M': models.Q(bone_imaging_result=True, bone_lesions__in=crab_slim.FOCAL_LESIONS),
+    }
+
+
+def _any(conditions):
+    return models.Q(*conditions.values(), _connector=models.Q.OR)
+
+
+def stats(patients):
+    """Aggregates over the ``patients`` queryset, in one query.
+
+    Returns the CRAB and SLiM counts per criterion, the ISS, R-ISS and
+    R2-ISS stage distributions and the share of high-risk cytogenetics per
+    region. The database groups by region and stages, with every count as
+    a filtered aggregate of the same scan; the groups are summed up here.
+    """
+    crab = crab_conditions()
+    slim = slim_conditions()
+    counts = {
+        'patients': models.Q(),
+        'meets_crab': _any(crab),
+        'meets_slim': _any(slim),
+        'myeloma_defining': _any(crab) | _any(slim),
+        'high_risk': models.Q(high_risk_bits__gt=0),
+        **{f'crab_{name}': q for name, q in crab.items()},
+        **{f'slim_{name}': q for name, q in slim.items()},
+    }
+    groups = (
+        patients
+        .annotate(high_risk_bits=models.F('cytogenetic_mask').bitand(cytogenetics.HIGH_RISK_MASK))
+        .values('region', *STAGE_FIELDS)
+        .annotate(**{name: models.Count('pk', filter=q or None) for name, q in counts.items()})
+        .order_by()
+    )
+
+    totals = dict.fromkeys(counts, 0)
+    stages = {name: {} for name in STAGE_FIELDS}
+    regions = {}
+    for row in groups:
+        for name in counts:
+            totals[name] += row[name]
+        for name, distribution in stages.items():
+            stage = staging.label(row[name])
+            distribution[stage] = distribution.get(stage, 0) + row['patients']
+        n, high_risk = regions.get(row['region'], (0, 0))
+        regions[row['region']] = (n + row['patients'], high_risk + row['high_risk'])
+
+    return {
+        'patients': totals['patients'],
+        'crab': {'meets': totals['meets_crab'], **{name: totals[f'crab_{name}'] for name in crab}},
+        'slim': {'meets': totals['meets_slim'], **{name: totals[f'slim_{name}'] for name in slim}},
+        'myelomaDefining': totals['myeloma_defining'],
+        'issStage': dict(sorted(stages['iss_stage'].items())),
+        'rIssStage': dict(sorted(stages['r_iss_stage'].items())),
+        'r2IssStage': dict(sorted(stages['r2_iss_stage'].items())),
+        'highRiskCytogeneticsByRegion': [
+            {'region': region, 'patients': n, 'highRisk': high_risk, 'share': high_risk / n}
+            for region, (n, high_risk) in sorted(regions.items(), key=lambda item: (item[0] is None, item[0] or ''))
+        ],
+    }
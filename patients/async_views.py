@@ -0,0 +1,76 @@
+"""Async versions of the read-only decision endpoints.
+
+They return the same responses (and ETags) as their counterparts in
+``views`` but await the async ORM instead of blocking a worker thread,
+which lets a single ASGI worker serve many concurrent dashboard polls.
+``urls`` routes to them when ``ASYNC_DECISION_VIEWS`` is enabled.
+"""
+from django.http import HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+
+from . import decisions
+from .instrumentation import JsonResponse
+from .models import DecisionKind
+from .routing import replica_reads
+
+
+def _not_found():
+    return JsonResponse({'error': 'Patient or diagnostics not found'}, status=404)
+
+
+async def _etag(request, patient_id, variant):
+    """``(etag, response)``: the ETag and a 304 if ``If-None-Match`` matches it, else None."""
+    version = await decisions.acurrent_version(patient_id)
+    if version is None:
+        return None, None
+    etag = decisions.etag(patient_id, version, variant)
+    response = get_conditional_response(request, etag=etag)
+    return etag, response and _tagged(response, etag)
+
+
+def _tagged(response, etag):
+    if etag:
+        response.headers.setdefault('ETag', etag)
+    return response
+
+
+@replica_reads
+async def next_tests(request, patient_id):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    etag, not_modified = await _etag(request, patient_id, 'next-tests')
+    if not_modified:
+        return not_modified
+    payload = await decisions.aget(patient_id, DecisionKind.NEXT_TESTS)
+    if payload is None:
+        return _tagged(_not_found(), etag)
+    return _tagged(JsonResponse(payload), etag)
+
+
+@replica_reads
+async def staging(request, patient_id):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    etag, not_modified = await _etag(request, patient_id, 'staging')
+    if not_modified:
+        return not_modified
+    payload = await decisions.aget(patient_id, DecisionKind.STAGING)
+    if payload is None:
+        return _tagged(_not_found(), etag)
+    return _tagged(JsonResponse(payload), etag)
+
+
+@replica_reads
+async def treatment_recommendations(request, patient_id):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    framework = request.GET.get("framework", "").lower()
+    etag, not_modified = await _etag(request, patient_id, f'treatment-{decisions.framework_label(framework)}')
+    if not_modified:
+        return not_modified
+    payload = await decisions.aget(patient_id, decisions.framework_kind(framework))
+    if payload is None:
+        return _tagged(_not_found(), etag)
+
+    payload['framework'] = decisions.framework_label(framework)
+    return _tagged(JsonResponse(payload, status=200), etag)
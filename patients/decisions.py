@@ -0,0 +1,339 @@
+"""Responses of the decision endpoints and their materialized copies.
+
+The ``*_payload`` functions compute what ``staging``, ``next_tests`` and
+``treatment_recommendations`` return. ``refresh`` evaluates all of them
+for a patient and stores the results in ``MaterializedDecision`` so the GET
+endpoints can serve them without evaluating any rules; ``get`` returns a
+stored payload, evaluating it live when it is missing or stale.
+``what_if`` evaluates hypothetical diagnostics without storing anything.
+"""
+import json
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, router
+from django.utils import timezone
+
+from . import routing
+from .engine import crab_slim, cytogenetics, staging, treatment
+from .instrumentation import timed
+from .models import STAGE_FIELDS, DecisionKind, MaterializedDecision, Patient
+
+EXPORT_CHUNK_SIZE = 2000
+STORE_BATCH_SIZE = 500
+
+# Patient fields read by staging_payload
+STAGING_FIELDS = STAGE_FIELDS + staging.FIELDS
+
+# Patient fields read by the rules what-if scenarios evaluate, and the
+# sources of the derived ones among them.
+WHAT_IF_PATIENT_FIELDS = tuple(sorted({
+    *crab_slim.FIELDS,
+    *treatment.FIELDS,
+    *STAGING_FIELDS,
+    *(source for sources, _ in Patient.DERIVED_FIELDS.values() for source in sources),
+}))
+
+
+def framework_kind(framework):
+    return DecisionKind.NICE if framework == 'nice' else DecisionKind.CONSENSUS
+
+
+def framework_label(framework):
+    return framework.upper() if framework else "CONSENSUS"
+
+
+def load_patient(patient_id):
+    """Load a patient's decision projection and its latest diagnostic in one query.
+
+    Returns ``(patient, latest_diag)``, with None for whichever doesn't exist.
+    """
+    patient = Patient.objects.for_decisions().filter(patient_id=patient_id).first()
+    if patient is None:
+        return None, None
+    return patient, patient.latest_diagnostic
+
+
+def current_version(patient_id):
+    """``Patient.version`` of ``patient_id``, or None if there is no such patient.
+
+    A single lookup through the unique patient_id index. version is
+    deliberately not indexed itself: it changes on every write, and an
+    index on it would turn each of those into an index update too.
+    """
+    try:
+        return Patient.objects.values_list('version', flat=True).get(patient_id=patient_id)
+    except Patient.DoesNotExist:
+        return None
+
+
+async def acurrent_version(patient_id):
+    """Async version of ``current_version``."""
+    try:
+        return await Patient.objects.values_list('version', flat=True).aget(patient_id=patient_id)
+    except Patient.DoesNotExist:
+        return None
+
+
+def etag(patient_id, version, variant):
+    """ETag of the ``variant`` response (endpoint and framework) for ``patient_id`` at ``version``."""
+    return f'"{quote(patient_id, safe="")}.{version}.{variant}"'
+
+
+def next_tests_payload(patient, latest_diag):
+    """Tests to order next, from the latest diagnostic's biomarkers and the patient's labs.
+
+    Beta-2 microglobulin is the patient's, as staging reads it.
+    """
+    recommended_tests = []
+    rationale = []
+
+    if not latest_diag.biomarkers.get('cytogenetics'):
+        recommended_tests.append("FISH for t(4;14) and t(14;16)")
+        rationale.append("High-risk cytogenetics not fully assessed.")
+
+    if patient.beta2_microglobulin and patient.beta2_microglobulin > 5.5:
+        recommended_tests.append("Bone Marrow Biopsy")
+        rationale.append("Elevated beta-2 microglobulin requires marrow confirmation.")
+
+    return {'patientId': patient.patient_id, 'nextRecommendedTests': recommended_tests, 'rationale': rationale}
+
+
+def staging_payload(patient_id, values):
+    """Stages in ``values`` (a mapping of ``STAGING_FIELDS``) and the prognosis they give."""
+    iss, r_iss, r2_iss = (values[name] for name in STAGE_FIELDS)
+    markers = staging.markers(values['cytogenic_markers'], values['diagnostic_cytogenetic_mask'])
+    if markers and markers & cytogenetics.HIGH_RISK_MASK:
+        prognosis = "High-risk disease due to cytogenetics"
+    elif r_iss == 3 or r2_iss in (3, 4):
+        prognosis = "High-risk disease with poor prognosis"
+    else:
+        prognosis = "Standard risk disease"
+
+    return {
+        'patientId': patient_id,
+        'issStage': staging.label(iss),
+        'rIssStage': staging.label(r_iss),
+        'r2IssStage': staging.label(r2_iss),
+        'prognosis': prognosis,
+        'missingValues': staging.missing(values),
+    }
+
+
+def _values(patient, names):
+    return {name: getattr(patient, name) for name in names}
+
+
+def treatment_payload(patient, framework):
+    recommendations, notes = treatment.evaluate(
+        {name: getattr(patient, name) for name in treatment.FIELDS}, framework
+    )
+    return {
+        'patient_id': patient.patient_id,
+        'framework': framework_label(framework),
+        'recommendations': recommendations,
+        'notes': notes,
+        'nextStep': 'Schedule follow-up consultation in 4 weeks or sooner based on lab results.'
+    }
+
+
+def cohort_record(patient, framework):
+    """Export record of one patient loaded with ``Patient.objects.for_decisions()``.
+
+    Patients without diagnostics are exported with null staging and next tests.
+    """
+    latest_diag = patient.latest_diagnostic
+    return {
+        'patientId': patient.patient_id,
+        'staging': staging_payload(patient.patient_id, _values(patient, STAGING_FIELDS)) if latest_diag else None,
+        'nextTests': next_tests_payload(patient, latest_diag) if latest_diag else None,
+        'treatmentRecommendations': treatment_payload(patient, framework),
+    }
+
+
+def iter_cohort_ndjson(framework, queryset=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one NDJSON line per patient, streaming rows from a server-side cursor."""
+    queryset = (queryset if queryset is not None else Patient.objects.all()).for_decisions().order_by('pk')
+    for patient in queryset.iterator(chunk_size=chunk_size):
+        yield json.dumps(cohort_record(patient, framework), cls=DjangoJSONEncoder) + '\n'
+
+
+def evaluate_all(patient, latest_diag):
+    """Compute the payload of every ``DecisionKind`` for ``patient``."""
+    with timed('rules'):
+        return {
+            DecisionKind.STAGING: staging_payload(patient.patient_id, _values(patient, STAGING_FIELDS)),
+            DecisionKind.NEXT_TESTS: next_tests_payload(patient, latest_diag),
+            DecisionKind.CONSENSUS: treatment_payload(patient, ''),
+            DecisionKind.NICE: treatment_payload(patient, 'nice'),
+        }
+
+
+def what_if(patient, scenarios):
+    """Evaluate ``patient`` under each of ``scenarios``, writing nothing.
+
+    ``patient`` is a fully loaded Patient; each scenario maps diagnostics
+    fields to values decoded by ``schemas.DIAGNOSTICS``. The patient's
+    values are read once, and each scenario is applied to a copy of them,
+    re-deriving only the fields (stages included) whose sources it
+    overrides. Returns one result per scenario, with the CRAB/SLiM
+    criteria, staging and the recommendations of both treatment
+    frameworks.
+    """
+    base = {name: getattr(patient, name) for name in WHAT_IF_PATIENT_FIELDS}
+    results = []
+    with timed('rules'):
+        for overrides in scenarios:
+            values = {**base, **overrides}
+            for name, (sources, function) in Patient.DERIVED_FIELDS.items():
+                if not overrides.keys().isdisjoint(sources):
+                    values[name] = function(*(values[source] for source in sources))
+
+            # The treatment rules read the stored flags: use the scenario's.
+            crab_slim_result = crab_slim.evaluate(values)
+            values['meets_crab'] = crab_slim_result['meets_crab']
+            values['meets_slim'] = crab_slim_result['meets_slim']
+            results.append({
+                'meetsCrab': crab_slim_result['meets_crab'],
+                'meetsSlim': crab_slim_result['meets_slim'],
+                'crabCriteria': crab_slim_result['crab_criteria'],
+                'slimCriteria': crab_slim_result['slim_criteria'],
+                'staging': staging_payload(patient.patient_id, values),
+                'treatmentRecommendations': {
+                    framework_label(framework): dict(zip(
+                        ('recommendations', 'notes'), treatment.evaluate(values, framework)
+                    ))
+                    for framework in ('', 'nice')
+                },
+            })
+    return results
+
+
+def get(patient_id, kind):
+    """Return the ``kind`` decision for ``patient_id``, or None if the patient or diagnostics don't exist.
+
+    Serves the materialized row when it is fresh and otherwise evaluates
+    the patient live, storing every decision for the next request.
+    """
+    payloads = get_many(patient_id, [kind])
+    return payloads and payloads[kind]
+
+
+def _fresh(patient_id, kinds):
+    # Rows computed from the patient's current version and not flagged stale since
+    return MaterializedDecision.objects.filter(
+        patient__patient_id=patient_id, kind__in=kinds, stale=False, version=models.F('patient__version'),
+    ).values_list('kind', 'payload')
+
+
+def get_many(patient_id, kinds):
+    """Return ``{kind: payload}`` for ``kinds``, or None if the patient or diagnostics don't exist.
+
+    Like ``get`` but fetches all requested kinds with one query, falling
+    back to a single live evaluation if any of them is missing or stale.
+    """
+    payloads = dict(_fresh(patient_id, kinds))
+    if len(payloads) == len(set(kinds)):
+        return payloads
+
+    # Evaluate what the primary holds: a lagging replica would store
+    # decisions of an outdated record.
+    with routing.primary():
+        patient, latest_diag = load_patient(patient_id)
+    if latest_diag is None:
+        return None
+    payloads = evaluate_all(patient, latest_diag)
+    store([(patient, k, p) for k, p in payloads.items()])
+    return payloads
+
+
+async def aget(patient_id, kind):
+    """Async version of ``get``."""
+    payloads = await aget_many(patient_id, [kind])
+    return payloads and payloads[kind]
+
+
+async def aget_many(patient_id, kinds):
+    """Async version of ``get_many``, using the async ORM for every read."""
+    payloads = {kind: payload async for kind, payload in _fresh(patient_id, kinds)}
+    if len(payloads) == len(set(kinds)):
+        return payloads
+
+    try:
+        with routing.primary():
+            patient = await Patient.objects.for_decisions().aget(patient_id=patient_id)
+    except Patient.DoesNotExist:
+        return None
+    if patient.latest_diagnostic is None:
+        return None
+    payloads = evaluate_all(patient, patient.latest_diagnostic)
+    await sync_to_async(store)([(patient, k, p) for k, p in payloads.items()])
+    return payloads
+
+
+def store(rows):
+    """Upsert ``(patient, kind, payload)`` rows as fresh decisions of ``patient.version``.
+
+    ``patient`` must have been loaded together with the values the payload
+    was computed from. A stored row is only replaced by one of a newer
+    version (or of the same version, if it was flagged stale), so an
+    evaluation that raced with a write never overwrites the writer's
+    decisions. Django's upserts can't be conditional, hence the SQL;
+    PostgreSQL and SQLite share the syntax.
+    """
+    connection = connections[router.db_for_write(MaterializedDecision)]
+    qn = connection.ops.quote_name
+    meta = MaterializedDecision._meta
+    fields = [meta.get_field(name) for name in ('patient', 'kind', 'payload', 'stale', 'version', 'computed_at')]
+    table, version, stale = qn(meta.db_table), qn('version'), qn('stale')
+    sql = (
+        f'INSERT INTO {table} ({", ".join(qn(f.column) for f in fields)}) VALUES {{values}} '
+        f'ON CONFLICT ({qn("patient_id")}, {qn("kind")}) DO UPDATE SET '
+        + ', '.join(f'{qn(f.column)} = EXCLUDED.{qn(f.column)}' for f in fields[2:])
+        + f' WHERE {table}.{version} < EXCLUDED.{version}'
+        f' OR ({table}.{version} = EXCLUDED.{version} AND {table}.{stale})'
+    )
+    placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    now = timezone.now()
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), STORE_BATCH_SIZE):
+            batch = rows[start:start + STORE_BATCH_SIZE]
+            params = [
+                field.get_db_prep_save(value, connection)
+                for patient, kind, payload in batch
+                for field, value in zip(fields, (patient.pk, kind, payload, False, patient.version, now))
+            ]
+            cursor.execute(sql.format(values=', '.join([placeholders] * len(batch))), params)
+
+
+def refresh(patient):
+    """Recompute and store every decision for ``patient``."""
+    refresh_many([patient])
+
+
+def refresh_many(patients):
+    """Recompute and store every decision for ``patients``, as just written.
+
+    The patients are reloaded (in one query, with their latest diagnostics
+    through the ``latest_diagnostic`` pointers) so that each decision is
+    stored with the version of the values it was computed from, whatever
+    the in-memory instances hold. Patients without diagnostics have no
+    decisions; their rows are removed so the endpoints keep answering 404.
+    """
+    pks = [p.pk for p in patients]
+    rows = []
+    undiagnosed = []
+    for patient in Patient.objects.filter(pk__in=pks).for_decisions():
+        if patient.latest_diagnostic is None:
+            undiagnosed.append(patient.pk)
+            continue
+        rows += [(patient, kind, payload) for kind, payload in evaluate_all(patient, patient.latest_diagnostic).items()]
+    MaterializedDecision.objects.filter(patient__in=undiagnosed).delete()
+    store(rows)
+
+
+def invalidate(patient_pks):
+    """Flag the stored decisions of ``patient_pks`` as stale."""
+    MaterializedDecision.objects.filter(patient_id__in=patient_pks).update(stale=True)
@@ -0,0 +1 @@
+"""Decision rules that operate on plain values and do not depend on Django."""
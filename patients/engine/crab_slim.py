@@ -0,0 +1,187 @@
+"""IMWG CRAB and SLiM criteria for multiple myeloma.
+
+The functions here only depend on the standard library (and NumPy for the
+columnar mode) so they can be used outside of Django, e.g. to re-score
+historical panels when thresholds change.
+
+Values are read from plain mappings keyed by the ``Patient`` field names
+listed in ``FIELDS``; lab values are the ``*_canonical`` columns, already
+in the units of the thresholds (see ``units``). Missing keys and ``None``
+are treated as unknown and never satisfy a criterion.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Thresholds:
+    calcium: float = 11             # serum calcium > 11 mg/dL
+    creatinine: float = 2           # serum creatinine > 2 mg/dL
+    creatinine_clearance: float = 40  # CrCl < 40 mL/min
+    hemoglobin: float = 10          # hemoglobin < 10 g/dL
+    plasma_cells: float = 60        # clonal BM plasma cells >= 60 %
+    flc_ratio: float = 100          # involved/uninvolved FLC ratio >= 100
+
+
+DEFAULT_THRESHOLDS = Thresholds()
+
+FIELDS = (
+    'serum_calcium_level_canonical',
+    'serum_creatinine_level_canonical',
+    'creatinine_clearance_rate',
+    'hemoglobin_level_canonical',
+    'bone_lesions',
+    'bone_imaging_result',
+    'clonal_bone_marrow_plasma_cells_percentage',
+    'kappa_flc',
+    'lambda_flc',
+)
+
+# bone_lesions values that mean "no lesions" / count as an MRI focal lesion finding
+NO_LESIONS = ('0', 'none')
+FOCAL_LESIONS = ('2', 'more than 2')
+POSITIVE_IMAGING = ('yes', 'true')
+
+
+def _number(value):
+    if value is None or isinstance(value, (int, float, Decimal)):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        return float(value) if value else None
+    raise TypeError(f'Expected a number, got {type(value).__name__}')
+
+
+def _has_lesions(bone_lesions):
+    return bone_lesions is not None and str(bone_lesions).lower() not in NO_LESIONS
+
+
+def _has_focal_lesions(bone_lesions):
+    return bone_lesions is not None and str(bone_lesions) in FOCAL_LESIONS
+
+
+def _positive_imaging(bone_imaging):
+    return bone_imaging is not None and str(bone_imaging).lower() in POSITIVE_IMAGING
+
+
+def crab_criteria(values, thresholds=DEFAULT_THRESHOLDS):
+    calcium = _number(values.get('serum_calcium_level_canonical'))
+    creatinine = _number(values.get('serum_creatinine_level_canonical'))
+    clearance = _number(values.get('creatinine_clearance_rate'))
+    hemoglobin = _number(values.get('hemoglobin_level_canonical'))
+    return {
+        'C': calcium is not None and calcium > thresholds.calcium,
+        'R': (
+            (creatinine is not None and creatinine > thresholds.creatinine) or
+            (clearance is not None and clearance < thresholds.creatinine_clearance)
+        ),
+        'A': hemoglobin is not None and hemoglobin < thresholds.hemoglobin,
+        'B': _has_lesions(values.get('bone_lesions')),
+    }
+
+
+def slim_criteria(values, thresholds=DEFAULT_THRESHOLDS):
+    plasma_cells = _number(values.get('clonal_bone_marrow_plasma_cells_percentage'))
+    kappa = _number(values.get('kappa_flc'))
+    lambda_ = _number(values.get('lambda_flc'))
+    return {
+        'S': plasma_cells is not None and plasma_cells >= thresholds.plasma_cells,
+        'Li': (
+            kappa is not None and lambda_ is not None and
+            (
+                (kappa / max(lambda_, 1)) >= thresholds.flc_ratio or
+                (lambda_ / max(kappa, 1)) >= thresholds.flc_ratio
+            )
+        ),
+        'M': _positive_imaging(values.get('bone_imaging_result')) and _has_focal_lesions(values.get('bone_lesions')),
+    }
+
+
+def evaluate(values, thresholds=DEFAULT_THRESHOLDS):
+    """Evaluate CRAB and SLiM for a single mapping of patient values."""
+    crab = crab_criteria(values, thresholds)
+    slim = slim_criteria(values, thresholds)
+    return {
+        'meets_crab': any(crab.values()),
+        'meets_slim': any(slim.values()),
+        'crab_criteria': crab,
+        'slim_criteria': slim,
+    }
+
+
+# ------------
+# Columnar mode
+# ------------
+
+def _float_column(column, size):
+    if column is None:
+        return np.full(size, np.nan)
+    array = np.asarray(column)
+    if array.dtype.kind in 'fiu':
+        return array.astype(float, copy=False)
+    return np.array([np.nan if v is None else float(v) for v in array], dtype=float)
+
+
+def _text_predicate(column, predicate, size):
+    """Apply a scalar predicate to a column of labels, once per distinct value."""
+    if column is None:
+        return np.zeros(size, dtype=bool)
+    array = np.asarray(column)
+    if array.dtype.kind == 'b':
+        return np.where(array, predicate(True), predicate(False))
+    cache = {}
+
+    def test(value):
+        try:
+            return cache[value]
+        except KeyError:
+            result = cache[value] = predicate(value)
+            return result
+
+    return np.fromiter(map(test, array.tolist()), dtype=bool, count=size)
+
+
+def evaluate_columns(columns, thresholds=DEFAULT_THRESHOLDS):
+    """Evaluate CRAB and SLiM for whole columns of patient values at once.
+
+    ``columns`` maps names from ``FIELDS`` to equally sized sequences or
+    NumPy arrays; missing names are treated as all-unknown and ``None`` or
+    NaN entries as unknown values. Returns a dict of boolean arrays for each
+    criterion plus ``meets_crab`` and ``meets_slim``.
+    """
+    sizes = {len(column) for column in columns.values()}
+    if len(sizes) > 1:
+        raise ValueError('All columns must have the same length')
+    size = sizes.pop() if sizes else 0
+
+    calcium = _float_column(columns.get('serum_calcium_level_canonical'), size)
+    creatinine = _float_column(columns.get('serum_creatinine_level_canonical'), size)
+    clearance = _float_column(columns.get('creatinine_clearance_rate'), size)
+    hemoglobin = _float_column(columns.get('hemoglobin_level_canonical'), size)
+    plasma_cells = _float_column(columns.get('clonal_bone_marrow_plasma_cells_percentage'), size)
+    kappa = _float_column(columns.get('kappa_flc'), size)
+    lambda_ = _float_column(columns.get('lambda_flc'), size)
+    bone_lesions = columns.get('bone_lesions')
+
+    # Comparisons against NaN are False, so unknown values never qualify.
+    with np.errstate(invalid='ignore'):
+        result = {
+            'C': calcium > thresholds.calcium,
+            'R': (creatinine > thresholds.creatinine) | (clearance < thresholds.creatinine_clearance),
+            'A': hemoglobin < thresholds.hemoglobin,
+            'B': _text_predicate(bone_lesions, _has_lesions, size),
+            'S': plasma_cells >= thresholds.plasma_cells,
+            'Li': (
+                (kappa / np.maximum(lambda_, 1) >= thresholds.flc_ratio) |
+                (lambda_ / np.maximum(kappa, 1) >= thresholds.flc_ratio)
+            ),
+            'M': (
+                _text_predicate(columns.get('bone_imaging_result'), _positive_imaging, size) &
+                _text_predicate(bone_lesions, _has_focal_lesions, size)
+            ),
+        }
+    result['meets_crab'] = result['C'] | result['R'] | result['A'] | result['B']
+    result['meets_slim'] = result['S'] | result['Li'] | result['M']
+    return result
@@ -0,0 +1,95 @@
+"""Cytogenetic marker vocabulary and its bitmask encoding.
+
+``Patient.cytogenic_markers`` is free text (comma separated). ``mask``
+maps it onto the fixed vocabulary below, one bit per marker, so that
+rules can test for a marker with a single ``&`` and cohort queries can
+use the indexed marker table instead of scanning text.
+
+A marker's ``bit`` is part of the stored data (the mask column and the
+primary key of ``CytogeneticMarker``): never renumber or reuse one.
+Markers outside the vocabulary are kept in the text but not encoded.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+
+class Marker(namedtuple('Marker', 'bit code name high_risk aliases')):
+
+    def __new__(cls, bit, code, name, high_risk=False, aliases=()):
+        return super().__new__(cls, bit, code, name, high_risk, tuple(aliases))
+
+
+VOCABULARY = (
+    Marker(0, 'del17p', 'Deletion 17p', high_risk=True, aliases=['del(17p)', '17p-']),
+    Marker(1, 't(4;14)', 'Translocation t(4;14)', high_risk=True),
+    Marker(2, 't(14;16)', 'Translocation t(14;16)', high_risk=True),
+    Marker(3, 't(14;20)', 'Translocation t(14;20)'),
+    Marker(4, 't(11;14)', 'Translocation t(11;14)'),
+    Marker(5, 't(6;14)', 'Translocation t(6;14)'),
+    Marker(6, 'gain1q', 'Gain of 1q', aliases=['gain(1q)', '+1q']),
+    Marker(7, 'amp1q', 'Amplification of 1q', aliases=['amp(1q)']),
+    Marker(8, 'del1p', 'Deletion 1p', aliases=['del(1p)']),
+    Marker(9, 'del13q', 'Deletion 13q', aliases=['del(13q)', 'monosomy 13']),
+    Marker(10, 'hyperdiploidy', 'Hyperdiploidy'),
+)
+
+BY_CODE = {marker.code: marker for marker in VOCABULARY}
+
+
+def _normalize(text):
+    return ''.join(text.lower().split())
+
+
+_LOOKUP = {
+    _normalize(name): marker
+    for marker in VOCABULARY
+    for name in (marker.code, *marker.aliases)
+}
+
+HIGH_RISK_MASK = sum(1 << marker.bit for marker in VOCABULARY if marker.high_risk)
+
+
+@lru_cache(maxsize=4096)
+def mask(cytogenic_markers):
+    """Bitmask of the vocabulary markers in the comma separated ``cytogenic_markers``."""
+    if not cytogenic_markers:
+        return 0
+    value = 0
+    for name in cytogenic_markers.split(','):
+        marker = _LOOKUP.get(_normalize(name))
+        if marker is not None:
+            value |= 1 << marker.bit
+    return value
+
+
+def list_mask(names):
+    """Bitmask of the vocabulary markers in the list ``names``, e.g. a Diagnostic's ``biomarkers['cytogenetics']``.
+
+    Anything but a list counts as no markers, as do non-string entries.
+    """
+    if not isinstance(names, list):
+        return 0
+    value = 0
+    for name in names:
+        marker = _LOOKUP.get(_normalize(name)) if isinstance(name, str) else None
+        if marker is not None:
+            value |= 1 << marker.bit
+    return value
+
+
+def codes(value):
+    """Codes of the markers set in the bitmask ``value``, in vocabulary order."""
+    return [marker.code for marker in VOCABULARY if value >> marker.bit & 1]
+
+
+def bits(value):
+    """Bit numbers set in ``value`` (the primary keys of their CytogeneticMarker rows)."""
+    return [marker.bit for marker in VOCABULARY if value >> marker.bit & 1]
+
+
+def mask_of(marker_codes):
+    """Bitmask of ``marker_codes``; raises KeyError for a code outside the vocabulary."""
+    value = 0
+    for code in marker_codes:
+        value |= 1 << _LOOKUP[_normalize(code)].bit
+    return value
@@ -0,0 +1,126 @@
+"""Serum M-protein kinetics and IMWG progression.
+
+A patient's monitoring history is summarised by a ``Kinetics`` value: the
+nadir, the latest result and an exponentially weighted slope. ``add``
+folds one more result into a summary in O(1), so the summary can be kept
+up to date on every insert without rescanning the history. Results must
+arrive in date order for that; ``add`` raises ``OutOfOrderError`` for an
+older result, and the caller rebuilds the summary with ``from_history``.
+
+Results without an M-protein value do not change the summary.
+"""
+from dataclasses import dataclass, replace
+
+
+@dataclass(frozen=True)
+class Thresholds:
+    relative_rise: float = 0.25     # >= 25 % increase from nadir
+    absolute_rise: float = 0.5      # ... of at least 0.5 g/dL
+    confirmations: int = 2          # consecutive assessments to confirm
+
+
+DEFAULT_THRESHOLDS = Thresholds()
+
+# The slope is reported in g/dL per SLOPE_PERIOD_DAYS and smoothed with
+# weight SLOPE_SMOOTHING on the newest interval.
+SLOPE_PERIOD_DAYS = 30
+SLOPE_SMOOTHING = 0.5
+
+CONTINUE_MAINTENANCE = 'Continue maintenance therapy. Next assessment in 3 months.'
+CONFIRM_PROGRESSION = (
+    'M-protein has risen at least 25% from nadir: repeat the assessment to confirm progression.'
+)
+PROGRESSION_CONFIRMED = (
+    'IMWG progressive disease confirmed (M-protein at least 25% above nadir on consecutive '
+    'assessments): initiate relapse/refractory regimen.'
+)
+
+
+class OutOfOrderError(ValueError):
+    """A result is older than the latest one already in the summary."""
+
+
+@dataclass(frozen=True)
+class Kinetics:
+    count: int = 0
+    nadir: float = None
+    nadir_date: object = None
+    last: float = None
+    last_date: object = None
+    slope: float = None
+    consecutive_progression: int = 0
+
+
+EMPTY = Kinetics()
+
+
+def meets_progression(nadir, value, thresholds=DEFAULT_THRESHOLDS):
+    """True if ``value`` is a progression-level rise from ``nadir``."""
+    rise = value - nadir
+    return rise >= thresholds.absolute_rise and rise >= thresholds.relative_rise * nadir
+
+
+def add(kinetics, date, value, thresholds=DEFAULT_THRESHOLDS):
+    """Return ``kinetics`` with the result ``value`` measured on ``date`` folded in."""
+    if value is None:
+        return kinetics
+    if kinetics.count == 0:
+        return Kinetics(count=1, nadir=value, nadir_date=date, last=value, last_date=date)
+    if date < kinetics.last_date:
+        raise OutOfOrderError(f'{date} is before the latest result ({kinetics.last_date})')
+
+    slope = kinetics.slope
+    days = (date - kinetics.last_date).days
+    if days:
+        interval = (value - kinetics.last) * SLOPE_PERIOD_DAYS / days
+        slope = interval if slope is None else SLOPE_SMOOTHING * interval + (1 - SLOPE_SMOOTHING) * slope
+
+    nadir, nadir_date = kinetics.nadir, kinetics.nadir_date
+    if value < nadir:
+        nadir, nadir_date = value, date
+    streak = kinetics.consecutive_progression + 1 if meets_progression(nadir, value, thresholds) else 0
+
+    return replace(
+        kinetics,
+        count=kinetics.count + 1,
+        nadir=nadir,
+        nadir_date=nadir_date,
+        last=value,
+        last_date=date,
+        slope=slope,
+        consecutive_progression=streak,
+    )
+
+
+def from_history(results, thresholds=DEFAULT_THRESHOLDS):
+    """Build a summary from ``(date, value)`` pairs in any order."""
+    kinetics = EMPTY
+    for date, value in sorted((r for r in results if r[1] is not None), key=lambda r: r[0]):
+        kinetics = add(kinetics, date, value, thresholds)
+    return kinetics
+
+
+def trend(kinetics, thresholds=DEFAULT_THRESHOLDS):
+    """Change from nadir and the progression status of ``kinetics``."""
+    if kinetics.count == 0:
+        return {
+            'change_from_nadir': None,
+            'percent_change_from_nadir': None,
+            'progression': False,
+            'progression_confirmed': False,
+        }
+    change = kinetics.last - kinetics.nadir
+    return {
+        'change_from_nadir': change,
+        'percent_change_from_nadir': 100 * change / kinetics.nadir if kinetics.nadir else None,
+        'progression': kinetics.consecutive_progression >= 1,
+        'progression_confirmed': kinetics.consecutive_progression >= thresholds.confirmations,
+    }
+
+
+def recommendation(kinetics, thresholds=DEFAULT_THRESHOLDS):
+    if kinetics.consecutive_progression >= thresholds.confirmations:
+        return PROGRESSION_CONFIRMED
+    if kinetics.consecutive_progression:
+        return CONFIRM_PROGRESSION
+    return CONTINUE_MAINTENANCE
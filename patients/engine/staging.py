@@ -0,0 +1,174 @@
+"""ISS, R-ISS and R2-ISS staging of multiple myeloma.
+
+Like ``crab_slim`` this only depends on the standard library. Values are
+the ``Patient`` fields in ``FIELDS``: serum beta-2 microglobulin (mg/L),
+albumin (g/dL), LDH (U/L), the free-text cytogenetic markers, read
+through ``cytogenetics.mask``, and the markers of the latest Diagnostic
+(a mask, see ``Patient.diagnostic_cytogenetic_mask``). A marker counts
+if either lists it; cytogenetics count as not assessed when both are
+empty.
+
+Stages are the integers 1 to 4 (see ``LABELS``). A missing value only
+leaves a patient unstaged (None) when it could change the stage: beta-2
+microglobulin >= 5.5 mg/L is ISS III whatever the albumin, for example.
+
+- ISS: I if beta-2 microglobulin < 3.5 and albumin >= 3.5, III if beta-2
+  microglobulin >= 5.5, II otherwise.
+- R-ISS: I if ISS I with standard-risk cytogenetics and normal LDH, III
+  if ISS III with high-risk cytogenetics (del(17p), t(4;14), t(14;16))
+  or high LDH, II otherwise.
+- R2-ISS: ISS II scores 1, ISS III 1.5, del(17p), high LDH and t(4;14) 1
+  each, gain or amplification of 1q 0.5; a total of 0 is stage I, up to
+  1 II, up to 2.5 III and more IV.
+"""
+from dataclasses import dataclass
+from itertools import product
+
+from . import cytogenetics
+
+
+@dataclass(frozen=True)
+class Thresholds:
+    beta2_microglobulin_low: float = 3.5    # ISS I below 3.5 mg/L
+    beta2_microglobulin_high: float = 5.5   # ISS III from 5.5 mg/L
+    albumin: float = 3.5                    # ISS I needs albumin >= 3.5 g/dL
+    ldh: float = 250                        # upper limit of normal, U/L
+
+
+DEFAULT_THRESHOLDS = Thresholds()
+
+FIELDS = (
+    'beta2_microglobulin', 'albumin', 'lactate_dehydrogenase_level', 'cytogenic_markers', 'diagnostic_cytogenetic_mask',
+)
+
+LABELS = {1: 'Stage I', 2: 'Stage II', 3: 'Stage III', 4: 'Stage IV'}
+UNSTAGED = 'Unstaged'
+NUMERALS = {'I': 1, 'II': 2, 'III': 3, 'IV': 4}
+
+DEL_17P = 1 << cytogenetics.BY_CODE['del17p'].bit
+T_4_14 = 1 << cytogenetics.BY_CODE['t(4;14)'].bit
+GAIN_1Q = 1 << cytogenetics.BY_CODE['gain1q'].bit | 1 << cytogenetics.BY_CODE['amp1q'].bit
+
+# R2-ISS points per ISS stage
+_R2_ISS_POINTS = {1: 0, 2: 1, 3: 1.5}
+
+_UNKNOWN = (False, True)
+
+
+def label(stage):
+    return LABELS.get(stage, UNSTAGED)
+
+
+def high_ldh(ldh, thresholds=DEFAULT_THRESHOLDS):
+    """Whether LDH is above the upper limit of normal; None if unknown."""
+    return None if ldh is None else ldh > thresholds.ldh
+
+
+def missing(values):
+    """Names in ``FIELDS`` without a value in ``values``; markers are missing if neither source has any."""
+    names = [name for name in FIELDS[:3] if values.get(name) in (None, '')]
+    if not values.get('cytogenic_markers') and not values.get('diagnostic_cytogenetic_mask'):
+        names.append('cytogenic_markers')
+    return names
+
+
+def markers(cytogenic_markers, diagnostic_cytogenetic_mask):
+    """Mask of the markers in the text or the latest Diagnostic, or None if neither lists any."""
+    if not cytogenic_markers and not diagnostic_cytogenetic_mask:
+        return None
+    return cytogenetics.mask(cytogenic_markers) | (diagnostic_cytogenetic_mask or 0)
+
+
+# ---------------------------------------------------------------------------
+# Possible values of each input: one when known, every one when not.
+
+def _iss_options(beta2_microglobulin, albumin, thresholds):
+    if beta2_microglobulin is None:
+        return (1, 2, 3)
+    if beta2_microglobulin >= thresholds.beta2_microglobulin_high:
+        return (3,)
+    if beta2_microglobulin >= thresholds.beta2_microglobulin_low:
+        return (2,)
+    if albumin is None:
+        return (1, 2)
+    return (1,) if albumin >= thresholds.albumin else (2,)
+
+
+def _options(flag):
+    return _UNKNOWN if flag is None else (flag,)
+
+
+def _marker_options(mask, bits):
+    if mask is None:
+        return _UNKNOWN
+    return (bool(mask & bits),)
+
+
+def _settle(stage, *options):
+    """``stage`` of the inputs if every possible combination agrees on it, else None."""
+    stages = {stage(*values) for values in product(*options)}
+    return stages.pop() if len(stages) == 1 else None
+
+
+def _r_iss(iss, high_risk, high_ldh):
+    if iss == 1 and not high_risk and not high_ldh:
+        return 1
+    if iss == 3 and (high_risk or high_ldh):
+        return 3
+    return 2
+
+
+def _r2_iss(iss, del_17p, high_ldh, t_4_14, gain_1q):
+    points = _R2_ISS_POINTS[iss] + del_17p + high_ldh + t_4_14 + 0.5 * gain_1q
+    if points == 0:
+        return 1
+    if points <= 1:
+        return 2
+    return 3 if points <= 2.5 else 4
+
+
+# ---------------------------------------------------------------------------
+# Stages
+
+def iss(beta2_microglobulin, albumin, thresholds=DEFAULT_THRESHOLDS):
+    options = _iss_options(beta2_microglobulin, albumin, thresholds)
+    return options[0] if len(options) == 1 else None
+
+
+def r_iss(beta2_microglobulin, albumin, ldh, cytogenic_markers, diagnostic_cytogenetic_mask=0,
+          thresholds=DEFAULT_THRESHOLDS):
+    mask = markers(cytogenic_markers, diagnostic_cytogenetic_mask)
+    return _settle(
+        _r_iss,
+        _iss_options(beta2_microglobulin, albumin, thresholds),
+        _marker_options(mask, cytogenetics.HIGH_RISK_MASK),
+        _options(high_ldh(ldh, thresholds)),
+    )
+
+
+def r2_iss(beta2_microglobulin, albumin, ldh, cytogenic_markers, diagnostic_cytogenetic_mask=0,
+           thresholds=DEFAULT_THRESHOLDS):
+    mask = markers(cytogenic_markers, diagnostic_cytogenetic_mask)
+    return _settle(
+        _r2_iss,
+        _iss_options(beta2_microglobulin, albumin, thresholds),
+        _marker_options(mask, DEL_17P),
+        _options(high_ldh(ldh, thresholds)),
+        _marker_options(mask, T_4_14),
+        _marker_options(mask, GAIN_1Q),
+    )
+
+
+def stages(beta2_microglobulin, albumin, ldh, cytogenic_markers, diagnostic_cytogenetic_mask=0,
+           thresholds=DEFAULT_THRESHOLDS):
+    """``(iss, r_iss, r2_iss)`` of one patient's values, in ``FIELDS`` order."""
+    return (
+        iss(beta2_microglobulin, albumin, thresholds),
+        r_iss(beta2_microglobulin, albumin, ldh, cytogenic_markers, diagnostic_cytogenetic_mask, thresholds),
+        r2_iss(beta2_microglobulin, albumin, ldh, cytogenic_markers, diagnostic_cytogenetic_mask, thresholds),
+    )
+
+
+def evaluate(values, thresholds=DEFAULT_THRESHOLDS):
+    """Stages of a mapping of patient values, keyed ``iss``, ``r_iss`` and ``r2_iss``."""
+    return dict(zip(('iss', 'r_iss', 'r2_iss'), stages(*(values.get(name) for name in FIELDS), thresholds)))
@@ -0,0 +1,275 @@
+"""Treatment recommendation rules as declarative decision tables.
+
+Each framework is a table of ``Rule`` rows. A rule names the predicates
+that must hold (``when``) or must not hold (``unless``) and the text it
+emits as a recommendation or a note. Predicates are declared once in
+``PREDICATES`` as Python expressions over patient fields (and previously
+declared predicates), together with the fields they read, so rules share
+them instead of re-testing the same values.
+
+At import time every table is compiled into a ``Plan``: a single generated
+function that loads each field once, computes each shared predicate once
+and then emits the texts of the matching rules in table order.
+"""
+import ast
+from collections import namedtuple
+from string import Formatter
+
+from . import cytogenetics
+
+RECOMMENDATION = 'recommendation'
+NOTE = 'note'
+
+
+# Functions and constants predicate expressions may use.
+HELPERS = {
+    'HIGH_RISK_MASK': cytogenetics.HIGH_RISK_MASK,
+}
+
+
+class Predicate(namedtuple('Predicate', 'fields expression')):
+    """A boolean ``expression`` reading the patient ``fields`` it declares.
+
+    The expression may also refer to predicates declared before it and to
+    the names in ``HELPERS``.
+    """
+
+
+class Rule(namedtuple('Rule', 'when unless kind text')):
+    """Emit ``text`` when every predicate in ``when`` holds and none in ``unless`` does.
+
+    ``text`` may contain ``str.format`` fields naming patient fields, e.g.
+    ``'Refractory to: {treatment_refractory_status}.'``.
+    """
+
+    def __new__(cls, text, when=(), unless=(), kind=RECOMMENDATION):
+        return super().__new__(cls, tuple(when), tuple(unless), kind, text)
+
+    @property
+    def template_fields(self):
+        return tuple(name for _, name, _, _ in Formatter().parse(self.text) if name)
+
+    @property
+    def fields(self):
+        names = set(self.template_fields)
+        for predicate in self.when + self.unless:
+            names.update(predicate_fields(predicate))
+        return tuple(sorted(names))
+
+
+PREDICATES = {
+    'fit': Predicate(
+        ('karnofsky_performance_score',),
+        'karnofsky_performance_score and karnofsky_performance_score >= 70'),
+    'frail': Predicate(
+        ('karnofsky_performance_score',),
+        'karnofsky_performance_score and karnofsky_performance_score < 60'),
+    'ecog_0_to_2': Predicate(
+        ('ecog_performance_status',),
+        'ecog_performance_status is not None and ecog_performance_status <= 2'),
+    'transplant_eligible': Predicate(
+        ('ecog_performance_status',),
+        'fit or (ecog_performance_status and ecog_performance_status <= 2)'),
+    'transplanted': Predicate(
+        ('stem_cell_transplant_history',),
+        'stem_cell_transplant_history'),
+    'active_disease': Predicate(
+        ('meets_crab', 'meets_slim'),
+        'meets_crab or meets_slim'),
+    'refractory': Predicate(
+        ('treatment_refractory_status',),
+        'treatment_refractory_status'),
+    'progressing': Predicate(
+        ('progression',),
+        'progression and "progression" in progression.lower()'),
+    'relapsed': Predicate(
+        (),
+        'refractory or progressing'),
+    'renal_impairment': Predicate(
+        ('serum_creatinine_level_canonical',),
+        'serum_creatinine_level_canonical and serum_creatinine_level_canonical > 2.0'),
+    'has_cytogenetics': Predicate(
+        ('cytogenic_markers',),
+        'cytogenic_markers'),
+    'high_risk_cytogenetics': Predicate(
+        ('cytogenetic_mask',),
+        'cytogenetic_mask & HIGH_RISK_MASK'),
+    'neuropathy': Predicate(
+        ('peripheral_neuropathy_grade',),
+        'peripheral_neuropathy_grade and peripheral_neuropathy_grade >= 2'),
+}
+
+
+def _predicate_names(expression):
+    return {node.id for node in ast.walk(ast.parse(expression, mode='eval')) if isinstance(node, ast.Name)}
+
+
+def predicate_dependencies(name):
+    """Names of the predicates ``name`` is built from, dependencies first, ending with ``name``."""
+    ordered = []
+    for dependency in _predicate_names(PREDICATES[name].expression) & PREDICATES.keys():
+        ordered += [n for n in predicate_dependencies(dependency) if n not in ordered]
+    return ordered + [name]
+
+
+def predicate_fields(name):
+    """Every patient field read by predicate ``name``, including through its dependencies."""
+    return {field for dependency in predicate_dependencies(name) for field in PREDICATES[dependency].fields}
+
+
+def _check_predicates():
+    fields = {field for predicate in PREDICATES.values() for field in predicate.fields}
+    seen = set()
+    for name, predicate in PREDICATES.items():
+        if name in fields or name in HELPERS:
+            raise ValueError(f'Predicate {name!r} shadows a field or helper of the same name')
+        names = _predicate_names(predicate.expression)
+        undeclared = names - set(predicate.fields) - seen - HELPERS.keys()
+        if undeclared:
+            raise ValueError(f'Predicate {name!r} reads undeclared names: {sorted(undeclared)}')
+        seen.add(name)
+
+
+_check_predicates()
+
+
+# -------------
+# NICE pathway
+# -------------
+
+NICE_RULES = (
+    # Fit vs frail
+    Rule("NICE: Fit for intensive treatment → Offer bortezomib + thalidomide + dexamethasone (VTD).",
+         when=['fit']),
+    Rule("NICE: Frail or transplant-ineligible → Offer lenalidomide + dexamethasone (Rd) or VMP if fit enough.",
+         unless=['fit']),
+    # Stem cell transplant
+    Rule("NICE: Consider autologous stem cell transplant following induction with VTD.",
+         when=['fit'], unless=['transplanted']),
+    Rule("Not eligible for stem cell transplant under NICE criteria.",
+         unless=['transplanted', 'fit'], kind=NOTE),
+    Rule("Stem cell transplant already performed.",
+         when=['transplanted'], kind=NOTE),
+    # Disease activity
+    Rule("NICE: Meets SLiM-CRAB criteria → Initiate systemic therapy.",
+         when=['active_disease']),
+    # Relapsed/Refractory
+    Rule("NICE: Relapse → Offer daratumumab + lenalidomide + dexamethasone (DRd), or carfilzomib-based regimen if previously treated.",
+         when=['relapsed']),
+    # Renal impairment
+    Rule("NICE: Renal impairment → Consider bortezomib-based treatment (VCD or VMP). Dose-adjust lenalidomide.",
+         when=['renal_impairment']),
+    # Cytogenetics
+    Rule("NICE: High-risk cytogenetics → Consider clinical trial or more aggressive triplet/quadruplet regimen.",
+         when=['high_risk_cytogenetics']),
+    # Peripheral neuropathy
+    Rule("NICE: Avoid thalidomide and bortezomib due to neuropathy — consider lenalidomide-based regimens.",
+         when=['neuropathy']),
+)
+
+NICE_FALLBACK = "NICE: No specific recommendation found — refer to haematology MDT."
+
+
+# ------------------------------------------------------
+# Default pathway from consensus practice and literature
+# ------------------------------------------------------
+
+CONSENSUS_RULES = (
+    Rule("Eligible for aggressive treatment options (VRd, KRd).",
+         when=['ecog_0_to_2']),
+    Rule("Consider standard induction therapy with lenalidomide-based regimens.",
+         when=['fit'], unless=['ecog_0_to_2']),
+    Rule("Consider less intensive therapy (Rd-lite, DRd).",
+         unless=['ecog_0_to_2', 'fit']),
+
+    Rule("Transplant Eligible → Induction therapy with Daratumumab + VRd (preferred).",
+         when=['transplant_eligible'], unless=['transplanted']),
+    Rule("Transplant Ineligible → Consider DRd or lenalidomide + dexamethasone (Rd).",
+         unless=['transplanted', 'transplant_eligible']),
+    Rule("Stem cell transplant already performed.",
+         when=['transplanted'], kind=NOTE),
+
+    Rule("High-risk cytogenetics: consider quadruplet regimens (Dara-KRd).",
+         when=['high_risk_cytogenetics']),
+    Rule("Standard-risk cytogenetics detected.",
+         when=['has_cytogenetics'], unless=['high_risk_cytogenetics'], kind=NOTE),
+
+    Rule("Initiate systemic therapy per IMWG criteria (meets SLiM-CRAB).",
+         when=['active_disease']),
+    Rule("Consider observation or clinical trial enrollment.",
+         unless=['active_disease']),
+
+    Rule("Avoid bortezomib; consider carfilzomib or ixazomib instead.",
+         when=['neuropathy']),
+    Rule("Renal impairment detected: dose-adjust lenalidomide and avoid nephrotoxic agents.",
+         when=['renal_impairment']),
+    Rule("Refractory to: {treatment_refractory_status}. Consider next-line salvage regimens (DPd, IsaPd, Selinexor combinations).",
+         when=['refractory'], kind=NOTE),
+    Rule("Disease progression detected: initiate relapse/refractory regimen.",
+         when=['progressing']),
+    Rule("Consider frailty-adapted treatment: low-dose dexamethasone, avoid triplet regimens.",
+         when=['frail']),
+)
+
+CONSENSUS_FALLBACK = "No immediate treatment recommendation. Recommend multidisciplinary board discussion."
+
+
+# ---------
+# Compiler
+# ---------
+
+class Plan:
+    """A decision table compiled into one flat evaluation function."""
+
+    def __init__(self, name, rules, fallback):
+        predicates = []
+        for rule in rules:
+            for predicate in rule.when + rule.unless:
+                if predicate not in PREDICATES:
+                    raise ValueError(f'{name}: unknown predicate {predicate!r}')
+                predicates += [p for p in predicate_dependencies(predicate) if p not in predicates]
+
+        self.name = name
+        self.rules = tuple(rules)
+        self.fallback = fallback
+        self.fields = tuple(sorted({field for rule in rules for field in rule.fields}))
+        self.source = self._generate(predicates)
+        namespace = dict(HELPERS)
+        exec(compile(self.source, f'<plan {name}>', 'exec'), namespace)
+        self.evaluate = namespace['evaluate']
+
+    def _generate(self, predicates):
+        lines = ['def evaluate(values):']
+        lines += [f'    {field} = values[{field!r}]' for field in self.fields]
+        lines += [f'    {p} = {PREDICATES[p].expression}' for p in predicates]
+        lines += ['    recommendations = []', '    notes = []']
+        for rule in self.rules:
+            condition = ' and '.join([*rule.when, *(f'not {p}' for p in rule.unless)]) or 'True'
+            target = 'notes' if rule.kind == NOTE else 'recommendations'
+            text = f'{rule.text!r}.format_map(values)' if rule.template_fields else repr(rule.text)
+            lines += [f'    if {condition}:', f'        {target}.append({text})']
+        lines += [
+            '    if not recommendations:',
+            f'        recommendations.append({self.fallback!r})',
+            '    return recommendations, notes',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+PLANS = {
+    'nice': Plan('nice', NICE_RULES, NICE_FALLBACK),
+    'consensus': Plan('consensus', CONSENSUS_RULES, CONSENSUS_FALLBACK),
+}
+
+# Every field read by any framework.
+FIELDS = tuple(sorted({field for plan in PLANS.values() for field in plan.fields}))
+
+
+def evaluate(values, framework=''):
+    """Return ``(recommendations, notes)`` for ``values`` under ``framework``.
+
+    ``values`` must contain every name in ``FIELDS``. Any framework other
+    than ``'nice'`` uses the consensus pathway.
+    """
+    plan = PLANS['nice'] if framework == 'nice' else PLANS['consensus']
+    return plan.evaluate(values)
@@ -0,0 +1,101 @@
+"""Conversion of lab values to the canonical units the rules are written in.
+
+``FACTORS`` maps a quantity and a unit to the factor that converts a value
+in that unit into the quantity's canonical unit (``CANONICAL_UNITS``).
+Units are the ``*Units`` choices of the models; a missing unit means the
+value is already canonical.
+
+``LAB_FIELDS`` lists the ``Patient`` fields that carry a ``<field>_units``
+companion. Their canonical values are stored at write time in
+``<field>_canonical`` (see ``canonical_field``), so rules and queries
+compare those columns directly.
+"""
+import numpy as np
+
+CANONICAL_UNITS = {
+    'calcium': 'MG/DL',
+    'creatinine': 'MG/DL',
+    'hemoglobin': 'G/DL',
+    'bilirubin': 'MG/DL',
+    'cell_count': 'CELLS/UL',
+}
+
+FACTORS = {
+    ('calcium', 'MG/DL'): 1.0,
+    ('calcium', 'MICROMOLES/L'): 40.078 / 10000,    # molar mass 40.078 g/mol
+    ('creatinine', 'MG/DL'): 1.0,
+    ('creatinine', 'MICROMOLES/L'): 1 / 88.4,
+    ('hemoglobin', 'G/DL'): 1.0,
+    ('hemoglobin', 'G/L'): 0.1,
+    ('bilirubin', 'MG/DL'): 1.0,
+    ('bilirubin', 'MICROMOLES/L'): 1 / 17.1,
+    ('cell_count', 'CELLS/UL'): 1.0,
+    ('cell_count', 'CELLS/L'): 1e-6,
+}
+
+LAB_FIELDS = {
+    'serum_calcium_level': 'calcium',
+    'serum_creatinine_level': 'creatinine',
+    'hemoglobin_level': 'hemoglobin',
+    'serum_bilirubin_level_total': 'bilirubin',
+    'serum_bilirubin_level_direct': 'bilirubin',
+    'absolute_neutrophile_count': 'cell_count',
+    'platelet_count': 'cell_count',
+    'white_blood_cell_count': 'cell_count',
+    'red_blood_cell_count': 'cell_count',
+}
+
+
+class UnitError(ValueError):
+    """A unit that is not known for the quantity."""
+
+
+def canonical_field(name):
+    return f'{name}_canonical'
+
+
+def units_field(name):
+    return f'{name}_units'
+
+
+def factor(quantity, unit):
+    """Factor converting ``quantity`` from ``unit`` to its canonical unit."""
+    if unit is None or unit == '':
+        return 1.0
+    try:
+        return FACTORS[quantity, unit.strip().upper()]
+    except KeyError:
+        known = ', '.join(u for q, u in FACTORS if q == quantity)
+        raise UnitError(f'Unknown unit {unit!r} for {quantity}; expected one of: {known}') from None
+
+
+def convert(value, quantity, unit):
+    """``value`` (a number, numeric string or None) in the canonical unit of ``quantity``."""
+    if value is None or value == '':
+        return None
+    return float(value) * factor(quantity, unit)
+
+
+def converter(quantity):
+    """``convert`` for ``quantity`` as a function of ``(value, unit)``."""
+    return lambda value, unit: convert(value, quantity, unit)
+
+
+def convert_array(values, quantity, units):
+    """Convert a whole column at once.
+
+    ``units`` is a single unit or a sequence as long as ``values``. Returns
+    a float array with NaN for missing values.
+    """
+    array = np.asarray(values)
+    if array.dtype.kind not in 'fiu':
+        array = np.array([np.nan if v is None or v == '' else float(v) for v in array.tolist()], dtype=float)
+    if units is None or isinstance(units, str):
+        return array * factor(quantity, units)
+    # One lookup per distinct unit, not per value.
+    cache = {}
+    factors = np.fromiter(
+        (cache[u] if u in cache else cache.setdefault(u, factor(quantity, u)) for u in units),
+        dtype=float, count=len(array)
+    )
+    return array * factors
@@ -0,0 +1,237 @@
+"""Background jobs, queued in the database.
+
+``enqueue`` stores a ``Job``; ``run_workers`` processes run ``work``,
+which claims the oldest runnable job with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` (concurrent workers skip rows another one is claiming instead of
+waiting on them) and runs the handler registered for its kind.
+
+Handlers get the job and a ``report(done, total=None)`` callable that
+records progress. While a handler runs, a thread of its worker refreshes
+the job's heartbeat every ``HEARTBEAT_INTERVAL``, however long it goes
+between reports (one slow query or batch). A handler returns
+the JSON stored in ``Job.result``; output too large for that is written
+with ``write_chunk`` and read back in order by ``iter_result``. A job
+whose heartbeat is older than ``LEASE`` is taken to have lost its worker
+and is run again from the start, so handlers must be safe to repeat.
+"""
+import functools
+import os
+import socket
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, models, transaction
+from django.utils import timezone
+
+from . import decisions
+from .models import Job, JobKind, JobResultChunk, JobStatus, Patient
+from .schemas import Field, Schema
+
+LEASE = timedelta(minutes=5)
+HEARTBEAT_INTERVAL = LEASE / 5
+POLL_INTERVAL = 1.0
+RESULT_CHUNK_LINES = decisions.EXPORT_CHUNK_SIZE
+
+PARAMS = {
+    JobKind.RECOMPUTE_FLAGS: Schema('recompute_flags params', [
+        Field('partitionSize', 'int', name='partition_size', null=False, default=10000, min_value=1),
+        Field('batchSize', 'int', name='batch_size', null=False, default=1000, min_value=1),
+        Field('dryRun', 'bool', name='dry_run', null=False, default=False),
+    ]),
+    JobKind.EXPORT_DECISIONS: Schema('export_decisions params', [
+        Field('framework', 'str', null=False, default=''),
+    ]),
+}
+
+
+def enqueue(kind, params=None):
+    """Queue a ``kind`` job; raises ValidationError for invalid ``params``."""
+    return Job.objects.create(kind=kind, params=PARAMS[kind].decode(params or {}))
+
+
+def describe(job):
+    """Public representation of ``job``."""
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'params': job.params,
+        'status': job.status,
+        'progress': {'done': job.progress_done, 'total': job.progress_total},
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error or None,
+        'createdAt': job.created_at,
+        'startedAt': job.started_at,
+        'finishedAt': job.finished_at,
+    }
+
+
+def iter_result(job):
+    """Yield the chunks written by ``job`` in order."""
+    chunks = JobResultChunk.objects.filter(job=job).order_by('sequence').values_list('data', flat=True)
+    yield from chunks.iterator(chunk_size=10)
+
+
+def write_chunk(job, sequence, lines):
+    JobResultChunk.objects.create(job=job, sequence=sequence, data=''.join(lines))
+
+
+# ---------------------------------------------------------------------------
+# Claiming and running
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker):
+    """Mark the oldest runnable job as running on ``worker`` and return it, or None.
+
+    Jobs whose lease expired with ``Job.MAX_ATTEMPTS`` used up are failed
+    on the way. The claiming update is conditional on the row being
+    unchanged, which keeps claims exclusive without row locks: SQLite has
+    none, and there the lookup runs outside a transaction, since one that
+    reads and then writes fails when another worker writes in between.
+    """
+    locking = connection.features.has_select_for_update_skip_locked
+    while True:
+        now = timezone.now()
+        runnable = models.Q(status=JobStatus.QUEUED) | models.Q(status=JobStatus.RUNNING, heartbeat_at__lt=now - LEASE)
+        with transaction.atomic() if locking else nullcontext():
+            job = (
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(runnable)
+                .order_by('created_at', 'pk')
+                .first()
+            )
+            if job is None:
+                return None
+            unchanged = Job.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts)
+            if job.attempts >= Job.MAX_ATTEMPTS:
+                unchanged.update(
+                    status=JobStatus.FAILED, finished_at=now,
+                    error=f'Worker {job.worker} stopped responding; gave up after {job.attempts} attempts.',
+                )
+                continue
+            claimed = unchanged.update(
+                status=JobStatus.RUNNING, worker=worker, attempts=job.attempts + 1,
+                started_at=now, heartbeat_at=now, progress_done=0, progress_total=None, error='',
+            )
+            if not claimed:
+                continue
+            # Output of an attempt that lost its lease
+            JobResultChunk.objects.filter(job=job).delete()
+        job.refresh_from_db()
+        return job
+
+
+def _leased(job):
+    # The job's row, as long as this attempt still holds it
+    return Job.objects.filter(pk=job.pk, worker=job.worker, attempts=job.attempts)
+
+
+def _report(job, done, total=None):
+    fields = {'progress_done': done, 'heartbeat_at': timezone.now()}
+    if total is not None:
+        fields['progress_total'] = total
+    _leased(job).update(**fields)
+
+
+def refresh_heartbeat(job):
+    """Extend the lease of a running ``job``; False if another worker took it over."""
+    return bool(_leased(job).update(heartbeat_at=timezone.now()))
+
+
+def _keep_alive(job, stop):
+    # Runs in its own thread, on its own database connection.
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL.total_seconds()):
+            if not refresh_heartbeat(job):
+                return
+    finally:
+        connection.close()
+
+
+def run(job):
+    """Run a claimed ``job`` to completion and record the outcome."""
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_keep_alive, args=(job, stop), name=f'job-{job.pk}-heartbeat', daemon=True)
+    heartbeat.start()
+    try:
+        result = HANDLERS[job.kind](job, functools.partial(_report, job))
+    except Exception as e:
+        outcome = {'status': JobStatus.FAILED, 'error': f'{type(e).__name__}: {e}'}
+    else:
+        outcome = {'status': JobStatus.SUCCEEDED, 'result': result}
+    finally:
+        stop.set()
+        heartbeat.join()
+    # A worker that lost its lease leaves the job to the one that took it over.
+    _leased(job).update(finished_at=timezone.now(), **outcome)
+
+
+def work(worker=None, poll_interval=POLL_INTERVAL, burst=False, stop=lambda: False):
+    """Claim and run jobs until ``stop()`` is true, or the queue is empty if ``burst``."""
+    worker = worker or worker_name()
+    while not stop():
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                return
+            time.sleep(poll_interval)
+            continue
+        run(job)
+
+
+# ---------------------------------------------------------------------------
+# Handlers
+
+def recompute_flags(job, report):
+    """``recompute_flags`` command as a job, one primary-key partition at a time."""
+    from .management.commands.recompute_flags import recompute_partition
+
+    params = job.params
+    bounds = Patient.objects.aggregate(lo=models.Min('pk'), hi=models.Max('pk'))
+    if bounds['lo'] is None:
+        return {'scanned': 0, 'changed': 0, 'dryRun': params['dry_run']}
+    partitions = range(bounds['lo'], bounds['hi'] + 1, params['partition_size'])
+    report(0, len(partitions))
+
+    scanned = changed = 0
+    for done, lo in enumerate(partitions, 1):
+        _, _, n_scanned, n_changed = recompute_partition(
+            lo, lo + params['partition_size'], params['batch_size'], params['dry_run'],
+        )
+        scanned += n_scanned
+        changed += n_changed
+        report(done)
+    return {'scanned': scanned, 'changed': changed, 'dryRun': params['dry_run']}
+
+
+def export_decisions(job, report):
+    """Cohort decisions NDJSON, stored in chunks of ``RESULT_CHUNK_LINES`` lines."""
+    report(0, Patient.objects.count())
+    done = sequence = 0
+    lines = []
+    for line in decisions.iter_cohort_ndjson(job.params['framework'].lower()):
+        lines.append(line)
+        if len(lines) == RESULT_CHUNK_LINES:
+            write_chunk(job, sequence, lines)
+            done += len(lines)
+            sequence += 1
+            lines = []
+            report(done)
+    if lines:
+        write_chunk(job, sequence, lines)
+        done += len(lines)
+        sequence += 1
+        report(done)
+    return {'patients': done, 'chunks': sequence}
+
+
+HANDLERS = {
+    JobKind.RECOMPUTE_FLAGS: recompute_flags,
+    JobKind.EXPORT_DECISIONS: export_decisions,
+}
@@ -0,0 +1,30 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from patients import decisions, jobs
+from patients.models import JobKind
+
+
+class Command(BaseCommand):
+    help = 'Export staging, next tests and treatment recommendations for every patient as NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--framework', default='', help='Treatment framework, e.g. "nice" (default: consensus).')
+        parser.add_argument('--output', '-o', help='File to write to (default: stdout).')
+        parser.add_argument('--chunk-size', type=int, default=decisions.EXPORT_CHUNK_SIZE)
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue the export as a background job (see run_workers) and print its id.')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = jobs.enqueue(JobKind.EXPORT_DECISIONS, {'framework': options['framework']})
+            self.stdout.write(f'Queued job {job.pk}.')
+            return
+        out = open(options['output'], 'w') if options['output'] else sys.stdout
+        try:
+            for line in decisions.iter_cohort_ndjson(options['framework'].lower(), chunk_size=options['chunk_size']):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
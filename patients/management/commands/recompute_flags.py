@@ -0,0 +1,154 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+DEFAULT_CHECKPOINT = 'recompute_flags.checkpoint.json'
+
+
+def _init_worker():
+    # Workers started with "spawn" import Django from scratch; forked ones
+    # inherit it. Either way they open their own database connection on
+    # first use because the parent closed its connections before forking.
+    if not apps.ready:
+        django.setup()
+
+
+def recompute_partition(lo, hi, batch_size, dry_run=False):
+    """Recompute meets_crab/meets_slim for patients with lo <= pk < hi.
+
+    Only rows whose flags change are written, with their versions bumped and
+    decisions invalidated. Returns ``(lo, hi, scanned, changed)``.
+    """
+    from patients import decisions
+    from patients.engine import crab_slim
+    from patients.models import Patient
+
+    rows = list(
+        Patient.objects.filter(pk__gte=lo, pk__lt=hi)
+        .order_by('pk')
+        .values_list('pk', 'meets_crab', 'meets_slim', *crab_slim.FIELDS)
+    )
+    if not rows:
+        return lo, hi, 0, 0
+
+    columns = dict(zip(crab_slim.FIELDS, zip(*(row[3:] for row in rows))))
+    result = crab_slim.evaluate_columns(columns)
+
+    changed = [
+        Patient(pk=pk, meets_crab=bool(crab), meets_slim=bool(slim))
+        for (pk, old_crab, old_slim, *_), crab, slim in zip(rows, result['meets_crab'], result['meets_slim'])
+        if old_crab is not bool(crab) or old_slim is not bool(slim)
+    ]
+    if changed and not dry_run:
+        with transaction.atomic():
+            Patient.objects.bulk_update(changed, ['meets_crab', 'meets_slim'], batch_size=batch_size)
+            Patient.bump_versions([p.pk for p in changed])
+            decisions.invalidate([p.pk for p in changed])
+    return lo, hi, len(rows), len(changed)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the stored meets_crab/meets_slim flags of every patient in parallel. '
+        'Completed primary-key partitions are recorded in a checkpoint file, so an '
+        'interrupted run picks up where it stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--partition-size', type=int, default=10000,
+                            help='Number of primary keys per partition.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk_update statement.')
+        parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                            help=f'Checkpoint file (default: {DEFAULT_CHECKPOINT}).')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+        parser.add_argument('--dry-run', action='store_true', help='Count changes without writing them.')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue the recompute as a background job (see run_workers) and print its id.')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            from patients import jobs
+            from patients.models import JobKind
+
+            try:
+                job = jobs.enqueue(JobKind.RECOMPUTE_FLAGS, {
+                    'partitionSize': options['partition_size'],
+                    'batchSize': options['batch_size'],
+                    'dryRun': options['dry_run'],
+                })
+            except ValidationError as e:
+                raise CommandError(' '.join(e.messages))
+            self.stdout.write(f'Queued job {job.pk}.')
+            return
+
+        from django.db.models import Max, Min
+        from patients.models import Patient
+
+        size = options['partition_size']
+        bounds = Patient.objects.aggregate(lo=Min('pk'), hi=Max('pk'))
+        if bounds['lo'] is None:
+            self.stdout.write('No patients.')
+            return
+        partitions = [(lo, lo + size) for lo in range(bounds['lo'], bounds['hi'] + 1, size)]
+
+        checkpoint = options['checkpoint']
+        done = set() if options['restart'] or options['dry_run'] else self._load_checkpoint(checkpoint, size)
+        pending = [p for p in partitions if p[0] not in done]
+        if done:
+            self.stdout.write(f'Resuming: {len(partitions) - len(pending)} of {len(partitions)} partitions already done.')
+
+        scanned = changed = 0
+        completed = len(partitions) - len(pending)
+        for lo, hi, n_scanned, n_changed in self._run(pending, options):
+            scanned += n_scanned
+            changed += n_changed
+            completed += 1
+            if not options['dry_run']:
+                done.add(lo)
+                self._save_checkpoint(checkpoint, size, done)
+            self.stdout.write(
+                f'[{completed}/{len(partitions)}] pk {lo}-{hi - 1}: {n_scanned} scanned, {n_changed} changed'
+            )
+
+        verb = 'would change' if options['dry_run'] else 'changed'
+        self.stdout.write(self.style.SUCCESS(f'Done: {scanned} patients scanned, {changed} {verb}.'))
+        if not options['dry_run'] and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def _run(self, partitions, options):
+        args = (options['batch_size'], options['dry_run'])
+        if options['workers'] <= 1:
+            for lo, hi in partitions:
+                yield recompute_partition(lo, hi, *args)
+            return
+
+        # Never share the parent's connections with forked workers.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            futures = [pool.submit(recompute_partition, lo, hi, *args) for lo, hi in partitions]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _load_checkpoint(self, path, partition_size):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return set()
+        if state.get('partition_size') != partition_size:
+            self.stderr.write('Checkpoint was written with another --partition-size; starting over.')
+            return set()
+        return set(state['done'])
+
+    def _save_checkpoint(self, path, partition_size, done):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'partition_size': partition_size, 'done': sorted(done)}, f)
+        os.replace(tmp, path)
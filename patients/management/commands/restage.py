@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the stored ISS, R-ISS and R2-ISS stages of every patient, e.g. after '
+        'changing engine.staging. Only patients whose stages change are written.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Changed patients written per transaction.')
+
+    def handle(self, *args, **options):
+        scanned, changed = Patient.objects.all().restage(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done: {scanned} patients scanned, {changed} restaged.'))
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import signal
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from patients import jobs
+
+
+def _worker(poll_interval, burst):
+    # As in recompute_flags: set Django up under "spawn", and open our own
+    # connections either way.
+    if not apps.ready:
+        django.setup()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    # Finish the job at hand, then exit.
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    jobs.work(poll_interval=poll_interval, burst=burst, stop=lambda: stopping)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background job workers. Each worker process claims queued jobs from the '
+        'database and runs them one at a time; on SIGTERM or SIGINT they finish the '
+        'job at hand and exit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--poll-interval', type=float, default=jobs.POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        args = (options['poll_interval'], options['burst'])
+        if options['workers'] <= 1:
+            _worker(*args)
+            return
+
+        # Never share the parent's connections with forked workers.
+        connections.close_all()
+        processes = [multiprocessing.Process(target=_worker, args=args) for _ in range(options['workers'])]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Started {len(processes)} workers.')
+
+        def forward(signum, frame):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signum)
+
+        signal.signal(signal.SIGTERM, forward)
+        # Ctrl-C already reaches the workers through the process group.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.join()
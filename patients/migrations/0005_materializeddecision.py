@@ -0,0 +1,29 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_patient_absolute_neutrophile_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializedDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('staging', 'Staging'), ('next_tests', 'Next tests'), ('consensus', 'Consensus treatment recommendations'), ('nice', 'NICE treatment recommendations')], max_length=20)),
+                ('payload', models.JSONField()),
+                ('stale', models.BooleanField(default=False)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='decisions', to='patients.patient')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='materializeddecision',
+            constraint=models.UniqueConstraint(fields=('patient', 'kind'), name='unique_decision_per_patient_kind'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def backfill_latest_diagnostic(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    Diagnostic = apps.get_model('patients', 'Diagnostic')
+    latest = Diagnostic.objects.filter(
+        patient=models.OuterRef('pk')
+    ).order_by('-date', '-pk').values('pk')[:1]
+
+    # Walk the patients in primary key ranges, one UPDATE (and commit) per chunk.
+    last_pk = 0
+    while True:
+        pks = list(
+            Patient.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BACKFILL_CHUNK_SIZE]
+        )
+        if not pks:
+            break
+        Patient.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).update(latest_diagnostic=models.Subquery(latest))
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('patients', '0005_materializeddecision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='latest_diagnostic',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='patients.diagnostic'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnostic',
+            index=models.Index(fields=['patient', 'date'], name='diagnostic_patient_date_idx'),
+        ),
+        migrations.RunPython(backfill_latest_diagnostic, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+from itertools import groupby
+
+BACKFILL_CHUNK_SIZE = 1000
+
+# engine.kinetics as of this migration, frozen so that later rule changes
+# don't change what it backfills: IMWG progression is a rise from nadir of
+# at least 25 % and 0.5 g/dL; the slope is in g/dL per 30 days, smoothed
+# with weight 0.5 on the newest interval.
+RELATIVE_RISE = 0.25
+ABSOLUTE_RISE = 0.5
+SLOPE_PERIOD_DAYS = 30
+SLOPE_SMOOTHING = 0.5
+
+
+def summarize(results):
+    """MonitoringSummary field values of date-ordered ``(date, m_protein)`` pairs, as kinetics.from_history()."""
+    summary = {'count': 0, 'slope': None, 'consecutive_progression': 0}
+    for date, value in results:
+        if summary['count']:
+            days = (date - summary['last_date']).days
+            if days:
+                interval = (value - summary['last_m_protein']) * SLOPE_PERIOD_DAYS / days
+                summary['slope'] = interval if summary['slope'] is None else (
+                    SLOPE_SMOOTHING * interval + (1 - SLOPE_SMOOTHING) * summary['slope']
+                )
+            if value < summary['nadir_m_protein']:
+                summary['nadir_m_protein'], summary['nadir_date'] = value, date
+            rise = value - summary['nadir_m_protein']
+            progression = rise >= ABSOLUTE_RISE and rise >= RELATIVE_RISE * summary['nadir_m_protein']
+            summary['consecutive_progression'] = summary['consecutive_progression'] + 1 if progression else 0
+        else:
+            summary['nadir_m_protein'], summary['nadir_date'] = value, date
+        summary['count'] += 1
+        summary['last_m_protein'], summary['last_date'] = value, date
+    return summary
+
+
+def backfill_monitoring_summaries(apps, schema_editor):
+    Monitoring = apps.get_model('patients', 'Monitoring')
+    MonitoringSummary = apps.get_model('patients', 'MonitoringSummary')
+    rows = (
+        Monitoring.objects.filter(m_protein__isnull=False)
+        .order_by('patient', 'date', 'pk')
+        .values_list('patient', 'date', 'm_protein')
+        .iterator(chunk_size=BACKFILL_CHUNK_SIZE)
+    )
+
+    summaries = []
+    for patient_pk, results in groupby(rows, key=lambda row: row[0]):
+        summaries.append(MonitoringSummary(
+            patient_id=patient_pk, **summarize((date, value) for _, date, value in results)
+        ))
+        if len(summaries) == BACKFILL_CHUNK_SIZE:
+            MonitoringSummary.objects.bulk_create(summaries)
+            summaries = []
+    MonitoringSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_patient_latest_diagnostic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonitoringSummary',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='monitoring_summary', serialize=False, to='patients.patient')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('nadir_m_protein', models.FloatField(null=True)),
+                ('nadir_date', models.DateField(null=True)),
+                ('last_m_protein', models.FloatField(null=True)),
+                ('last_date', models.DateField(null=True)),
+                ('slope', models.FloatField(null=True)),
+                ('consecutive_progression', models.PositiveSmallIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='monitoring',
+            index=models.Index(fields=['patient', 'date'], name='monitoring_patient_date_idx'),
+        ),
+        migrations.RunPython(backfill_monitoring_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:22
+
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+BACKFILL_CHUNK_SIZE = 1000
+
+# engine.cytogenetics.VOCABULARY as of this migration, frozen so that later
+# vocabulary changes don't change what it does:
+# (bit, code, name, high_risk, aliases)
+VOCABULARY = (
+    (0, 'del17p', 'Deletion 17p', True, ('del(17p)', '17p-')),
+    (1, 't(4;14)', 'Translocation t(4;14)', True, ()),
+    (2, 't(14;16)', 'Translocation t(14;16)', True, ()),
+    (3, 't(14;20)', 'Translocation t(14;20)', False, ()),
+    (4, 't(11;14)', 'Translocation t(11;14)', False, ()),
+    (5, 't(6;14)', 'Translocation t(6;14)', False, ()),
+    (6, 'gain1q', 'Gain of 1q', False, ('gain(1q)', '+1q')),
+    (7, 'amp1q', 'Amplification of 1q', False, ('amp(1q)',)),
+    (8, 'del1p', 'Deletion 1p', False, ('del(1p)',)),
+    (9, 'del13q', 'Deletion 13q', False, ('del(13q)', 'monosomy 13')),
+    (10, 'hyperdiploidy', 'Hyperdiploidy', False, ()),
+)
+
+
+def _normalize(text):
+    return ''.join(text.lower().split())
+
+
+BITS = {_normalize(name): bit for bit, code, _, _, aliases in VOCABULARY for name in (code, *aliases)}
+
+
+def marker_bits(cytogenic_markers):
+    """Sorted bits of the vocabulary markers in the comma separated text, as cytogenetics.mask()."""
+    return sorted({BITS[key] for key in map(_normalize, cytogenic_markers.split(',')) if key in BITS})
+
+
+def seed_vocabulary(apps, schema_editor):
+    CytogeneticMarker = apps.get_model('patients', 'CytogeneticMarker')
+    for bit, code, name, high_risk, _ in VOCABULARY:
+        CytogeneticMarker.objects.update_or_create(
+            id=bit, defaults={'code': code, 'name': name, 'high_risk': high_risk}
+        )
+
+
+def backfill_cytogenetic_markers(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    PatientCytogeneticMarker = apps.get_model('patients', 'PatientCytogeneticMarker')
+    MaterializedDecision = apps.get_model('patients', 'MaterializedDecision')
+
+    # One transaction per chunk of patients that have any markers text.
+    # The rules now recognize alias spellings ("17p-", "del(17p)"), which
+    # can change the stored staging and treatment decisions of these
+    # patients: mark them stale. (Patient.version, and with it the ETags,
+    # only appears in 0010.)
+    last_pk = 0
+    while True:
+        rows = list(
+            Patient.objects.filter(pk__gt=last_pk, cytogenic_markers__gt='')
+            .order_by('pk')
+            .values_list('pk', 'cytogenic_markers')[:BACKFILL_CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        bits = {pk: marker_bits(text) for pk, text in rows}
+        with transaction.atomic():
+            Patient.objects.bulk_update(
+                [Patient(pk=pk, cytogenetic_mask=sum(1 << bit for bit in found)) for pk, found in bits.items() if found],
+                ['cytogenetic_mask'],
+            )
+            PatientCytogeneticMarker.objects.bulk_create([
+                PatientCytogeneticMarker(patient_id=pk, marker_id=bit)
+                for pk, found in bits.items()
+                for bit in found
+            ])
+            MaterializedDecision.objects.filter(
+                patient__in=list(bits), kind__in=['staging', 'consensus', 'nice'],
+            ).update(stale=True)
+        last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('patients', '0007_monitoringsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CytogeneticMarker',
+            fields=[
+                ('id', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('code', models.CharField(max_length=20, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('high_risk', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='cytogenetic_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='PatientCytogeneticMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marker', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='patients.cytogeneticmarker')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cytogenetic_markers', to='patients.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['marker', 'patient'], name='marker_patient_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='patientcytogeneticmarker',
+            constraint=models.UniqueConstraint(fields=('patient', 'marker'), name='unique_marker_per_patient'),
+        ),
+        migrations.RunPython(seed_vocabulary, migrations.RunPython.noop),
+        migrations.RunPython(backfill_cytogenetic_markers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:25
+
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+BACKFILL_CHUNK_SIZE = 5000
+
+# engine.units.FACTORS and LAB_FIELDS as of this migration, frozen so that
+# later changes to the converter don't change what it does.
+FACTORS = {
+    ('calcium', 'MG/DL'): 1.0,
+    ('calcium', 'MICROMOLES/L'): 40.078 / 10000,
+    ('creatinine', 'MG/DL'): 1.0,
+    ('creatinine', 'MICROMOLES/L'): 1 / 88.4,
+    ('hemoglobin', 'G/DL'): 1.0,
+    ('hemoglobin', 'G/L'): 0.1,
+    ('bilirubin', 'MG/DL'): 1.0,
+    ('bilirubin', 'MICROMOLES/L'): 1 / 17.1,
+    ('cell_count', 'CELLS/UL'): 1.0,
+    ('cell_count', 'CELLS/L'): 1e-6,
+}
+LAB_FIELDS = {
+    'serum_calcium_level': 'calcium',
+    'serum_creatinine_level': 'creatinine',
+    'hemoglobin_level': 'hemoglobin',
+    'serum_bilirubin_level_total': 'bilirubin',
+    'serum_bilirubin_level_direct': 'bilirubin',
+    'absolute_neutrophile_count': 'cell_count',
+    'platelet_count': 'cell_count',
+    'white_blood_cell_count': 'cell_count',
+    'red_blood_cell_count': 'cell_count',
+}
+
+
+def canonical_value(name, quantity):
+    """SQL expression for the canonical value of lab field ``name``, as engine.units.convert()."""
+    units_field = f'{name}_units'
+    value = Cast(name, models.FloatField())
+    return models.Case(
+        models.When(models.Q(**{f'{units_field}__isnull': True}) | models.Q(**{units_field: ''}), then=value),
+        *(
+            models.When(**{f'{units_field}__iexact': unit}, then=value * models.Value(factor))
+            for (q, unit), factor in FACTORS.items() if q == quantity
+        ),
+        default=None,
+        output_field=models.FloatField(),
+    )
+
+
+def non_canonical(name, quantity):
+    """``Q`` of the rows with a value of lab field ``name`` in a unit other than the canonical one."""
+    units_field = f'{name}_units'
+    return models.Q(**{f'{name}__isnull': False}) & models.Q(*(
+        models.Q(**{f'{units_field}__iexact': unit})
+        for (q, unit), factor in FACTORS.items() if q == quantity and factor != 1
+    ), _connector=models.Q.OR)
+
+
+def backfill_canonical_lab_values(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    MaterializedDecision = apps.get_model('patients', 'MaterializedDecision')
+    values = {
+        f'{name}_canonical': canonical_value(name, quantity)
+        for name, quantity in LAB_FIELDS.items()
+    }
+    converted = models.Q(
+        *(non_canonical(name, quantity) for name, quantity in LAB_FIELDS.items()), _connector=models.Q.OR
+    )
+
+    # Convert in SQL, one UPDATE (and commit) per primary key range. The
+    # treatment rules now read the canonical values, so the stored
+    # recommendations of patients with labs in other units are marked
+    # stale. (Patient.version, and with it the ETags, only appears in 0010.)
+    last_pk = 0
+    while True:
+        pks = list(
+            Patient.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BACKFILL_CHUNK_SIZE]
+        )
+        if not pks:
+            break
+        chunk = Patient.objects.filter(pk__gte=pks[0], pk__lte=pks[-1])
+        chunk.update(**values)
+        MaterializedDecision.objects.filter(
+            patient__in=chunk.filter(converted), kind__in=['consensus', 'nice'],
+        ).update(stale=True)
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('patients', '0008_cytogenetic_markers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='absolute_neutrophile_count_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='hemoglobin_level_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='platelet_count_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='red_blood_cell_count_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='serum_bilirubin_level_direct_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='serum_bilirubin_level_total_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='serum_calcium_level_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='serum_creatinine_level_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='white_blood_cell_count_canonical',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_canonical_lab_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_canonical_lab_values'),
+    ]
+
+    # Stored decisions keep version 0 and are evaluated again on their next
+    # read: they were stored without one and may be outdated.
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='materializeddecision',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,165 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:56
+
+from itertools import product
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, Coalesce, Round
+
+BACKFILL_CHUNK_SIZE = 2000
+STAGE_FIELDS = ('iss_stage', 'r_iss_stage', 'r2_iss_stage')
+
+# engine.staging as of this migration, frozen so that later rule changes
+# don't change what it does. Markers are read as a vocabulary bitmask
+# (Patient.cytogenetic_mask, see 0008) instead of parsing the text.
+BETA2_MICROGLOBULIN_LOW = 3.5
+BETA2_MICROGLOBULIN_HIGH = 5.5
+ALBUMIN = 3.5
+LDH = 250
+DEL_17P = 1 << 0
+T_4_14 = 1 << 1
+GAIN_1Q = 1 << 6 | 1 << 7
+HIGH_RISK_MASK = 1 << 0 | 1 << 1 | 1 << 2
+R2_ISS_POINTS = {1: 0, 2: 1, 3: 1.5}
+UNKNOWN = (False, True)
+
+
+def _iss_options(beta2_microglobulin, albumin):
+    if beta2_microglobulin is None:
+        return (1, 2, 3)
+    if beta2_microglobulin >= BETA2_MICROGLOBULIN_HIGH:
+        return (3,)
+    if beta2_microglobulin >= BETA2_MICROGLOBULIN_LOW:
+        return (2,)
+    if albumin is None:
+        return (1, 2)
+    return (1,) if albumin >= ALBUMIN else (2,)
+
+
+def _settle(stage, *options):
+    stages = {stage(*values) for values in product(*options)}
+    return stages.pop() if len(stages) == 1 else None
+
+
+def _r_iss(iss, high_risk, high_ldh):
+    if iss == 1 and not high_risk and not high_ldh:
+        return 1
+    if iss == 3 and (high_risk or high_ldh):
+        return 3
+    return 2
+
+
+def _r2_iss(iss, del_17p, high_ldh, t_4_14, gain_1q):
+    points = R2_ISS_POINTS[iss] + del_17p + high_ldh + t_4_14 + 0.5 * gain_1q
+    if points == 0:
+        return 1
+    if points <= 1:
+        return 2
+    return 3 if points <= 2.5 else 4
+
+
+def stages(beta2_microglobulin, albumin, ldh, markers):
+    """``(iss, r_iss, r2_iss)``; ``markers`` is a vocabulary bitmask, or None when not assessed."""
+    iss = _iss_options(beta2_microglobulin, albumin)
+    high_ldh = UNKNOWN if ldh is None else (ldh > LDH,)
+
+    def has(bits):
+        return UNKNOWN if markers is None else (bool(markers & bits),)
+
+    return (
+        iss[0] if len(iss) == 1 else None,
+        _settle(_r_iss, iss, has(HIGH_RISK_MASK), high_ldh),
+        _settle(_r2_iss, iss, has(DEL_17P), high_ldh, has(T_4_14), has(GAIN_1Q)),
+    )
+
+
+def backfill_staging(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    Diagnostic = apps.get_model('patients', 'Diagnostic')
+    MaterializedDecision = apps.get_model('patients', 'MaterializedDecision')
+
+    def latest(name):
+        return models.Subquery(Diagnostic.objects.filter(pk=models.OuterRef('latest_diagnostic')).values(name)[:1])
+
+    # Staging used to read beta-2 microglobulin and LDH from the latest
+    # Diagnostic: carry them over where the patient has none, then stage
+    # every patient. Staging responses change, so versions are bumped and
+    # stored staging decisions marked stale. One chunk of primary keys per
+    # commit.
+    last_pk = 0
+    while True:
+        pks = list(
+            Patient.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BACKFILL_CHUNK_SIZE]
+        )
+        if not pks:
+            break
+        chunk = Patient.objects.filter(pk__gte=pks[0], pk__lte=pks[-1])
+        chunk.filter(latest_diagnostic__isnull=False).update(
+            beta2_microglobulin=Coalesce('beta2_microglobulin', latest('beta2_microglobulin')),
+            lactate_dehydrogenase_level=Coalesce(
+                'lactate_dehydrogenase_level', Cast(Round(latest('ldh')), models.IntegerField())
+            ),
+        )
+        # Empty markers text counts as not assessed.
+        rows = chunk.values_list(
+            'pk', 'beta2_microglobulin', 'albumin', 'lactate_dehydrogenase_level', 'cytogenic_markers', 'cytogenetic_mask',
+        )
+        Patient.objects.bulk_update(
+            [
+                Patient(pk=pk, **dict(zip(STAGE_FIELDS, stages(b2m, albumin, ldh, mask if text else None))))
+                for pk, b2m, albumin, ldh, text, mask in rows
+            ],
+            STAGE_FIELDS,
+        )
+        chunk.update(version=models.F('version') + 1)
+        MaterializedDecision.objects.filter(patient__in=pks, kind='staging').update(stale=True)
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('patients', '0012_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='albumin',
+            field=models.FloatField(blank=True, help_text='Serum albumin in g/dL', null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='beta2_microglobulin',
+            field=models.FloatField(blank=True, help_text='Serum beta-2 microglobulin in mg/L', null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='iss_stage',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Stage I'), (2, 'Stage II'), (3, 'Stage III'), (4, 'Stage IV')], editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='r2_iss_stage',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Stage I'), (2, 'Stage II'), (3, 'Stage III'), (4, 'Stage IV')], editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='r_iss_stage',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Stage I'), (2, 'Stage II'), (3, 'Stage III'), (4, 'Stage IV')], editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['iss_stage'], name='patient_iss_stage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['r_iss_stage'], name='patient_r_iss_stage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['r2_iss_stage'], name='patient_r2_iss_stage_idx'),
+        ),
+        migrations.RunPython(backfill_staging, migrations.RunPython.noop),
+    ]
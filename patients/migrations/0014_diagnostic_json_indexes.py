@@ -0,0 +1,141 @@
+# Generated by Django 4.2.20 on 2026-10-18 09:03
+
+import math
+from importlib import import_module
+
+from django.db import migrations, models
+
+BACKFILL_CHUNK_SIZE = 2000
+JSON_FIELDS = ('biomarkers', 'cbc', 'imaging_results')
+
+# The marker vocabulary frozen in 0008, so that later vocabulary changes
+# don't change what this migration does.
+_vocabulary = import_module('patients.migrations.0008_cytogenetic_markers')
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _text(value):
+    return value if isinstance(value, str) else None
+
+
+def _list_mask(names):
+    # As cytogenetics.list_mask(): anything but a list, and any non-string
+    # entry, counts as no markers.
+    if not isinstance(names, list):
+        return 0
+    value = 0
+    for name in names:
+        bit = _vocabulary.BITS.get(_vocabulary._normalize(name)) if isinstance(name, str) else None
+        if bit is not None:
+            value |= 1 << bit
+    return value
+
+
+def _get(document, key):
+    return document.get(key) if isinstance(document, dict) else None
+
+
+def backfill_extracted(apps, schema_editor):
+    # As Diagnostic.extract_fields(), one chunk of primary keys per commit.
+    Diagnostic = apps.get_model('patients', 'Diagnostic')
+    last_pk = 0
+    while True:
+        rows = list(
+            Diagnostic.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', *JSON_FIELDS)[:BACKFILL_CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        Diagnostic.objects.bulk_update(
+            [
+                Diagnostic(
+                    pk=pk,
+                    cytogenetic_mask=_list_mask(_get(biomarkers, 'cytogenetics')),
+                    pet_ct=_text(_get(imaging_results, 'pet_ct')),
+                    cbc_hemoglobin=_number(_get(cbc, 'hemoglobin')),
+                    cbc_platelets=_number(_get(cbc, 'platelets')),
+                )
+                for pk, biomarkers, cbc, imaging_results in rows
+            ],
+            ['cytogenetic_mask', 'pet_ct', 'cbc_hemoglobin', 'cbc_platelets'],
+        )
+        last_pk = rows[-1][0]
+
+
+def create_gin_indexes(apps, schema_editor):
+    # GIN indexes serve the jsonb containment (@>) of json_contains(); other
+    # backends have no equivalent. jsonb_path_ops indexes are smaller and
+    # faster than the default operator class, and @> is all they support.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in JSON_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS diagnostic_{field}_gin '
+            f'ON patients_diagnostic USING gin ({field} jsonb_path_ops)'
+        )
+
+
+def drop_gin_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in JSON_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS diagnostic_{field}_gin')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('patients', '0013_staging'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnostic',
+            name='cbc_hemoglobin',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='diagnostic',
+            name='cbc_platelets',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='diagnostic',
+            name='cytogenetic_mask',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='diagnostic',
+            name='pet_ct',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_extracted, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='diagnostic',
+            index=models.Index(condition=models.Q(('cytogenetic_mask__gt', 0)), fields=['cytogenetic_mask'], name='diagnostic_cytogenetics_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnostic',
+            index=models.Index(fields=['pet_ct'], name='diagnostic_pet_ct_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnostic',
+            index=models.Index(fields=['cbc_hemoglobin'], name='diagnostic_cbc_hemoglobin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnostic',
+            index=models.Index(fields=['cbc_platelets'], name='diagnostic_cbc_platelets_idx'),
+        ),
+        migrations.RunPython(create_gin_indexes, drop_gin_indexes),
+    ]
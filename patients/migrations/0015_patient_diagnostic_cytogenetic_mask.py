@@ -0,0 +1,63 @@
+# Generated by Django 4.2.20 on 2026-10-18 09:45
+
+from importlib import import_module
+
+from django.db import migrations, models, transaction
+
+BACKFILL_CHUNK_SIZE = 2000
+STAGE_FIELDS = ('iss_stage', 'r_iss_stage', 'r2_iss_stage')
+
+# The staging rules frozen in 0013, which this change leaves as they are:
+# only their cytogenetics input now includes the latest Diagnostic's markers.
+stages = import_module('patients.migrations.0013_staging').stages
+
+
+def backfill_diagnostic_markers(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    MaterializedDecision = apps.get_model('patients', 'MaterializedDecision')
+
+    # Only patients whose latest Diagnostic lists a vocabulary marker change:
+    # their stages are recomputed with both sources of markers, and since
+    # the staging response reads the markers too, their versions are bumped
+    # and stored decisions marked stale. One chunk of primary keys per
+    # transaction.
+    last_pk = 0
+    while True:
+        rows = list(
+            Patient.objects.filter(pk__gt=last_pk, latest_diagnostic__cytogenetic_mask__gt=0)
+            .order_by('pk')
+            .values_list(
+                'pk', 'beta2_microglobulin', 'albumin', 'lactate_dehydrogenase_level',
+                'cytogenic_markers', 'cytogenetic_mask', 'latest_diagnostic__cytogenetic_mask',
+            )[:BACKFILL_CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        updated = []
+        for pk, b2m, albumin, ldh, text, mask, diagnostic_mask in rows:
+            staged = stages(b2m, albumin, ldh, (mask if text else 0) | diagnostic_mask)
+            updated.append(Patient(pk=pk, diagnostic_cytogenetic_mask=diagnostic_mask, **dict(zip(STAGE_FIELDS, staged))))
+        pks = [row[0] for row in rows]
+        with transaction.atomic():
+            Patient.objects.bulk_update(updated, ['diagnostic_cytogenetic_mask', *STAGE_FIELDS])
+            Patient.objects.filter(pk__in=pks).update(version=models.F('version') + 1)
+            MaterializedDecision.objects.filter(patient__in=pks).update(stale=True)
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('patients', '0014_diagnostic_json_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='diagnostic_cytogenetic_mask',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_diagnostic_markers, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,14 @@
-from django.db import models
+import copy
+import math
+from collections import defaultdict
+
+from django.core.exceptions import FieldError
+from django.db import NotSupportedError, connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.db.models.query import ModelIterable
+
+from .engine import cytogenetics, kinetics, staging, treatment, units
 
 
 class GenderChoices(models.TextChoices):
@@ -45,6 +55,115 @@ class SerumCalciumUnits(models.TextChoices):
     MICROMOLES_L = 'MICROMOLES/L', 'micromoles/L'
 
 
+# Stored stages, in the order of engine.staging.stages()
+STAGE_FIELDS = ('iss_stage', 'r_iss_stage', 'r2_iss_stage')
+
+# Fields read by the decision endpoints: the treatment rules' manifest, the
+# stages and their inputs (beta-2 microglobulin is also read by next tests),
+# plus the identifiers, the version the decisions are stored with and the
+# latest-diagnostic biomarkers used by next tests.
+DECISION_PATIENT_FIELDS = tuple(dict.fromkeys(
+    ('patient_id', 'version', 'latest_diagnostic') + treatment.FIELDS + STAGE_FIELDS + staging.FIELDS
+))
+DECISION_DIAGNOSTIC_FIELDS = ('patient', 'date', 'biomarkers')
+
+
+class DecisionProjectionError(FieldError):
+    """A decision projection was asked for a field outside its manifest."""
+
+
+class DecisionProjectionIterable(ModelIterable):
+
+    def __iter__(self):
+        for patient in super().__iter__():
+            patient._decision_projection = True
+            yield patient
+
+
+class PatientQuerySet(models.QuerySet):
+
+    def with_latest_diagnostic(self):
+        """Fetch each patient's latest Diagnostic in the same query."""
+        return self.select_related('latest_diagnostic')
+
+    def restage(self, batch_size=1000):
+        """Recompute the stored stages of the patients in this queryset, in one pass.
+
+        Streams just the staging inputs and writes the patients whose stages
+        changed, ``batch_size`` at a time, bumping their versions and marking
+        their stored decisions stale. Stages take few distinct values, so
+        each batch is one UPDATE per combination of new stages. save() keeps
+        the stages current; this is for rows written around it and for
+        changes to ``engine.staging``. Returns ``(scanned, changed)``.
+        """
+        rows = self.order_by('pk').values_list('pk', *STAGE_FIELDS, *staging.FIELDS)
+        scanned = changed = 0
+        batch = defaultdict(list)   # new stages -> pks
+
+        def flush():
+            with transaction.atomic():
+                for stages, pks in batch.items():
+                    Patient.objects.filter(pk__in=pks).update(
+                        version=models.F('version') + 1, **dict(zip(STAGE_FIELDS, stages))
+                    )
+                MaterializedDecision.objects.filter(
+                    patient__in=[pk for pks in batch.values() for pk in pks]
+                ).update(stale=True)
+            batch.clear()
+
+        pending = 0
+        for pk, *values in rows.iterator(chunk_size=batch_size):
+            scanned += 1
+            stages = staging.stages(*values[len(STAGE_FIELDS):])
+            if stages == tuple(values[:len(STAGE_FIELDS)]):
+                continue
+            batch[stages].append(pk)
+            changed += 1
+            pending += 1
+            if pending == batch_size:
+                flush()
+                pending = 0
+        if pending:
+            flush()
+        return scanned, changed
+
+    def sync_diagnostic_markers(self):
+        """Copy the markers of each patient's latest Diagnostic, restaging the patients whose markers changed.
+
+        The Diagnostic signals do this for every write; bulk writes must
+        call it themselves. Returns the number of patients updated.
+        """
+        latest_mask = Coalesce(
+            models.Subquery(
+                Diagnostic.objects.filter(pk=models.OuterRef('latest_diagnostic')).values('cytogenetic_mask')[:1]
+            ),
+            0,
+        )
+        pks = list(
+            self.alias(latest_mask=latest_mask)
+            .exclude(diagnostic_cytogenetic_mask=models.F('latest_mask'))
+            .values_list('pk', flat=True)
+        )
+        if pks:
+            changed = Patient.objects.filter(pk__in=pks)
+            changed.update(diagnostic_cytogenetic_mask=latest_mask)
+            changed.restage()
+        return len(pks)
+
+    def for_decisions(self):
+        """Load only the columns the decision rules read, with the latest Diagnostic.
+
+        Reading any other field of the returned patients raises
+        DecisionProjectionError instead of silently querying for it.
+        """
+        qs = self.with_latest_diagnostic().only(
+            *DECISION_PATIENT_FIELDS,
+            *(f'latest_diagnostic__{name}' for name in DECISION_DIAGNOSTIC_FIELDS)
+        )
+        qs._iterable_class = DecisionProjectionIterable
+        return qs
+
+
 class Patient(models.Model):
     patient_id = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=100)
@@ -101,6 +220,9 @@ class Patient(models.Model):
 
     # Myeloma related
     cytogenic_markers = models.TextField(blank=True, null=True)  # csv
+    # Vocabulary markers found in cytogenic_markers, one bit each (see
+    # engine.cytogenetics); derived on save, mirrored in PatientCytogeneticMarker.
+    cytogenetic_mask = models.BigIntegerField(default=0, editable=False)
     molecular_markers = models.TextField(blank=True, null=True)  # csv
     stem_cell_transplant_history = models.JSONField(blank=True, null=True, default=list)
     plasma_cell_leukemia = models.BooleanField(blank=True, null=True, default=True)
@@ -243,11 +365,38 @@ class Patient(models.Model):
     monoclonal_protein_serum = models.DecimalField(decimal_places=2, max_digits=10, blank=True, null=True)
     monoclonal_protein_urine = models.DecimalField(decimal_places=2, max_digits=10, blank=True, null=True)
     lactate_dehydrogenase_level = models.IntegerField(blank=True, null=True)
+    beta2_microglobulin = models.FloatField(help_text="Serum beta-2 microglobulin in mg/L", blank=True, null=True)
+    albumin = models.FloatField(help_text="Serum albumin in g/dL", blank=True, null=True)
     pulmonary_function_test_result = models.BooleanField(blank=False, null=False, default=False)
     bone_imaging_result = models.BooleanField(blank=False, null=False, default=False)
     clonal_plasma_cells = models.IntegerField(blank=True, null=True)
+    clonal_bone_marrow_plasma_cells_percentage = models.DecimalField(decimal_places=2, max_digits=10, blank=True, null=True)
     ejection_fraction = models.IntegerField(blank=True, null=True)
 
+    # Lab values above converted from their *_units to the canonical units of
+    # engine.units (mg/dL, g/dL, cells/uL); derived on save.
+    serum_calcium_level_canonical = models.FloatField(editable=False, blank=True, null=True)
+    serum_creatinine_level_canonical = models.FloatField(editable=False, blank=True, null=True)
+    hemoglobin_level_canonical = models.FloatField(editable=False, blank=True, null=True)
+    serum_bilirubin_level_total_canonical = models.FloatField(editable=False, blank=True, null=True)
+    serum_bilirubin_level_direct_canonical = models.FloatField(editable=False, blank=True, null=True)
+    absolute_neutrophile_count_canonical = models.FloatField(editable=False, blank=True, null=True)
+    platelet_count_canonical = models.FloatField(editable=False, blank=True, null=True)
+    white_blood_cell_count_canonical = models.FloatField(editable=False, blank=True, null=True)
+    red_blood_cell_count_canonical = models.FloatField(editable=False, blank=True, null=True)
+
+    # ISS, R-ISS and R2-ISS (see engine.staging) of the labs and cytogenetic
+    # markers above; derived on save, null when the known values don't
+    # settle the stage.
+    iss_stage = models.PositiveSmallIntegerField(
+        choices=list(staging.LABELS.items()), editable=False, blank=True, null=True
+    )
+    r_iss_stage = models.PositiveSmallIntegerField(
+        choices=list(staging.LABELS.items()), editable=False, blank=True, null=True
+    )
+    r2_iss_stage = models.PositiveSmallIntegerField(
+        choices=list(staging.LABELS.items()), editable=False, blank=True, null=True
+    )
 
     # --------------
     # Behavior block
@@ -275,9 +424,286 @@ class Patient(models.Model):
     remission_duration_min = models.TextField(blank=True, null=True)  # str for now
     washout_period_duration = models.TextField(blank=True, null=True)  # str for now
 
+    # Pointer to the most recent Diagnostic, kept up to date on every insert
+    # and delete so the decision endpoints can join it instead of sorting.
+    latest_diagnostic = models.ForeignKey(
+        'Diagnostic',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        editable=False,
+        related_name='+'
+    )
+
+    # The markers of the latest Diagnostic's biomarkers (its cytogenetic_mask),
+    # copied along with the pointer; staging counts them with cytogenic_markers.
+    diagnostic_cytogenetic_mask = models.PositiveIntegerField(default=0, editable=False)
+
+    # Incremented by every write to the patient or its Diagnostic and
+    # Monitoring rows (see bump_versions); the decision endpoints derive
+    # their ETags from it.
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    # Columns that Patient.save() leaves to the code maintaining them.
+    MANAGED_FIELDS = ('latest_diagnostic', 'diagnostic_cytogenetic_mask', 'version')
+
+    # Columns computed from other fields: name -> (source fields, function of their values).
+    DERIVED_FIELDS = {
+        'cytogenetic_mask': (('cytogenic_markers',), cytogenetics.mask),
+        **{
+            units.canonical_field(name): ((name, units.units_field(name)), units.converter(quantity))
+            for name, quantity in units.LAB_FIELDS.items()
+        },
+        'iss_stage': (staging.FIELDS[:2], staging.iss),
+        'r_iss_stage': (staging.FIELDS, staging.r_iss),
+        'r2_iss_stage': (staging.FIELDS, staging.r2_iss),
+    }
+
+    objects = PatientQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Cohort filters (see analytics.stats); disease is nearly constant and not worth one.
+            models.Index(fields=['country', 'region'], name='patient_country_region_idx'),
+            models.Index(fields=['region'], name='patient_region_idx'),
+            models.Index(fields=['stage'], name='patient_stage_idx'),
+            # Cohort staging queries read the stored stages
+            models.Index(fields=['iss_stage'], name='patient_iss_stage_idx'),
+            models.Index(fields=['r_iss_stage'], name='patient_r_iss_stage_idx'),
+            models.Index(fields=['r2_iss_stage'], name='patient_r2_iss_stage_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # Deferred fields are loaded through here on first access.
+        if getattr(self, '_decision_projection', False) and fields is not None:
+            outside = set(fields) - set(DECISION_PATIENT_FIELDS) - {'id'}
+            if outside:
+                raise DecisionProjectionError(
+                    f'{", ".join(sorted(outside))} is not in the decision projection; '
+                    f'add it to the fields a rule declares.'
+                )
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot(
+            f.attname for f in self._meta.concrete_fields
+            if fields is None or f.name in fields or f.attname in fields
+        )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot(field_names)
+        return instance
+
+    def _snapshot(self, attnames):
+        # Remember the current values of the loaded ``attnames`` as clean.
+        # JSON values are copied so that changes made in place are noticed.
+        current = self.__dict__
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for name in attnames:
+            if name in current:
+                value = current[name]
+                loaded[name] = copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+    def changed_fields(self):
+        """Names of the columns changed since the instance was loaded or last saved.
+
+        Columns that were never loaded (deferred) count as changed once
+        they are assigned. Instances that weren't loaded from the database
+        report every assigned column.
+        """
+        current = self.__dict__
+        loaded = current.get('_loaded_values', {})
+        return [
+            f.name for f in self._meta.concrete_fields
+            if not f.primary_key and f.attname in current
+            and (f.attname not in loaded or current[f.attname] != loaded[f.attname])
+        ]
+
+    def derive_fields(self, names=None):
+        """Recompute ``DERIVED_FIELDS`` (or just ``names``) from their sources.
+
+        save() does this; bulk writes must call it themselves.
+        """
+        for name in self.DERIVED_FIELDS if names is None else names:
+            sources, function = self.DERIVED_FIELDS[name]
+            setattr(self, name, function(*(getattr(self, source) for source in sources)))
+
+    def save(self, *args, **kwargs):
+        # Derive what can be derived without loading deferred sources, and
+        # write derived columns along with any of their sources.
+        deferred = self.get_deferred_fields()
+        derived = [name for name, (sources, _) in self.DERIVED_FIELDS.items() if deferred.isdisjoint(sources)]
+        self.derive_fields(derived)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {
+                *update_fields,
+                *(name for name in derived if not set(self.DERIVED_FIELDS[name][0]).isdisjoint(update_fields)),
+            }
+
+        # Write only the columns that changed since the instance was loaded,
+        # and nothing at all if none did. latest_diagnostic is maintained by
+        # Diagnostic writes (see signals); never overwrite it with the value
+        # loaded alongside this instance.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            if '_loaded_values' in self.__dict__:
+                changed = [name for name in self.changed_fields() if name not in self.MANAGED_FIELDS]
+            else:
+                deferred = self.get_deferred_fields()
+                changed = [
+                    f.name for f in self._meta.concrete_fields
+                    if not f.primary_key and f.name not in self.MANAGED_FIELDS and f.attname not in deferred
+                ]
+            if not changed:
+                return
+            kwargs['update_fields'] = changed
+
+        # Bump the version in SQL so that concurrent writes can't reuse one.
+        # Its new value isn't known here; it is reloaded if read.
+        bump = not self._state.adding and kwargs['update_fields']
+        if bump:
+            self.version = models.F('version') + 1
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+
+        if bump:
+            del self.__dict__['version']
+            self.__dict__.get('_loaded_values', {}).pop('version', None)
+        update_fields = kwargs.get('update_fields')
+        self._snapshot(
+            f.attname for f in self._meta.concrete_fields
+            if update_fields is None or f.name in update_fields or f.attname in update_fields
+        )
+
+    @classmethod
+    def bump_versions(cls, pks):
+        """Increment the version of the patients ``pks`` after writing their related rows."""
+        cls.objects.filter(pk__in=pks).update(version=models.F('version') + 1)
+
+
+class CytogeneticMarker(models.Model):
+    """A marker of the cytogenetics vocabulary; ``id`` is its bit in ``Patient.cytogenetic_mask``."""
+    id = models.PositiveSmallIntegerField(primary_key=True)
+    code = models.CharField(max_length=20, unique=True)
+    name = models.CharField(max_length=100)
+    high_risk = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.code
+
+
+class PatientCytogeneticMarker(models.Model):
+    """A vocabulary marker found in a patient's ``cytogenic_markers``, for indexed cohort queries."""
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='cytogenetic_markers')
+    marker = models.ForeignKey(CytogeneticMarker, on_delete=models.PROTECT, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'marker'], name='unique_marker_per_patient'),
+        ]
+        indexes = [
+            models.Index(fields=['marker', 'patient'], name='marker_patient_idx'),
+        ]
+
+    @classmethod
+    def sync(cls, masks):
+        """Make the rows of every patient pk in ``masks`` match its ``cytogenetic_mask``."""
+        if not masks:
+            return
+        existing = defaultdict(set)
+        for patient_pk, marker_pk in cls.objects.filter(patient__in=masks).values_list('patient', 'marker'):
+            existing[patient_pk].add(marker_pk)
+
+        removed = models.Q()
+        added = []
+        for patient_pk, mask in masks.items():
+            wanted = set(cytogenetics.bits(mask))
+            have = existing[patient_pk]
+            if have - wanted:
+                removed |= models.Q(patient=patient_pk, marker__in=have - wanted)
+            added += [cls(patient_id=patient_pk, marker_id=bit) for bit in wanted - have]
+        if removed:
+            cls.objects.filter(removed).delete()
+        if added:
+            cls.objects.bulk_create(added)
+
+
+def _json_number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _json_text(value):
+    return value if isinstance(value, str) else None
+
+
+def _json_path(keys):
+    return '$' + ''.join('."{}"'.format(str(key).replace('"', '\\"')) for key in keys)
+
+
+def _json_conditions(connection, model, field, keys, value):
+    """Conditions for ``field @> value`` below ``keys``, for backends without ``@>``."""
+    if isinstance(value, dict):
+        return [
+            condition
+            for key, item in value.items()
+            for condition in _json_conditions(connection, model, field, (*keys, key), item)
+        ]
+    if isinstance(value, list):
+        column = f'{connection.ops.quote_name(model._meta.db_table)}.{connection.ops.quote_name(field)}'
+        conditions = []
+        for item in value:
+            if isinstance(item, (dict, list)):
+                raise NotSupportedError('Containment of objects or lists inside lists needs PostgreSQL.')
+            conditions.append(RawSQL(
+                f'EXISTS (SELECT 1 FROM json_each({column}, %s) WHERE value = %s)',
+                (_json_path(keys), item),
+                output_field=models.BooleanField(),
+            ))
+        return conditions
+    return [models.Q(**{'__'.join((field, *keys)): value})]
+
+
+class DiagnosticQuerySet(models.QuerySet):
+
+    def with_cytogenetics(self, codes, match='any'):
+        """Diagnostics whose ``biomarkers['cytogenetics']`` list any of the markers ``codes``.
+
+        ``match='all'`` requires every one. Tests the extracted
+        ``cytogenetic_mask`` within its partial index instead of parsing
+        the JSON; raises KeyError for a code outside the vocabulary.
+        """
+        mask = cytogenetics.mask_of(codes)
+        matched = models.Q(marker_bits=mask) if match == 'all' else models.Q(marker_bits__gt=0)
+        return (
+            self.filter(cytogenetic_mask__gt=0)
+            .alias(marker_bits=models.F('cytogenetic_mask').bitand(mask))
+            .filter(matched)
+        )
+
+    def json_contains(self, field, value):
+        """Rows whose JSON ``field`` contains ``value``, as PostgreSQL's ``@>`` has it.
+
+        For example ``json_contains('biomarkers', {'cytogenetics': ['del(17p)']})``.
+        On PostgreSQL this is the ``contains`` lookup, served by the field's
+        GIN index. Elsewhere ``value`` is matched key by key, and its lists
+        element by element (scalars only), with the JSON1 functions of
+        SQLite, which parse every row: fine for local tests only.
+        """
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            return self.filter(**{f'{field}__contains': value})
+        column = self.model._meta.get_field(field).column
+        return self.filter(*_json_conditions(connection, self.model, column, (), value))
+
 
 class Diagnostic(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
@@ -290,6 +716,66 @@ class Diagnostic(models.Model):
     biomarkers = models.JSONField(default=dict)
     date = models.DateField(auto_now_add=True)
 
+    # Hot keys of the JSON fields, extracted on save so that queries on them
+    # read an indexed column instead of parsing every document. On
+    # PostgreSQL the JSON fields also have GIN indexes (see json_contains).
+    cytogenetic_mask = models.PositiveIntegerField(default=0, editable=False)
+    pet_ct = models.TextField(blank=True, null=True, editable=False)
+    cbc_hemoglobin = models.FloatField(blank=True, null=True, editable=False)
+    cbc_platelets = models.FloatField(blank=True, null=True, editable=False)
+
+    # Extracted columns: name -> (JSON field, key, function of the key's value).
+    EXTRACTED_FIELDS = {
+        'cytogenetic_mask': ('biomarkers', 'cytogenetics', cytogenetics.list_mask),
+        'pet_ct': ('imaging_results', 'pet_ct', _json_text),
+        'cbc_hemoglobin': ('cbc', 'hemoglobin', _json_number),
+        'cbc_platelets': ('cbc', 'platelets', _json_number),
+    }
+
+    objects = DiagnosticQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'date'], name='diagnostic_patient_date_idx'),
+            # Only diagnostics with a vocabulary marker, see with_cytogenetics()
+            models.Index(
+                fields=['cytogenetic_mask'], condition=models.Q(cytogenetic_mask__gt=0),
+                name='diagnostic_cytogenetics_idx',
+            ),
+            models.Index(fields=['pet_ct'], name='diagnostic_pet_ct_idx'),
+            models.Index(fields=['cbc_hemoglobin'], name='diagnostic_cbc_hemoglobin_idx'),
+            models.Index(fields=['cbc_platelets'], name='diagnostic_cbc_platelets_idx'),
+        ]
+
+    @classmethod
+    def latest_for(cls, patient_pk):
+        """Subquery of the latest Diagnostic pk of ``patient_pk`` (or an OuterRef)."""
+        return cls.objects.filter(patient=patient_pk).order_by('-date', '-pk').values('pk')[:1]
+
+    def extract_fields(self, names=None):
+        """Recompute ``EXTRACTED_FIELDS`` (or just ``names``) from the JSON fields.
+
+        save() does this; bulk writes must call it themselves.
+        """
+        for name in self.EXTRACTED_FIELDS if names is None else names:
+            field, key, function = self.EXTRACTED_FIELDS[name]
+            document = getattr(self, field)
+            setattr(self, name, function(document.get(key) if isinstance(document, dict) else None))
+
+    def save(self, *args, **kwargs):
+        # As Patient.save(): extract what doesn't need deferred fields, and
+        # write extracted columns along with their JSON field.
+        deferred = self.get_deferred_fields()
+        extracted = [name for name, (field, _, _) in self.EXTRACTED_FIELDS.items() if field not in deferred]
+        self.extract_fields(extracted)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {
+                *update_fields,
+                *(name for name in extracted if self.EXTRACTED_FIELDS[name][0] in update_fields),
+            }
+        super().save(*args, **kwargs)
+
 
 class Monitoring(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
@@ -297,3 +783,166 @@ class Monitoring(models.Model):
     m_protein = models.FloatField(null=True, blank=True)
     mrD_status = models.CharField(max_length=50)
     symptoms = models.JSONField(default=list)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'date'], name='monitoring_patient_date_idx'),
+        ]
+
+
+class MonitoringSummary(models.Model):
+    """Running M-protein kinetics of a patient, see ``engine.kinetics``.
+
+    Kept up to date by signals on ``Monitoring`` (and explicitly by bulk
+    ingestion) in O(1) per result; results older than the latest one and
+    deletions rebuild it from the patient's history.
+    """
+    patient = models.OneToOneField(
+        Patient, on_delete=models.CASCADE, primary_key=True, related_name='monitoring_summary'
+    )
+    count = models.PositiveIntegerField(default=0)
+    nadir_m_protein = models.FloatField(null=True)
+    nadir_date = models.DateField(null=True)
+    last_m_protein = models.FloatField(null=True)
+    last_date = models.DateField(null=True)
+    slope = models.FloatField(null=True)
+    consecutive_progression = models.PositiveSmallIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def kinetics(self):
+        return kinetics.Kinetics(
+            count=self.count,
+            nadir=self.nadir_m_protein,
+            nadir_date=self.nadir_date,
+            last=self.last_m_protein,
+            last_date=self.last_date,
+            slope=self.slope,
+            consecutive_progression=self.consecutive_progression,
+        )
+
+    @kinetics.setter
+    def kinetics(self, value):
+        self.count = value.count
+        self.nadir_m_protein = value.nadir
+        self.nadir_date = value.nadir_date
+        self.last_m_protein = value.last
+        self.last_date = value.last_date
+        self.slope = value.slope
+        self.consecutive_progression = value.consecutive_progression
+
+    @classmethod
+    def record(cls, patient_pk, results):
+        """Fold ``(date, m_protein)`` pairs into the summary of ``patient_pk``."""
+        results = sorted((r for r in results if r[1] is not None), key=lambda r: r[0])
+        if not results:
+            return
+        with transaction.atomic():
+            summary, _ = cls.objects.select_for_update().get_or_create(patient_id=patient_pk)
+            state = summary.kinetics
+            try:
+                for date, value in results:
+                    state = kinetics.add(state, date, value)
+            except kinetics.OutOfOrderError:
+                state = kinetics.from_history(cls._history(patient_pk))
+            summary.kinetics = state
+            summary.save()
+
+    @classmethod
+    def rebuild(cls, patient_pk):
+        """Recompute the summary of ``patient_pk`` from all its monitoring results."""
+        state = kinetics.from_history(cls._history(patient_pk))
+        if not state.count:
+            cls.objects.filter(patient_id=patient_pk).delete()
+            return
+        summary = cls(patient_id=patient_pk)
+        summary.kinetics = state
+        summary.save()
+
+    @staticmethod
+    def _history(patient_pk):
+        return (
+            Monitoring.objects.filter(patient=patient_pk, m_protein__isnull=False)
+            .order_by('date', 'pk')
+            .values_list('date', 'm_protein')
+        )
+
+
+class DecisionKind(models.TextChoices):
+    STAGING = 'staging', 'Staging'
+    NEXT_TESTS = 'next_tests', 'Next tests'
+    CONSENSUS = 'consensus', 'Consensus treatment recommendations'
+    NICE = 'nice', 'NICE treatment recommendations'
+
+
+class MaterializedDecision(models.Model):
+    """Precomputed response of a decision endpoint, one row per patient and kind.
+
+    Rows are rewritten whenever the write endpoints change the patient and
+    flagged ``stale`` by signals on any other change, see ``patients.decisions``.
+    A row only answers for the ``Patient.version`` it was computed from.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='decisions')
+    kind = models.CharField(max_length=20, choices=DecisionKind.choices)
+    payload = models.JSONField()
+    stale = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'kind'], name='unique_decision_per_patient_kind'),
+        ]
+
+
+class JobKind(models.TextChoices):
+    RECOMPUTE_FLAGS = 'recompute_flags', 'Recompute CRAB/SLiM flags'
+    EXPORT_DECISIONS = 'export_decisions', 'Export decisions as NDJSON'
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = 'queued', 'Queued'
+    RUNNING = 'running', 'Running'
+    SUCCEEDED = 'succeeded', 'Succeeded'
+    FAILED = 'failed', 'Failed'
+
+
+class Job(models.Model):
+    """A unit of background work, claimed by ``run_workers`` processes (see ``patients.jobs``).
+
+    A running job's ``heartbeat_at`` is refreshed by its worker while it
+    runs; a job whose worker stopped refreshing it for longer than the
+    lease is claimed again, up to ``MAX_ATTEMPTS`` times.
+    """
+    MAX_ATTEMPTS = 3
+
+    kind = models.CharField(max_length=30, choices=JobKind.choices)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(null=True)
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    heartbeat_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+
+class JobResultChunk(models.Model):
+    """Part ``sequence`` of a job's output; the output is the chunks' ``data`` in order."""
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='chunks')
+    sequence = models.PositiveIntegerField()
+    data = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'sequence'], name='unique_chunk_per_job'),
+        ]
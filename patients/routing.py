@@ -0,0 +1,125 @@
+"""Read replicas for the read-heavy GET endpoints.
+
+Every query goes to the ``default`` (primary) database unless it runs in
+a view wrapped by ``replica_reads``: there ``ReplicaRouter`` sends reads
+to one of ``settings.DATABASE_REPLICAS``, picked at random per request so
+that an ETag and the body it describes come from the same replica.
+Writes always go to the primary. The choice lives in a context variable,
+so it holds for async views too (asgiref copies context into the threads
+that run ORM calls).
+
+Replicas lag behind the primary. ``ReadYourWritesMiddleware`` sets a
+cookie on the response to any write request that changed the database.
+For ``READ_YOUR_WRITES_SECONDS`` afterwards that client reads from the
+primary, so it sees its own write. Code that must not act on a stale
+read (such as evaluating and storing decisions) runs under ``primary()``.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PIN_COOKIE = 'read_primary'
+
+_replica = ContextVar('replica_alias', default=None)
+_writes = ContextVar('request_writes', default=None)
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block, even in a ``replica_reads`` view."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def _replica_for(request):
+    # The replica serving every read of ``request``, or None for the primary
+    if settings.DATABASE_REPLICAS and request.method in ('GET', 'HEAD') and PIN_COOKIE not in request.COOKIES:
+        return random.choice(settings.DATABASE_REPLICAS)
+    return None
+
+
+def replica_reads(view):
+    """Serve GET and HEAD requests to ``view`` from a replica, unless the client is pinned."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = _replica.set(_replica_for(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _replica.reset(token)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = _replica.set(_replica_for(request))
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _replica.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Reads from a replica inside ``replica_reads`` views; writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        writes = _writes.get()
+        if writes is not None:
+            writes.append(model._meta.label)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's data: objects relate across them.
+        return True
+
+
+class ReadYourWritesMiddleware:
+    """Pin clients to the primary for ``READ_YOUR_WRITES_SECONDS`` after they write."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        writes = []
+        token = _writes.set(writes)
+        try:
+            response = self.get_response(request)
+        finally:
+            _writes.reset(token)
+        return self._pin(request, response, writes)
+
+    async def __acall__(self, request):
+        writes = []
+        token = _writes.set(writes)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _writes.reset(token)
+        return self._pin(request, response, writes)
+
+    def _pin(self, request, response, writes):
+        # GETs may store computed decisions; only client writes pin.
+        if writes and request.method not in ('GET', 'HEAD', 'OPTIONS') and settings.READ_YOUR_WRITES_SECONDS > 0:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.READ_YOUR_WRITES_SECONDS,
+                secure=request.is_secure(), httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,374 @@
+"""Typed decoding of the write endpoint payloads.
+
+A ``Schema`` lists the keys a payload may carry as ``Field`` rows: the
+attribute each is stored in, its type and whether it may be null or
+missing. At import time every schema is compiled into a single generated
+function that looks each key up once, accepts values that already have
+the right type without calling anything, coerces the rest (numeric
+strings, integral floats, ...), fills in defaults and rejects unknown
+keys. All problems of a payload are reported together in one
+``ValidationError``.
+
+Most fields are derived from the model columns they are stored in
+(``model_field``), so choices, lengths and nullability follow the models.
+"""
+import datetime
+import math
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from .engine import units
+from .models import Monitoring, Patient
+
+MISSING = object()
+
+
+class Field(namedtuple('Field', 'key name kind null default required options')):
+    """Payload key ``key`` stored as ``name``, of type ``kind`` (see ``KINDS``).
+
+    ``default`` (a value or a callable) is used when the key is missing
+    from a full payload; without one, nullable fields default to None
+    and the others are required. ``required`` fields must be present
+    even in partial payloads. ``options`` are passed to the kind's
+    converter (``max_length``, ``choices``, ``blank``, ``places``,
+    ``min_value``, ...).
+    """
+
+    def __new__(cls, key, kind, name=None, null=True, default=MISSING, required=False, **options):
+        return super().__new__(cls, key, name or key, kind, null, default, required, options)
+
+
+# ---------------------------------------------------------------------------
+# Converters, used for values that don't pass a kind's fast check. Each
+# kind has a factory that returns the converter for a field's options; a
+# converter raises ValueError with the message to report.
+
+def int_converter(min_value=None, **options):
+    def parse(value):
+        if type(value) is int:
+            return value
+        if type(value) is float and value.is_integer():
+            return int(value)
+        if type(value) is str:
+            try:
+                return int(value.strip())
+            except ValueError:
+                pass
+        raise ValueError('expected an integer.')
+
+    def convert(value):
+        result = parse(value)
+        if min_value is not None and result < min_value:
+            raise ValueError(f'must be at least {min_value}.')
+        return result
+    return convert
+
+
+def float_converter(**options):
+    def convert(value):
+        if type(value) in (int, float, str):
+            try:
+                result = float(value)
+            except ValueError:
+                pass
+            else:
+                if math.isfinite(result):
+                    return result
+        raise ValueError('expected a number.')
+    return convert
+
+
+def decimal_converter(places=None, max_digits=None, **options):
+    # Values are rounded to ``places`` when saved; only their magnitude is checked here.
+    limit = Decimal(10) ** (max_digits - (places or 0)) if max_digits is not None else None
+
+    def convert(value):
+        if type(value) is str:
+            value = value.strip()
+        elif type(value) not in (int, float):
+            raise ValueError('expected a number.')
+        try:
+            result = Decimal(repr(value) if type(value) is float else value)
+        except InvalidOperation:
+            raise ValueError('expected a number.') from None
+        if not result.is_finite():
+            raise ValueError('expected a number.')
+        if limit is not None and not -limit < result < limit:
+            raise ValueError(f'at most {max_digits - (places or 0)} digits before the decimal point are allowed.')
+        return result
+    return convert
+
+
+def bool_converter(**options):
+    def convert(value):
+        if type(value) is int and value in (0, 1):
+            return bool(value)
+        if type(value) is str and value.lower() in ('true', 'false', '1', '0'):
+            return value.lower() in ('true', '1')
+        raise ValueError('expected true or false.')
+    return convert
+
+
+def str_converter(max_length=None, choices=None, blank=True, **options):
+    def convert(value):
+        if type(value) in (int, float):
+            value = str(value)
+        elif type(value) is not str:
+            raise ValueError('expected a string.')
+        if not blank and not value:
+            raise ValueError('may not be blank.')
+        if max_length is not None and len(value) > max_length:
+            raise ValueError(f'at most {max_length} characters are allowed.')
+        if choices is not None and value not in choices:
+            raise ValueError(f'expected one of: {", ".join(choices)}.')
+        return value
+    return convert
+
+
+def date_converter(**options):
+    def convert(value):
+        if type(value) is str:
+            try:
+                return datetime.date.fromisoformat(value.strip())
+            except ValueError:
+                pass
+        raise ValueError('expected a date (YYYY-MM-DD).')
+    return convert
+
+
+def list_converter(**options):
+    def convert(value):
+        raise ValueError('expected a list.')
+    return convert
+
+
+def unit_converter(quantity=None, **options):
+    def convert(value):
+        if type(value) is not str:
+            raise ValueError('expected a string.')
+        try:
+            units.factor(quantity, value)
+        except units.UnitError as e:
+            raise ValueError(f'{e}.') from None
+        return value.strip().upper()
+    return convert
+
+
+class Kind(namedtuple('Kind', 'fast converter')):
+    """``fast`` is an expression over ``value`` that is true for values to
+    store as they are; other values go through the converter that
+    ``converter`` returns for the field. For fields with ``choices`` the
+    fast check also requires ``value`` to be one of them."""
+
+
+KINDS = {
+    'int': Kind('type(value) is int', int_converter),
+    'float': Kind('type(value) is float and isfinite(value)', float_converter),
+    'decimal': Kind(None, decimal_converter),
+    'bool': Kind('type(value) is bool', bool_converter),
+    'str': Kind('type(value) is str', str_converter),
+    'date': Kind(None, date_converter),
+    'json': Kind('True', None),
+    'list': Kind('type(value) is list', list_converter),
+    'unit': Kind('type(value) is str', unit_converter),
+}
+
+
+def model_field(key, model, name=None, **overrides):
+    """``Field`` for payload key ``key`` stored in the ``model`` column ``name``."""
+    name = name or key
+    field = model._meta.get_field(name)
+    options = {}
+    if name in UNIT_FIELDS:
+        kind, options['quantity'] = 'unit', UNIT_FIELDS[name]
+        options['choices'] = tuple(unit for quantity, unit in units.FACTORS if quantity == UNIT_FIELDS[name])
+    elif isinstance(field, models.DecimalField):
+        kind, options['places'], options['max_digits'] = 'decimal', field.decimal_places, field.max_digits
+    elif isinstance(field, models.IntegerField):
+        kind = 'int'
+    elif isinstance(field, models.FloatField):
+        kind = 'float'
+    elif isinstance(field, models.BooleanField):
+        kind = 'bool'
+    elif isinstance(field, models.DateField):
+        kind = 'date'
+    elif isinstance(field, models.JSONField):
+        kind = 'json'
+    elif isinstance(field, (models.CharField, models.TextField)):
+        kind, options['max_length'], options['blank'] = 'str', field.max_length, field.blank
+        if field.choices:
+            options['choices'] = tuple(value for value, label in field.choices)
+    else:
+        raise TypeError(f'No payload kind for {type(field).__name__} {name}')
+    default = field.default if field.has_default() else MISSING
+    return Field(key, kind, name=name, null=field.null, default=default, **{**options, **overrides})
+
+
+# ---------------------------------------------------------------------------
+# Compilation
+
+class Schema:
+    """A payload format compiled into one decoding function."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+        self.keys = frozenset(field.key for field in self.fields)
+        self.source = self._generate()
+        namespace = {
+            'MISSING': MISSING,
+            'ValidationError': ValidationError,
+            'isfinite': math.isfinite,
+            'unknown': self._unknown,
+        }
+        for index, field in enumerate(self.fields):
+            namespace[f'default_{index}'] = field.default
+            namespace[f'choices_{index}'] = frozenset(field.options.get('choices', ()))
+            converter = KINDS[field.kind].converter
+            if converter is not None:
+                namespace[f'convert_{index}'] = converter(**field.options)
+        exec(compile(self.source, f'<schema {name}>', 'exec'), namespace)
+        self._decode = namespace['decode']
+
+    def decode(self, item, partial=False):
+        """Validate ``item`` and return its values keyed by attribute name.
+
+        A full payload returns every field, with defaults for the missing
+        ones; a ``partial`` one only the fields present in ``item``.
+        Raises ``ValidationError`` listing every problem found.
+        """
+        return self._decode(item, partial)
+
+    def _unknown(self, item):
+        return f'Unknown fields: {", ".join(sorted(map(str, item.keys() - self.keys)))}.'
+
+    def _generate(self):
+        lines = [
+            'def decode(item, partial):',
+            '    if type(item) is not dict:',
+            "        raise ValidationError('Expected a JSON object.')",
+            '    get = item.get',
+            '    values = {}',
+            '    errors = []',
+            '    found = 0',
+        ]
+        for index, field in enumerate(self.fields):
+            lines += [f'    {line}' for line in self._field_source(index, field)]
+        lines += [
+            '    if found != len(item):',
+            '        errors.append(unknown(item))',
+            '    if errors:',
+            '        raise ValidationError(errors)',
+            '    return values',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def _field_source(self, index, field):
+        key, name = repr(field.key), repr(field.name)
+        if field.required:
+            missing = [f'errors.append({field.key + " is required."!r})']
+        else:
+            if field.default is not MISSING:
+                default = f'default_{index}()' if callable(field.default) else f'default_{index}'
+                fill = [f'values[{name}] = {default}']
+            elif field.null:
+                fill = [f'values[{name}] = None']
+            else:
+                fill = [f'errors.append({field.key + " is required."!r})']
+            missing = ['if not partial:', *(f'    {line}' for line in fill)]
+
+        if field.null:
+            null = [f'values[{name}] = None']
+        else:
+            null = [f'errors.append({field.key + " may not be null."!r})']
+
+        kind = KINDS[field.kind]
+        fast = kind.fast
+        if field.options.get('choices'):
+            fast += f' and value in choices_{index}'
+        elif field.kind == 'int' and field.options.get('min_value') is not None:
+            fast += f' and value >= {field.options["min_value"]!r}'
+        elif field.kind == 'str':
+            if not field.options.get('blank', True):
+                fast += ' and value'
+            if field.options.get('max_length'):
+                fast += f' and len(value) <= {field.options["max_length"]}'
+        convert = [
+            'try:',
+            f'    values[{name}] = convert_{index}(value)',
+            'except ValueError as e:',
+            f"    errors.append({field.key + ': '!r} + str(e))",
+        ]
+        if fast is None:
+            coerce = convert
+        elif kind.converter is None:
+            coerce = [f'values[{name}] = value']
+        else:
+            coerce = [f'if {fast}:', f'    values[{name}] = value', 'else:', *(f'    {line}' for line in convert)]
+
+        return [
+            f'value = get({key}, MISSING)',
+            'if value is MISSING:',
+            *(f'    {line}' for line in missing),
+            'else:',
+            '    found += 1',
+            '    if value is None:',
+            *(f'        {line}' for line in null),
+            '    else:',
+            *(f'        {line}' for line in coerce),
+        ]
+
+
+# ---------------------------------------------------------------------------
+# Payloads
+
+# <lab>_units field -> the quantity its unit is for
+UNIT_FIELDS = {units.units_field(name): quantity for name, quantity in units.LAB_FIELDS.items()}
+
+# Fields accepted by the diagnostics endpoints, in payload order.
+DIAGNOSTIC_FIELDS = (
+    'karnofsky_performance_score',
+    'ecog_performance_status',
+    'stem_cell_transplant_history',
+    'cytogenic_markers',
+    'peripheral_neuropathy_grade',
+    'serum_creatinine_level',
+    'serum_creatinine_level_units',
+    'creatinine_clearance_rate',
+    'serum_calcium_level',
+    'serum_calcium_level_units',
+    'hemoglobin_level',
+    'hemoglobin_level_units',
+    'bone_lesions',
+    'bone_imaging_result',
+    'clonal_bone_marrow_plasma_cells_percentage',
+    'kappa_flc',
+    'lambda_flc',
+    'treatment_refractory_status',
+    'progression',
+    'beta2_microglobulin',
+    'albumin',
+    'lactate_dehydrogenase_level',
+)
+
+_diagnostic_fields = [model_field(name, Patient) for name in DIAGNOSTIC_FIELDS]
+
+# Body of POST /patients/<id>/diagnostics
+DIAGNOSTICS = Schema('diagnostics', _diagnostic_fields)
+
+# Item of POST /patients/diagnostics:batch, decoded with partial=True
+DIAGNOSTICS_BATCH_ITEM = Schema('diagnostics batch item', [
+    Field('patient_id', 'str', null=False, required=True, max_length=Patient._meta.get_field('patient_id').max_length),
+    *_diagnostic_fields,
+])
+
+# Body of POST /patients/<id>/monitoring and each line of monitoring:ingest
+MONITORING = Schema('monitoring', [
+    model_field('date', Monitoring),
+    model_field('mProtein', Monitoring, name='m_protein'),
+    model_field('mrDStatus', Monitoring, name='mrD_status'),
+    Field('symptoms', 'list', null=False, default=list),
+])
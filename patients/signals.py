@@ -0,0 +1,57 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import decisions
+from .models import Diagnostic, Monitoring, MonitoringSummary, Patient, PatientCytogeneticMarker
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def invalidate_patient_decisions(sender, instance, **kwargs):
+    decisions.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Patient)
+def sync_cytogenetic_markers(sender, instance, update_fields, **kwargs):
+    if update_fields is None or 'cytogenetic_mask' in update_fields:
+        PatientCytogeneticMarker.sync({instance.pk: instance.cytogenetic_mask})
+
+
+@receiver([post_save, post_delete], sender=Diagnostic)
+@receiver([post_save, post_delete], sender=Monitoring)
+def invalidate_related_decisions(sender, instance, **kwargs):
+    decisions.invalidate([instance.patient_id])
+
+
+@receiver([post_save, post_delete], sender=Diagnostic)
+@receiver([post_save, post_delete], sender=Monitoring)
+def bump_patient_version(sender, instance, **kwargs):
+    Patient.bump_versions([instance.patient_id])
+
+
+@receiver(post_save, sender=Diagnostic)
+def point_to_new_diagnostic(sender, instance, created, **kwargs):
+    # Diagnostic.date is auto_now_add, so an inserted row is always the latest.
+    if created:
+        Patient.objects.filter(pk=instance.patient_id).update(latest_diagnostic=instance)
+    Patient.objects.filter(pk=instance.patient_id).sync_diagnostic_markers()
+
+
+@receiver(post_delete, sender=Diagnostic)
+def repoint_after_delete(sender, instance, **kwargs):
+    Patient.objects.filter(pk=instance.patient_id, latest_diagnostic__isnull=True).update(
+        latest_diagnostic=Diagnostic.latest_for(instance.patient_id)
+    )
+    Patient.objects.filter(pk=instance.patient_id).sync_diagnostic_markers()
+
+
+@receiver(post_save, sender=Monitoring)
+def update_monitoring_summary(sender, instance, created, **kwargs):
+    if created:
+        MonitoringSummary.record(instance.patient_id, [(instance.date, instance.m_protein)])
+    else:
+        MonitoringSummary.rebuild(instance.patient_id)
+
+
+@receiver(post_delete, sender=Monitoring)
+def rebuild_monitoring_summary(sender, instance, **kwargs):
+    MonitoringSummary.rebuild(instance.patient_id)
@@ -0,0 +1,1108 @@
+import datetime
+import json
+import math
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.db import NotSupportedError, connection, router
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+
+from benchmarks.treatment import legacy_treatment_recommendations, random_patient, reference_markers
+
+from . import analytics, async_views, decisions, instrumentation, jobs, routing, schemas
+from .engine import crab_slim, cytogenetics, kinetics, staging, treatment, units
+from .management.commands.recompute_flags import recompute_partition
+from .models import (
+    DecisionKind, Diagnostic, Job, JobKind, JobResultChunk, JobStatus, MaterializedDecision, Monitoring,
+    MonitoringSummary, Patient, PatientCytogeneticMarker,
+)
+
+# The decision endpoints served by their async views, for AsyncViewTests
+urlpatterns = [
+    path('patients/<str:patient_id>/next-tests', async_views.next_tests),
+    path('patients/<str:patient_id>/staging', async_views.staging),
+    path('patients/<str:patient_id>/treatment-recommendations', async_views.treatment_recommendations),
+]
+
+
+def make_patient(patient_id='P100', **fields):
+    return Patient.objects.create(
+        patient_id=patient_id, name=patient_id, date_of_birth=datetime.date(1960, 1, 1), **fields
+    )
+
+
+def post_json(client, path, body, method='post'):
+    return getattr(client, method)(path, json.dumps(body), content_type='application/json')
+
+
+def random_crab_slim_values(rng):
+    """Rule inputs of a random patient, with lab values reported in any unit."""
+    def lab(quantity, *values):
+        value = rng.choice((None,) + values)
+        unit = rng.choice([None] + [u for q, u in units.FACTORS if q == quantity])
+        return units.convert(value, quantity, unit)
+
+    return {
+        'serum_calcium_level_canonical': lab('calcium', 9.5, 11, 11.5, '12.2', 2.5, 3.1),
+        'serum_creatinine_level_canonical': lab('creatinine', Decimal('0.9'), 2, Decimal('2.4'), 150, 250),
+        'creatinine_clearance_rate': rng.choice([None, 25.0, '35', 40, 80.0]),
+        'hemoglobin_level_canonical': lab('hemoglobin', 8, 10, '12.5', 95, 130),
+        'bone_lesions': rng.choice([None, '', '0', 'none', 'None', '1', '2', 'more than 2']),
+        'bone_imaging_result': rng.choice([None, '', 'yes', 'YES', 'no', 'true', 'False']),
+        'clonal_bone_marrow_plasma_cells_percentage': rng.choice([None, 10, 59.9, 60, Decimal('75')]),
+        'kappa_flc': rng.choice([None, 0, 0.5, 10, 100, 2000]),
+        'lambda_flc': rng.choice([None, 0, 0.5, 10, 100, 2000]),
+    }
+
+
+class CrabSlimTests(SimpleTestCase):
+
+    def test_columnar_evaluation_matches_scalar(self):
+        rng = random.Random(0)
+        patients = [random_crab_slim_values(rng) for _ in range(2000)]
+        columns = {name: [values[name] for values in patients] for name in crab_slim.FIELDS}
+        result = crab_slim.evaluate_columns(columns)
+
+        for index, values in enumerate(patients):
+            expected = crab_slim.evaluate(values)
+            criteria = {**expected['crab_criteria'], **expected['slim_criteria']}
+            actual = {name: bool(column[index]) for name, column in result.items()}
+            self.assertEqual(actual, {**criteria, 'meets_crab': expected['meets_crab'],
+                                      'meets_slim': expected['meets_slim']}, values)
+
+    def test_missing_columns_are_unknown(self):
+        result = crab_slim.evaluate_columns({'hemoglobin_level_canonical': [None, 8.0]})
+        self.assertEqual(result['meets_crab'].tolist(), [False, True])
+        self.assertEqual(result['meets_slim'].tolist(), [False, False])
+        self.assertEqual(crab_slim.evaluate({'hemoglobin_level_canonical': None})['meets_crab'], False)
+
+
+class TreatmentTablesTests(SimpleTestCase):
+    """The compiled decision tables give the output of the original if/else rules."""
+
+    def test_tables_match_legacy_rules(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            values = random_patient(rng)
+            legacy_patient = SimpleNamespace(**values)
+            legacy_patient.cytogenic_markers = reference_markers(values['cytogenic_markers'])
+            for framework in ('nice', 'consensus'):
+                self.assertEqual(
+                    treatment.evaluate(values, framework),
+                    legacy_treatment_recommendations(legacy_patient, framework),
+                    (framework, values),
+                )
+
+
+class KineticsTests(SimpleTestCase):
+
+    def day(self, n):
+        return datetime.date(2026, 1, 1) + timedelta(days=n)
+
+    def test_progression_needs_both_rises_from_nadir(self):
+        for nadir, value, expected in (
+            (2.0, 2.5, True),    # +0.5 g/dL and +25 %: both limits exactly
+            (2.0, 2.45, False),  # +22.5 %, under 0.5 g/dL
+            (1.0, 1.5, True),    # +50 %
+            (1.0, 1.4, False),   # +40 %, but only 0.4 g/dL
+            (4.0, 4.5, False),   # +0.5 g/dL, but only 12.5 %
+            (4.0, 5.0, True),    # +25 %
+            (0.0, 0.5, True),    # from an undetectable nadir, the absolute rise decides
+            (0.0, 0.4, False),
+        ):
+            self.assertIs(kinetics.meets_progression(nadir, value), expected, (nadir, value))
+
+    def test_add_tracks_nadir_slope_and_confirmation(self):
+        state = kinetics.EMPTY
+        steps = [
+            (0, 2.0, 2.0, 0.0, 0),
+            (30, 1.0, 1.0, -1.0, 0),
+            (60, None, 1.0, -1.0, 0),     # no M-protein: ignored
+            (60, 1.5, 1.0, -0.25, 1),     # +0.5 from nadir: progression
+            (90, 1.6, 1.0, -0.075, 2),    # confirmed
+            (120, 1.2, 1.0, -0.2375, 0),  # back under the limits
+        ]
+        for day, value, nadir, slope, streak in steps:
+            state = kinetics.add(state, self.day(day), value)
+            self.assertEqual(state.nadir, nadir, day)
+            self.assertAlmostEqual(state.slope or 0.0, slope, msg=day)
+            self.assertEqual(state.consecutive_progression, streak, day)
+        self.assertEqual((state.count, state.nadir_date, state.last), (5, self.day(30), 1.2))
+
+        with self.assertRaises(kinetics.OutOfOrderError):
+            kinetics.add(state, self.day(100), 1.0)
+
+    def test_from_history_sorts_results(self):
+        results = [(self.day(60), 1.5), (self.day(0), 2.0), (self.day(90), None), (self.day(30), 1.0)]
+        state = kinetics.from_history(results)
+        self.assertEqual(state, kinetics.from_history(sorted(results[:2] + results[3:])))
+        self.assertEqual((state.count, state.nadir, state.last, state.consecutive_progression), (3, 1.0, 1.5, 1))
+
+    def test_trend_and_recommendation(self):
+        self.assertEqual(kinetics.trend(kinetics.EMPTY)['progression'], False)
+        self.assertEqual(kinetics.recommendation(kinetics.EMPTY), kinetics.CONTINUE_MAINTENANCE)
+
+        state = kinetics.from_history([(self.day(0), 2.0), (self.day(30), 2.5)])
+        self.assertEqual(kinetics.trend(state), {
+            'change_from_nadir': 0.5,
+            'percent_change_from_nadir': 25.0,
+            'progression': True,
+            'progression_confirmed': False,
+        })
+        self.assertEqual(kinetics.recommendation(state), kinetics.CONFIRM_PROGRESSION)
+        state = kinetics.add(state, self.day(60), 2.6)
+        self.assertTrue(kinetics.trend(state)['progression_confirmed'])
+        self.assertEqual(kinetics.recommendation(state), kinetics.PROGRESSION_CONFIRMED)
+
+
+class MonitoringSummaryTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient()
+
+    def submit(self, date, m_protein):
+        response = post_json(self.client, '/patients/P100/monitoring',
+                             {'date': date, 'mProtein': m_protein, 'mrDStatus': 'positive'})
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_summary_follows_results_in_any_order(self):
+        for date, m_protein in (('2026-01-01', 2.0), ('2026-03-01', 2.5), ('2026-02-01', 1.0)):
+            self.submit(date, m_protein)
+        summary = MonitoringSummary.objects.get(patient=self.patient)
+        self.assertEqual((summary.count, summary.nadir_m_protein, summary.last_m_protein), (3, 1.0, 2.5))
+        self.assertEqual(summary.kinetics, kinetics.from_history(MonitoringSummary._history(self.patient.pk)))
+
+        body = json.loads(self.client.get('/patients/P100/monitoring/trend').content)
+        self.assertEqual(body['nadir'], {'mProtein': 1.0, 'date': '2026-02-01'})
+        self.assertTrue(body['progression'])
+        self.assertFalse(body['progressionConfirmed'])
+        self.assertEqual(body['recommendation'], kinetics.CONFIRM_PROGRESSION)
+
+    def test_deleting_results_rebuilds_the_summary(self):
+        self.submit('2026-01-01', 1.0)
+        self.submit('2026-02-01', 1.5)
+        Monitoring.objects.filter(patient=self.patient).latest('date').delete()
+        summary = MonitoringSummary.objects.get(patient=self.patient)
+        self.assertEqual((summary.count, summary.last_m_protein, summary.consecutive_progression), (1, 1.0, 0))
+
+
+class UnitsTests(SimpleTestCase):
+
+    def test_known_conversions(self):
+        for value, quantity, unit, expected in (
+            (176.8, 'creatinine', 'MICROMOLES/L', 2.0),      # 88.4 umol/L per mg/dL
+            (2.0, 'creatinine', 'MG/DL', 2.0),
+            (2500, 'calcium', 'MICROMOLES/L', 10.0195),      # 2.5 mmol/L
+            (11, 'calcium', None, 11.0),
+            (120, 'hemoglobin', 'G/L', 12.0),
+            ('9.5', 'hemoglobin', ' g/dl ', 9.5),
+            (17.1, 'bilirubin', 'micromoles/l', 1.0),
+            (4.5e9, 'cell_count', 'CELLS/L', 4500.0),
+        ):
+            self.assertAlmostEqual(units.convert(value, quantity, unit), expected, msg=(value, quantity, unit))
+
+    def test_unknown_values_and_units(self):
+        self.assertIsNone(units.convert(None, 'hemoglobin', 'G/L'))
+        self.assertIsNone(units.convert('', 'hemoglobin', 'G/L'))
+        self.assertEqual(units.factor('hemoglobin', ''), 1.0)
+        message = "Unknown unit 'MMOL/L' for hemoglobin; expected one of: G/DL, G/L"
+        with self.assertRaisesMessage(units.UnitError, message):
+            units.factor('hemoglobin', 'MMOL/L')
+        with self.assertRaises(units.UnitError):
+            units.factor('calcium', 'G/L')
+
+    def test_every_unit_choice_has_a_factor(self):
+        for name, quantity in units.LAB_FIELDS.items():
+            for unit, _ in Patient._meta.get_field(units.units_field(name)).choices:
+                self.assertIn((quantity, unit), units.FACTORS, name)
+
+    def test_convert_array(self):
+        values = [120, None, '95', 13.5]
+        converted = units.convert_array(values, 'hemoglobin', ['G/L', 'G/L', 'g/l', None])
+        self.assertEqual(converted[[0, 2, 3]].tolist(), [12.0, 9.5, 13.5])
+        self.assertTrue(math.isnan(converted[1]))
+        self.assertEqual(units.convert_array([1.0, 2.0], 'creatinine', 'MICROMOLES/L').tolist(), [1 / 88.4, 2 / 88.4])
+        with self.assertRaises(units.UnitError):
+            units.convert_array([1.0], 'hemoglobin', ['MG/DL'])
+
+
+class PatientSaveTests(TestCase):
+
+    def setUp(self):
+        make_patient(cytogenic_markers='t(11;14)')
+        self.patient = Patient.objects.get(patient_id='P100')
+
+    def test_changed_fields_tracks_assignments(self):
+        self.assertEqual(self.patient.changed_fields(), [])
+        self.patient.kappa_flc = 40
+        self.patient.stem_cell_transplant_history.append('autologous 2021')
+        self.assertEqual(set(self.patient.changed_fields()), {'kappa_flc', 'stem_cell_transplant_history'})
+
+    def test_unchanged_save_writes_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.patient.save()
+        self.assertEqual(len(queries), 0)
+
+    def test_save_writes_changed_columns_and_bumps_version(self):
+        self.patient.cytogenic_markers = 'del(17p)'
+        with CaptureQueriesContext(connection) as queries:
+            self.patient.save()
+        update = next(q['sql'] for q in queries if q['sql'].startswith('UPDATE "patients_patient"'))
+        self.assertIn('"cytogenic_markers"', update)
+        self.assertIn('"cytogenetic_mask"', update)
+        self.assertNotIn('"name"', update)
+        self.assertEqual(self.patient.version, 2)
+        self.assertEqual(self.patient.changed_fields(), [])
+
+
+class ETagTests(TestCase):
+    """Every write that can change a decision response changes its ETag."""
+
+    def setUp(self):
+        self.patient = make_patient()
+        Diagnostic.objects.create(patient=self.patient, biomarkers={'cytogenetics': ['t(11;14)']})
+
+    def assertRevalidates(self, path, write):
+        first = self.client.get(path)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        write()
+        second = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], etag)
+        return second
+
+    def test_post_diagnostics(self):
+        self.assertRevalidates('/patients/P100/staging', lambda: post_json(
+            self.client, '/patients/P100/diagnostics', {'cytogenic_markers': 'del(17p)'},
+        ))
+
+    def test_patch_diagnostics(self):
+        response = self.assertRevalidates('/patients/P100/treatment-recommendations', lambda: post_json(
+            self.client, '/patients/P100/diagnostics', {'hemoglobin_level': 8}, method='patch',
+        ))
+        self.assertIn('Initiate systemic therapy per IMWG criteria (meets SLiM-CRAB).',
+                      json.loads(response.content)['recommendations'])
+
+    def test_batch_diagnostics(self):
+        self.assertRevalidates('/patients/P100/summary', lambda: post_json(
+            self.client, '/patients/diagnostics:batch', {'patients': [{'patient_id': 'P100', 'hemoglobin_level': 8}]},
+        ))
+
+    def test_new_diagnostic(self):
+        self.assertRevalidates('/patients/P100/next-tests', lambda: Diagnostic.objects.create(patient=self.patient))
+
+    def test_monitoring(self):
+        self.assertRevalidates('/patients/P100/monitoring/trend', lambda: post_json(
+            self.client, '/patients/P100/monitoring', {'date': '2026-01-01', 'mProtein': 1.5, 'mrDStatus': 'positive'},
+        ))
+
+    def test_monitoring_ingest(self):
+        body = '\n'.join(json.dumps({'date': f'2026-01-0{day}', 'mProtein': day, 'mrDStatus': 'positive'})
+                         for day in (1, 2))
+        self.assertRevalidates('/patients/P100/monitoring/trend', lambda: self.client.post(
+            '/patients/P100/monitoring:ingest', body, content_type='application/x-ndjson',
+        ))
+
+    def test_recompute_flags(self):
+        def rewrite_flags():
+            Patient.objects.filter(pk=self.patient.pk).update(hemoglobin_level_canonical=8)
+            self.assertEqual(recompute_partition(0, self.patient.pk + 1, 100)[3], 1)
+
+        response = self.assertRevalidates('/patients/P100/treatment-recommendations', rewrite_flags)
+        self.assertIn('Initiate systemic therapy per IMWG criteria (meets SLiM-CRAB).',
+                      json.loads(response.content)['recommendations'])
+
+    def test_restage(self):
+        def restage():
+            Patient.objects.filter(pk=self.patient.pk).update(beta2_microglobulin=7)
+            self.assertEqual(Patient.objects.restage(), (1, 1))
+
+        response = self.assertRevalidates('/patients/P100/staging', restage)
+        self.assertEqual(json.loads(response.content)['issStage'], 'Stage III')
+
+
+class MaterializedDecisionTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient()
+        Diagnostic.objects.create(patient=self.patient)
+
+    def stored(self):
+        return dict(MaterializedDecision.objects.filter(patient=self.patient).values_list('kind', 'version'))
+
+    def test_write_refreshes_every_kind(self):
+        post_json(self.client, '/patients/P100/diagnostics', {'hemoglobin_level': 8}, method='patch')
+        version = Patient.objects.get(pk=self.patient.pk).version
+        self.assertEqual(self.stored(), {kind: version for kind in DecisionKind.values})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNotNone(decisions.get('P100', DecisionKind.CONSENSUS))
+        self.assertEqual(len(queries), 1)
+
+    def test_invalidated_decisions_are_evaluated_again(self):
+        decisions.get('P100', DecisionKind.STAGING)
+        decisions.invalidate([self.patient.pk])
+        Patient.objects.filter(pk=self.patient.pk).update(cytogenic_markers='del(17p)', cytogenetic_mask=1)
+        payload = decisions.get('P100', DecisionKind.STAGING)
+        self.assertEqual(payload['prognosis'], 'High-risk disease due to cytogenetics')
+
+    def test_late_store_of_an_older_evaluation_is_ignored(self):
+        patient, latest_diag = decisions.load_patient('P100')
+        outdated = decisions.evaluate_all(patient, latest_diag)
+        post_json(self.client, '/patients/P100/diagnostics', {'cytogenic_markers': 'del(17p)'}, method='patch')
+        decisions.store([(patient, kind, payload) for kind, payload in outdated.items()])
+        payload = decisions.get('P100', DecisionKind.STAGING)
+        self.assertEqual(payload['prognosis'], 'High-risk disease due to cytogenetics')
+
+    def test_patients_without_diagnostics_have_no_decisions(self):
+        make_patient('P101')
+        self.assertEqual(self.client.get('/patients/P101/staging').status_code, 404)
+
+
+class SummaryTests(TestCase):
+
+    def setUp(self):
+        Diagnostic.objects.create(patient=make_patient(hemoglobin_level=8, beta2_microglobulin=6.0))
+
+    def test_summary_combines_every_decision(self):
+        response = self.client.get('/patients/P100/summary', {'framework': 'nice'})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(set(body), {'patientId', 'staging', 'nextTests', 'treatmentRecommendations'})
+        self.assertEqual(body['patientId'], 'P100')
+        self.assertEqual(body['staging'], json.loads(self.client.get('/patients/P100/staging').content))
+        self.assertEqual(body['nextTests'], json.loads(self.client.get('/patients/P100/next-tests').content))
+        self.assertEqual(body['treatmentRecommendations'], json.loads(
+            self.client.get('/patients/P100/treatment-recommendations', {'framework': 'nice'}).content
+        ))
+        self.assertEqual(body['treatmentRecommendations']['framework'], 'NICE')
+
+    def test_missing_patient_or_diagnostics(self):
+        make_patient('P101')
+        for patient_id in ('P101', 'P999'):
+            response = self.client.get(f'/patients/{patient_id}/summary')
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(json.loads(response.content), {'error': 'Patient or diagnostics not found'})
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        Diagnostic.objects.create(patient=make_patient(beta2_microglobulin=6.0))
+        make_patient('P101')
+
+    async def test_decisions_and_revalidation(self):
+        for endpoint, kind in (('staging', DecisionKind.STAGING), ('next-tests', DecisionKind.NEXT_TESTS),
+                               ('treatment-recommendations?framework=nice', DecisionKind.NICE)):
+            path = f'/patients/P100/{endpoint}'
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, 200, endpoint)
+            payload = json.loads(response.content)
+            self.assertEqual(payload, await decisions.aget('P100', kind))
+
+            etag = response['ETag']
+            response = await self.async_client.get(path, headers={'If-None-Match': etag})
+            self.assertEqual((response.status_code, response['ETag']), (304, etag))
+            response = await self.async_client.get(path, headers={'If-None-Match': '"stale"'})
+            self.assertEqual(response.status_code, 200)
+
+    async def test_missing_patient_or_diagnostics(self):
+        for patient_id in ('P101', 'P999'):
+            response = await self.async_client.get(f'/patients/{patient_id}/staging')
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(json.loads(response.content), {'error': 'Patient or diagnostics not found'})
+        self.assertEqual((await self.async_client.post('/patients/P100/staging')).status_code, 405)
+
+
+class CohortTests(TestCase):
+
+    def setUp(self):
+        make_patient('P1', cytogenic_markers='del(17p), t(11;14)')
+        make_patient('P2', cytogenic_markers='t(4;14)')
+        make_patient('P3', cytogenic_markers='T(11;14), unknown', serum_creatinine_level=250,
+                     serum_creatinine_level_units='MICROMOLES/L')
+        make_patient('P4', cytogenic_markers='17p-')
+        make_patient('P5')
+
+    def cohort(self, **params):
+        response = self.client.get('/patients/cohort', params)
+        return response.status_code, json.loads(response.content)
+
+    def marker_rows(self, patient_id):
+        return set(PatientCytogeneticMarker.objects.filter(
+            patient__patient_id=patient_id).values_list('marker', flat=True))
+
+    def test_markers_stay_in_sync_with_the_text(self):
+        for patient in Patient.objects.all():
+            self.assertEqual(patient.cytogenetic_mask, cytogenetics.mask(patient.cytogenic_markers))
+            self.assertEqual(self.marker_rows(patient.patient_id), set(cytogenetics.bits(patient.cytogenetic_mask)))
+
+        patient = Patient.objects.get(patient_id='P1')
+        patient.cytogenic_markers = 'gain(1q)'
+        patient.save()
+        self.assertEqual(self.marker_rows('P1'), {cytogenetics.BY_CODE['gain1q'].bit})
+
+        post_json(self.client, '/patients/diagnostics:batch', {'patients': [
+            {'patient_id': 'P2', 'cytogenic_markers': 'hyperdiploidy, del13q'},
+            {'patient_id': 'P4', 'cytogenic_markers': ''},
+        ]})
+        mask = cytogenetics.mask_of(['hyperdiploidy', 'del13q'])
+        self.assertEqual(Patient.objects.get(patient_id='P2').cytogenetic_mask, mask)
+        self.assertEqual(self.marker_rows('P2'), set(cytogenetics.bits(mask)))
+        self.assertEqual(self.marker_rows('P4'), set())
+
+    def test_marker_filters(self):
+        status, body = self.cohort(marker=['t(11;14)', 'del(17p)'])
+        self.assertEqual(status, 200)
+        self.assertEqual(body['patients'], [
+            {'patient_id': 'P1', 'markers': ['del17p', 't(11;14)']},
+            {'patient_id': 'P3', 'markers': ['t(11;14)']},
+            {'patient_id': 'P4', 'markers': ['del17p']},
+        ])
+        self.assertIsNone(body['next'])
+        _, body = self.cohort(marker=['t(11;14)', 'del17p'], match='all')
+        self.assertEqual([p['patient_id'] for p in body['patients']], ['P1'])
+        _, body = self.cohort(high_risk='true')
+        self.assertEqual([p['patient_id'] for p in body['patients']], ['P1', 'P2', 'P4'])
+        _, body = self.cohort(serum_creatinine_level__gt=2)
+        self.assertEqual([p['patient_id'] for p in body['patients']], ['P3'])
+
+    def test_keyset_paging(self):
+        pages = []
+        params = {'high_risk': 'true', 'limit': 2}
+        while True:
+            _, body = self.cohort(**params)
+            pages.append([p['patient_id'] for p in body['patients']])
+            if body['next'] is None:
+                break
+            params['after'] = body['next']
+        self.assertEqual(pages, [['P1', 'P2'], ['P4']])
+
+    def test_invalid_parameters(self):
+        for params, error in (
+            ({}, 'Give at least one marker, lab or stage filter or high_risk=true'),
+            ({'marker': 'del18p'}, "Unknown marker 'del18p'"),
+            ({'marker': 'del17p', 'match': 'some'}, 'match must be "any" or "all"'),
+            ({'marker': 'del17p', 'limit': 'ten'}, 'limit must be an integer'),
+            ({'marker': 'del17p', 'limit': 0}, 'limit must be between 1 and'),
+            ({'serum_creatinine_level__gt': 'high'}, 'serum_creatinine_level__gt must be a number'),
+        ):
+            status, body = self.cohort(**params)
+            self.assertEqual(status, 400, params)
+            self.assertTrue(body['error'].startswith(error), body)
+
+
+def treatment_predicate(name, patient):
+    """Value of the treatment rules' predicate ``name`` for ``patient``."""
+    namespace = dict(treatment.HELPERS)
+    namespace.update((field, getattr(patient, field)) for field in treatment.predicate_fields(name))
+    for dependency in treatment.predicate_dependencies(name):
+        namespace[dependency] = eval(treatment.PREDICATES[dependency].expression, namespace)
+    return bool(namespace[name])
+
+
+class CohortStatsTests(TestCase):
+    """The aggregates computed in SQL agree with the rules evaluated in Python."""
+
+    def setUp(self):
+        rng = random.Random(0)
+        for n in range(300):
+            make_patient(
+                f'P{n:03}',
+                country=rng.choice(['UK', 'FR']),
+                region=rng.choice(['North', 'South', None]),
+                serum_calcium_level=rng.choice([None, 9.5, 11, 11.5, 12.2]),
+                serum_calcium_level_units='MG/DL',
+                serum_creatinine_level=rng.choice([None, 0.9, 2, 2.4, 150, 250]),
+                serum_creatinine_level_units=rng.choice(['MG/DL', 'MICROMOLES/L']),
+                creatinine_clearance_rate=rng.choice([None, 25, 40, 80]),
+                hemoglobin_level=rng.choice([None, 8, 10, 12.5, 95, 130]),
+                hemoglobin_level_units=rng.choice(['G/DL', 'G/L']),
+                bone_lesions=rng.choice([None, '', '0', 'none', 'None', '1', '2', 'more than 2']),
+                bone_imaging_result=rng.choice([False, True]),
+                clonal_bone_marrow_plasma_cells_percentage=rng.choice([None, 10, 59.99, 60, 75]),
+                kappa_flc=rng.choice([None, 0, 1, 10, 100, 2000]),
+                lambda_flc=rng.choice([None, 0, 1, 10, 100, 2000]),
+                beta2_microglobulin=rng.choice([None, 2.0, 4.0, 6.0]),
+                albumin=rng.choice([None, 3.0, 4.0]),
+                lactate_dehydrogenase_level=rng.choice([None, 200, 300]),
+                cytogenic_markers=rng.choice([None, '', 'del17p', 't(4;14), t(11;14)', 'hyperdiploidy', 'gain1q']),
+            )
+        # Store the flags the treatment rules read, as recompute_flags does.
+        recompute_partition(0, Patient.objects.latest('pk').pk + 1, 100)
+
+    def expected(self, patients):
+        totals = {'patients': 0, 'meets_crab': 0, 'meets_slim': 0, 'myeloma_defining': 0}
+        criteria = {}
+        distributions = {name: {} for name in ('issStage', 'rIssStage', 'r2IssStage')}
+        regions = {}
+        for patient in patients:
+            result = crab_slim.evaluate({name: getattr(patient, name) for name in crab_slim.FIELDS})
+            totals['patients'] += 1
+            totals['meets_crab'] += result['meets_crab']
+            totals['meets_slim'] += result['meets_slim']
+            totals['myeloma_defining'] += treatment_predicate('active_disease', patient)
+            for name, met in {**result['crab_criteria'], **result['slim_criteria']}.items():
+                criteria[name] = criteria.get(name, 0) + met
+
+            stages = staging.stages(*(getattr(patient, name) for name in staging.FIELDS))
+            for distribution, stage in zip(distributions.values(), stages):
+                distribution[staging.label(stage)] = distribution.get(staging.label(stage), 0) + 1
+
+            high_risk = treatment_predicate('high_risk_cytogenetics', patient)
+            n, count = regions.get(patient.region, (0, 0))
+            regions[patient.region] = (n + 1, count + high_risk)
+
+        return {
+            'patients': totals['patients'],
+            'crab': {'meets': totals['meets_crab'], **{name: criteria[name] for name in 'CRAB'}},
+            'slim': {'meets': totals['meets_slim'], **{name: criteria[name] for name in ('S', 'Li', 'M')}},
+            'myelomaDefining': totals['myeloma_defining'],
+            **{name: dict(sorted(distribution.items())) for name, distribution in distributions.items()},
+            'highRiskCytogeneticsByRegion': [
+                {'region': region, 'patients': n, 'highRisk': count, 'share': count / n}
+                for region, (n, count) in sorted(regions.items(), key=lambda item: (item[0] is None, item[0] or ''))
+            ],
+        }
+
+    def test_stats_match_the_python_rules(self):
+        self.assertEqual(analytics.stats(Patient.objects.all()), self.expected(Patient.objects.all()))
+
+    def test_stats_endpoint_applies_filters(self):
+        response = self.client.get('/patients/cohort/stats', {'country': 'UK', 'r_iss_stage': 'II'})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body.pop('filters'), {'country': 'UK', 'r_iss_stage': 'II'})
+        subset = Patient.objects.filter(country='UK', r_iss_stage=2)
+        self.assertGreater(subset.count(), 0)
+        self.assertEqual(body, self.expected(subset))
+
+
+class SchemaTests(SimpleTestCase):
+
+    def assertErrors(self, schema, item, messages, partial=False):
+        with self.assertRaises(ValidationError) as cm:
+            schema.decode(item, partial=partial)
+        self.assertEqual(cm.exception.messages, messages)
+
+    def test_values_of_the_right_type_are_kept(self):
+        values = schemas.DIAGNOSTICS.decode({
+            'karnofsky_performance_score': 80, 'beta2_microglobulin': 3.5, 'bone_imaging_result': True,
+            'cytogenic_markers': 'del(17p)', 'stem_cell_transplant_history': [{'type': 'auto'}],
+        })
+        self.assertEqual(values['karnofsky_performance_score'], 80)
+        self.assertEqual(values['beta2_microglobulin'], 3.5)
+        self.assertIs(values['bone_imaging_result'], True)
+        self.assertEqual(values['cytogenic_markers'], 'del(17p)')
+        self.assertEqual(values['stem_cell_transplant_history'], [{'type': 'auto'}])
+
+    def test_coercion(self):
+        values = schemas.DIAGNOSTICS.decode({
+            'karnofsky_performance_score': ' 80 ',
+            'ecog_performance_status': 1.0,
+            'kappa_flc': '120',
+            'beta2_microglobulin': '3.5',
+            'albumin': 4,
+            'serum_creatinine_level': 1.4,
+            'serum_calcium_level': ' 10.25 ',
+            'hemoglobin_level': 12,
+            'hemoglobin_level_units': 'g/l',
+            'serum_creatinine_level_units': ' micromoles/l ',
+            'bone_imaging_result': 'TRUE',
+            'bone_lesions': 2,
+        })
+        self.assertEqual(values['karnofsky_performance_score'], 80)
+        self.assertEqual(values['ecog_performance_status'], 1)
+        self.assertIs(type(values['ecog_performance_status']), int)
+        self.assertEqual(values['kappa_flc'], 120)
+        self.assertEqual(values['beta2_microglobulin'], 3.5)
+        self.assertEqual(values['albumin'], 4.0)
+        self.assertIs(type(values['albumin']), float)
+        # Floats are read from their shortest repr, not their binary value.
+        self.assertEqual(values['serum_creatinine_level'], Decimal('1.4'))
+        self.assertEqual(values['serum_calcium_level'], Decimal('10.25'))
+        self.assertEqual(values['hemoglobin_level'], Decimal(12))
+        self.assertEqual(values['hemoglobin_level_units'], 'G/L')
+        self.assertEqual(values['serum_creatinine_level_units'], 'MICROMOLES/L')
+        self.assertIs(values['bone_imaging_result'], True)
+        self.assertEqual(values['bone_lesions'], '2')
+
+        monitoring = schemas.MONITORING.decode({'date': ' 2024-03-01', 'mProtein': '1.2', 'mrDStatus': 'positive'})
+        self.assertEqual(monitoring, {
+            'date': datetime.date(2024, 3, 1), 'm_protein': 1.2, 'mrD_status': 'positive', 'symptoms': [],
+        })
+
+    def test_invalid_values(self):
+        cases = [
+            ({'karnofsky_performance_score': 80.5}, 'karnofsky_performance_score: expected an integer.'),
+            ({'karnofsky_performance_score': True}, 'karnofsky_performance_score: expected an integer.'),
+            ({'beta2_microglobulin': 'high'}, 'beta2_microglobulin: expected a number.'),
+            ({'beta2_microglobulin': math.inf}, 'beta2_microglobulin: expected a number.'),
+            ({'serum_calcium_level': 'NaN'}, 'serum_calcium_level: expected a number.'),
+            ({'serum_calcium_level': [10]}, 'serum_calcium_level: expected a number.'),
+            ({'serum_calcium_level': 1e10},
+             'serum_calcium_level: at most 8 digits before the decimal point are allowed.'),
+            ({'bone_imaging_result': 'yes'}, 'bone_imaging_result: expected true or false.'),
+            ({'bone_imaging_result': None}, 'bone_imaging_result may not be null.'),
+            ({'hemoglobin_level_units': 'mmol/l'},
+             "hemoglobin_level_units: Unknown unit 'mmol/l' for hemoglobin; expected one of: G/DL, G/L."),
+            ({'hemoglobin_level_units': 12}, 'hemoglobin_level_units: expected a string.'),
+            ({'treatment_refractory_status': 'x' * 256},
+             'treatment_refractory_status: at most 255 characters are allowed.'),
+            ({'cytogenic_markers': {'del(17p)': True}}, 'cytogenic_markers: expected a string.'),
+        ]
+        for item, message in cases:
+            with self.subTest(item=item):
+                self.assertErrors(schemas.DIAGNOSTICS, item, [message], partial=True)
+
+    def test_unknown_keys_are_rejected(self):
+        self.assertErrors(schemas.DIAGNOSTICS, {'hemoglobin': 8, 'kappa_flc': 10, 'ldh': 300},
+                          ['Unknown fields: hemoglobin, ldh.'])
+        self.assertErrors(schemas.DIAGNOSTICS, {'patient_id': 'P100'}, ['Unknown fields: patient_id.'], partial=True)
+        self.assertErrors(schemas.DIAGNOSTICS, [], ['Expected a JSON object.'])
+
+    def test_full_and_partial_payloads(self):
+        values = schemas.DIAGNOSTICS.decode({'hemoglobin_level': 8})
+        self.assertEqual(set(values), set(schemas.DIAGNOSTIC_FIELDS))
+        self.assertEqual(values['karnofsky_performance_score'], 100)
+        self.assertEqual(values['hemoglobin_level_units'], 'G/DL')
+        self.assertIsNone(values['kappa_flc'])
+        self.assertEqual(values['stem_cell_transplant_history'], [])
+        # Callable defaults give each payload its own value.
+        other = schemas.DIAGNOSTICS.decode({})
+        self.assertIsNot(values['stem_cell_transplant_history'], other['stem_cell_transplant_history'])
+
+        self.assertEqual(schemas.DIAGNOSTICS.decode({'hemoglobin_level': 8, 'kappa_flc': None}, partial=True),
+                         {'hemoglobin_level': Decimal(8), 'kappa_flc': None})
+        self.assertEqual(schemas.DIAGNOSTICS.decode({}, partial=True), {})
+        # Required fields are required in partial payloads too.
+        self.assertErrors(schemas.DIAGNOSTICS_BATCH_ITEM, {'hemoglobin_level': 8}, ['patient_id is required.'],
+                          partial=True)
+        self.assertErrors(schemas.MONITORING, {'mProtein': 1.2}, ['date is required.', 'mrDStatus is required.'])
+
+    def test_every_error_is_reported(self):
+        self.assertErrors(schemas.DIAGNOSTICS_BATCH_ITEM, {
+            'patient_id': None,
+            'karnofsky_performance_score': 'good',
+            'hemoglobin_level': '8,5',
+            'bone_imaging_result': None,
+            'hemoglobin_level_units': 'mg',
+            'extra': 1,
+        }, [
+            'patient_id may not be null.',
+            'karnofsky_performance_score: expected an integer.',
+            'hemoglobin_level: expected a number.',
+            "hemoglobin_level_units: Unknown unit 'mg' for hemoglobin; expected one of: G/DL, G/L.",
+            'bone_imaging_result may not be null.',
+            'Unknown fields: extra.',
+        ], partial=True)
+
+    def test_min_value(self):
+        params = jobs.PARAMS[JobKind.RECOMPUTE_FLAGS]
+        self.assertEqual(params.decode({'partitionSize': '500', 'dryRun': 'true'}),
+                         {'partition_size': 500, 'batch_size': 1000, 'dry_run': True})
+        self.assertErrors(params, {'partitionSize': 0, 'batchSize': '-5'},
+                          ['partitionSize: must be at least 1.', 'batchSize: must be at least 1.'])
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        Diagnostic.objects.create(patient=make_patient(hemoglobin_level=8, beta2_microglobulin=6.0))
+        instrumentation.reset()
+
+    def server_timing(self, response):
+        phases = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            phases[name] = dict(param.split('=', 1) for param in params)
+        return phases
+
+    def queries(self, response):
+        return int(self.server_timing(response)['db']['desc'].strip('"').split()[0])
+
+    def test_server_timing_header(self):
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            response = self.client.get('/patients/P100/staging')
+        phases = self.server_timing(response)
+        self.assertEqual(list(phases), ['db', 'rules', 'serialize', 'app', 'total'])
+        self.assertEqual(phases['db']['desc'], f'"{len(queries)} queries"')
+        self.assertGreater(len(queries), 0)
+        durations = {name: float(params['dur']) for name, params in phases.items()}
+        self.assertGreater(durations['rules'], 0)
+        self.assertGreater(durations['serialize'], 0)
+        self.assertAlmostEqual(
+            durations['db'] + durations['rules'] + durations['serialize'] + durations['app'], durations['total'],
+            delta=0.05,
+        )
+
+    @override_settings(SERVER_TIMING=False)
+    def test_header_can_be_turned_off(self):
+        response = self.client.get('/patients/P100/staging')
+        self.assertNotIn('Server-Timing', response)
+        self.assertIn('myeloma_request_queries_count', self.client.get('/metrics').content.decode())
+
+    def test_metrics_exposes_histograms(self):
+        queries = [self.queries(self.client.get('/patients/P100/staging')) for _ in range(2)]
+        self.client.get('/patients/P999/staging')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE myeloma_request_duration_seconds histogram', lines)
+        self.assertIn('# TYPE myeloma_request_queries histogram', lines)
+
+        staging = 'method="GET",route="patients/<str:patient_id>/staging"'
+        for phase in ('total', 'db', 'rules', 'serialize', 'app'):
+            self.assertIn(f'myeloma_request_duration_seconds_count{{{staging},status="2xx",phase="{phase}"}} 2', lines)
+        self.assertIn(f'myeloma_request_duration_seconds_count{{{staging},status="4xx",phase="total"}} 1', lines)
+        self.assertIn(
+            f'myeloma_request_duration_seconds_bucket{{{staging},status="2xx",phase="total",le="+Inf"}} 2', lines,
+        )
+        self.assertIn(f'myeloma_request_queries_sum{{{staging},status="2xx"}} {float(sum(queries))}', lines)
+        buckets = [
+            int(line.rsplit(' ', 1)[1]) for line in lines
+            if line.startswith(f'myeloma_request_queries_bucket{{{staging},status="2xx"')
+        ]
+        self.assertEqual(len(buckets), len(instrumentation.QUERY_BUCKETS) + 1)
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1], 2)
+
+    def test_metrics_rejects_post(self):
+        self.assertEqual(self.client.post('/metrics').status_code, 405)
+
+
+class BatchDiagnosticsTests(TestCase):
+
+    def setUp(self):
+        make_patient('P100', kappa_flc=10)
+        make_patient('P101')
+
+    def test_updates_present_fields_and_reports_errors(self):
+        response = post_json(self.client, '/patients/diagnostics:batch', {'patients': [
+            {'patient_id': 'P100', 'hemoglobin_level': 8},
+            {'patient_id': 'P101', 'hemoglobin_level': 'low'},
+            {'patient_id': 'P999'},
+        ]})
+        body = json.loads(response.content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['updated'], 1)
+        self.assertEqual([e['patient_id'] for e in body['errors']], ['P101', 'P999'])
+
+        patient = Patient.objects.get(patient_id='P100')
+        self.assertEqual(patient.hemoglobin_level, 8)
+        self.assertEqual(patient.kappa_flc, 10)
+        self.assertTrue(patient.meets_crab)
+        self.assertEqual(patient.version, 2)
+        self.assertEqual(Patient.objects.get(patient_id='P101').version, 1)
+
+
+class DiagnosticQueryTests(TestCase):
+
+    def setUp(self):
+        patient = make_patient()
+        self.del17p = Diagnostic.objects.create(
+            patient=patient, biomarkers={'cytogenetics': ['del(17p)'], 'fish': {'panel': 'standard', 'cells': 200}},
+            imaging_results={'pet_ct': 'positive'}, cbc={'hemoglobin': 9.5, 'platelets': '120'},
+        )
+        self.both = Diagnostic.objects.create(
+            patient=patient, biomarkers={'cytogenetics': ['17p-', 't(4;14)', 'unlisted'], 'fish': {'cells': 100}},
+        )
+        self.t11_14 = Diagnostic.objects.create(patient=patient, biomarkers={'cytogenetics': ['t(11;14)']})
+        self.empty = Diagnostic.objects.create(patient=patient)
+
+    def pks(self, queryset):
+        return set(queryset.values_list('pk', flat=True))
+
+    def test_extract_fields_on_save(self):
+        self.assertEqual(self.del17p.cytogenetic_mask, cytogenetics.mask_of(['del17p']))
+        self.assertEqual(self.both.cytogenetic_mask, cytogenetics.mask_of(['del17p', 't(4;14)']))
+        self.assertEqual((self.del17p.pet_ct, self.del17p.cbc_hemoglobin, self.del17p.cbc_platelets),
+                         ('positive', 9.5, 120.0))
+        self.assertEqual((self.empty.cytogenetic_mask, self.empty.pet_ct, self.empty.cbc_hemoglobin), (0, None, None))
+
+        # Malformed values extract as nothing rather than failing the save.
+        self.empty.biomarkers = {'cytogenetics': 'del(17p)'}
+        self.empty.cbc = {'hemoglobin': True, 'platelets': 'many'}
+        self.empty.imaging_results = {'pet_ct': 3}
+        self.empty.save()
+        self.empty.refresh_from_db()
+        self.assertEqual((self.empty.cytogenetic_mask, self.empty.pet_ct), (0, None))
+        self.assertEqual((self.empty.cbc_hemoglobin, self.empty.cbc_platelets), (None, None))
+
+    def test_save_with_update_fields_writes_the_extracted_columns(self):
+        diagnostic = Diagnostic.objects.only('pk', 'biomarkers').get(pk=self.t11_14.pk)
+        diagnostic.biomarkers = {'cytogenetics': ['t(14;16)']}
+        diagnostic.save(update_fields=['biomarkers'])
+        self.t11_14.refresh_from_db()
+        self.assertEqual(self.t11_14.cytogenetic_mask, cytogenetics.mask_of(['t(14;16)']))
+
+        # Columns extracted from fields that are not saved are left alone.
+        self.del17p.biomarkers = {}
+        self.del17p.cbc = {}
+        self.del17p.save(update_fields=['cbc'])
+        self.del17p.refresh_from_db()
+        self.assertEqual(self.del17p.cytogenetic_mask, cytogenetics.mask_of(['del17p']))
+        self.assertIsNone(self.del17p.cbc_hemoglobin)
+
+    def test_with_cytogenetics(self):
+        self.assertEqual(self.pks(Diagnostic.objects.with_cytogenetics(['del(17p)'])), {self.del17p.pk, self.both.pk})
+        self.assertEqual(
+            self.pks(Diagnostic.objects.with_cytogenetics(['t(4;14)', 't(11;14)'])), {self.both.pk, self.t11_14.pk},
+        )
+        self.assertEqual(
+            self.pks(Diagnostic.objects.with_cytogenetics(['del17p', 't(4;14)'], match='all')), {self.both.pk},
+        )
+        self.assertEqual(self.pks(Diagnostic.objects.with_cytogenetics(['t(14;20)'])), set())
+        with self.assertRaises(KeyError):
+            Diagnostic.objects.with_cytogenetics(['unlisted'])
+
+    def test_json_contains(self):
+        def contains(field, value):
+            return self.pks(Diagnostic.objects.json_contains(field, value))
+
+        self.assertEqual(contains('biomarkers', {'cytogenetics': ['del(17p)']}), {self.del17p.pk})
+        self.assertEqual(contains('biomarkers', {'cytogenetics': ['17p-', 't(4;14)']}), {self.both.pk})
+        self.assertEqual(contains('biomarkers', {'cytogenetics': ['del(17p)', 't(4;14)']}), set())
+        self.assertEqual(contains('biomarkers', {'fish': {'cells': 100}}), {self.both.pk})
+        self.assertEqual(contains('biomarkers', {'fish': {'panel': 'standard', 'cells': 200}}), {self.del17p.pk})
+        self.assertEqual(contains('imaging_results', {'pet_ct': 'positive'}), {self.del17p.pk})
+        self.assertEqual(contains('cbc', {'hemoglobin': 9.5}), {self.del17p.pk})
+        self.assertEqual(contains('biomarkers', {}), self.pks(Diagnostic.objects.all()))
+
+    def test_json_contains_of_containers_in_lists_needs_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('PostgreSQL supports it')
+        with self.assertRaises(NotSupportedError):
+            Diagnostic.objects.json_contains('biomarkers', {'cytogenetics': [{'code': 'del17p'}]})
+
+
+class JobTests(TestCase):
+
+    def setUp(self):
+        for n in range(3):
+            Diagnostic.objects.create(patient=make_patient(f'P10{n}', meets_crab=False, meets_slim=False))
+
+    def test_invalid_params_are_rejected(self):
+        for params in ({'batchSize': 0}, {'partitionSize': -1}, {'unknown': 1}):
+            response = post_json(self.client, '/patients/jobs', {'kind': 'recompute_flags', 'params': params})
+            self.assertEqual(response.status_code, 400, params)
+        self.assertFalse(Job.objects.exists())
+
+    def test_recompute_flags_job(self):
+        Patient.objects.filter(patient_id='P100').update(hemoglobin_level_canonical=8)
+        response = post_json(self.client, '/patients/jobs', {'kind': 'recompute_flags', 'params': {'partitionSize': 2}})
+        self.assertEqual(response.status_code, 202)
+        jobs.work(worker='test', burst=True)
+
+        status = json.loads(self.client.get(response['Location']).content)
+        self.assertEqual(status['status'], JobStatus.SUCCEEDED)
+        self.assertEqual(status['result'], {'scanned': 3, 'changed': 1, 'dryRun': False})
+        self.assertEqual(status['progress']['done'], status['progress']['total'])
+        self.assertTrue(Patient.objects.get(patient_id='P100').meets_crab)
+
+    def test_export_result_is_streamed_in_chunks(self):
+        job = jobs.enqueue(JobKind.EXPORT_DECISIONS)
+        self.assertEqual(self.client.get(f'/patients/jobs/{job.pk}/result').status_code, 409)
+        with mock.patch.object(jobs, 'RESULT_CHUNK_LINES', 2):
+            jobs.work(worker='test', burst=True)
+        self.assertEqual(JobResultChunk.objects.filter(job=job).count(), 2)
+
+        response = self.client.get(f'/patients/jobs/{job.pk}/result')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['patientId'] for line in lines], ['P100', 'P101', 'P102'])
+
+    def test_jobs_are_claimed_once(self):
+        job = jobs.enqueue(JobKind.EXPORT_DECISIONS)
+        self.assertEqual(jobs.claim('a').pk, job.pk)
+        self.assertIsNone(jobs.claim('b'))
+
+    def test_job_with_expired_lease_is_retried_then_failed(self):
+        job = jobs.enqueue(JobKind.EXPORT_DECISIONS)
+        jobs.claim('lost')
+        JobResultChunk.objects.create(job=job, sequence=0, data='partial\n')
+        expired = timezone.now() - jobs.LEASE - timedelta(seconds=1)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=expired)
+
+        retried = jobs.claim('other')
+        self.assertEqual((retried.worker, retried.attempts), ('other', 2))
+        self.assertFalse(JobResultChunk.objects.filter(job=job).exists())
+
+        Job.objects.filter(pk=job.pk).update(attempts=Job.MAX_ATTEMPTS, heartbeat_at=expired)
+        self.assertIsNone(jobs.claim('third'))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, JobStatus.FAILED)
+
+    def test_heartbeat_is_refreshed_between_reports(self):
+        job = jobs.enqueue(JobKind.EXPORT_DECISIONS)
+        beats = []
+
+        def slow_handler(job, report):
+            # Never reports: only the heartbeat thread keeps the lease.
+            deadline = time.monotonic() + 5
+            while len(beats) < 3 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            return 'done'
+
+        with mock.patch.object(jobs, 'HEARTBEAT_INTERVAL', timedelta(milliseconds=1)), \
+                mock.patch.object(jobs, 'refresh_heartbeat', side_effect=lambda job: beats.append(job.pk) or True), \
+                mock.patch.dict(jobs.HANDLERS, {JobKind.EXPORT_DECISIONS: slow_handler}):
+            jobs.work(worker='test', burst=True)
+            self.assertFalse(any(thread.name.endswith('-heartbeat') for thread in threading.enumerate()))
+        self.assertGreaterEqual(len(beats), 3)
+        self.assertEqual(set(beats), {job.pk})
+        self.assertEqual(Job.objects.get(pk=job.pk).result, 'done')
+
+    def test_refresh_heartbeat_extends_the_lease_of_its_attempt_only(self):
+        job = jobs.enqueue(JobKind.EXPORT_DECISIONS)
+        claimed = jobs.claim('a')
+        expired = timezone.now() - jobs.LEASE - timedelta(seconds=1)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=expired)
+        self.assertTrue(jobs.refresh_heartbeat(claimed))
+        self.assertIsNone(jobs.claim('b'))
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=expired)
+        jobs.claim('b')
+        self.assertFalse(jobs.refresh_heartbeat(claimed))
+
+
+class WhatIfTests(TestCase):
+
+    def setUp(self):
+        make_patient()
+        post_json(self.client, '/patients/P100/diagnostics', {'hemoglobin_level': 8}, method='patch')
+
+    def test_scenario_flags_drive_its_recommendations(self):
+        response = post_json(self.client, '/patients/P100/what-if', {'scenarios': [
+            {'name': 'recovered', 'overrides': {'hemoglobin_level': 13}},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        scenario = body['scenarios'][0]
+        self.assertFalse(scenario['meetsCrab'])
+        recommendations = scenario['treatmentRecommendations']['CONSENSUS']['recommendations']
+        self.assertNotIn('Initiate systemic therapy per IMWG criteria (meets SLiM-CRAB).', recommendations)
+        self.assertIn('Consider observation or clinical trial enrollment.', recommendations)
+        self.assertIn('meetsCrab', scenario['changed'])
+        self.assertTrue(body['baseline']['meetsCrab'])
+
+    def test_nothing_is_written(self):
+        version = Patient.objects.get(patient_id='P100').version
+        post_json(self.client, '/patients/P100/what-if', {'scenarios': [
+            {'name': 'high risk', 'overrides': {'cytogenic_markers': 'del(17p)'}},
+        ]})
+        patient = Patient.objects.get(patient_id='P100')
+        self.assertEqual((patient.version, patient.cytogenic_markers), (version, None))
+
+    def test_invalid_overrides_are_rejected(self):
+        response = post_json(self.client, '/patients/P100/what-if', {'scenarios': [
+            {'name': 'ok', 'overrides': {}}, {'name': 'bad', 'overrides': {'kappa_flc': 'many'}},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['index'], 1)
+
+
+class StagingTests(TestCase):
+
+    def test_iss(self):
+        self.assertEqual(staging.iss(2.0, 4.0), 1)
+        self.assertEqual(staging.iss(4.0, 4.0), 2)
+        self.assertEqual(staging.iss(6.0, None), 3)
+        self.assertIsNone(staging.iss(2.0, None))
+
+    def test_r_iss(self):
+        self.assertEqual(staging.r_iss(6.0, 3.0, 300, 'del(17p)'), 3)
+        self.assertEqual(staging.r_iss(2.0, 4.0, 200, 't(11;14)'), 1)
+        self.assertEqual(staging.r_iss(4.0, 4.0, None, None), 2)
+        self.assertIsNone(staging.r_iss(2.0, 4.0, None, 't(11;14)'))
+
+    def test_r2_iss(self):
+        self.assertEqual(staging.r2_iss(2.0, 4.0, 200, 'hyperdiploidy'), 1)
+        self.assertEqual(staging.r2_iss(6.0, 3.0, 300, 'del(17p), t(4;14)'), 4)
+
+    def test_stages_are_stored_on_save(self):
+        patient = make_patient(beta2_microglobulin=6.0, albumin=3.0, lactate_dehydrogenase_level=300,
+                               cytogenic_markers='del(17p)')
+        self.assertEqual((patient.iss_stage, patient.r_iss_stage, patient.r2_iss_stage), (3, 3, 4))
+        self.assertEqual(Patient.objects.filter(r_iss_stage=3).count(), 1)
+
+    def test_staging_endpoint(self):
+        patient = make_patient(beta2_microglobulin=6.0)
+        Diagnostic.objects.create(patient=patient)
+        body = json.loads(self.client.get('/patients/P100/staging').content)
+        self.assertEqual(body['issStage'], 'Stage III')
+        self.assertEqual(body['rIssStage'], 'Unstaged')
+        self.assertEqual(body['missingValues'], ['albumin', 'lactate_dehydrogenase_level', 'cytogenic_markers'])
+
+    def test_markers_of_the_latest_diagnostic_count(self):
+        patient = make_patient(beta2_microglobulin=6.0, albumin=3.0, lactate_dehydrogenase_level=200)
+        diagnostic = Diagnostic.objects.create(patient=patient, biomarkers={'cytogenetics': ['del(17p)']})
+        patient.refresh_from_db()
+        self.assertEqual(patient.diagnostic_cytogenetic_mask, cytogenetics.mask('del(17p)'))
+        self.assertEqual((patient.iss_stage, patient.r_iss_stage, patient.r2_iss_stage), (3, 3, 3))
+        body = json.loads(self.client.get('/patients/P100/staging').content)
+        self.assertEqual(body['prognosis'], 'High-risk disease due to cytogenetics')
+        self.assertEqual((body['rIssStage'], body['r2IssStage']), ('Stage III', 'Stage III'))
+        self.assertEqual(body['missingValues'], [])
+
+        # A newer Diagnostic without the marker replaces it; deleting that one brings it back.
+        newer = Diagnostic.objects.create(patient=patient)
+        patient.refresh_from_db()
+        self.assertEqual((patient.diagnostic_cytogenetic_mask, patient.r_iss_stage), (0, None))
+        body = json.loads(self.client.get('/patients/P100/staging').content)
+        self.assertEqual(body['prognosis'], 'Standard risk disease')
+        self.assertEqual(body['missingValues'], ['cytogenic_markers'])
+        newer.delete()
+        patient.refresh_from_db()
+        self.assertEqual((patient.diagnostic_cytogenetic_mask, patient.r_iss_stage), (diagnostic.cytogenetic_mask, 3))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2', 'replica3'], READ_YOUR_WRITES_SECONDS=10)
+class ReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+        @routing.replica_reads
+        def view(request):
+            return [router.db_for_read(Patient) for _ in range(20)]
+
+        self.view = view
+
+    def test_reads_of_a_request_use_one_replica(self):
+        aliases = self.view(self.factory.get('/'))
+        self.assertEqual(len(set(aliases)), 1)
+        self.assertIn(aliases[0], ['replica1', 'replica2', 'replica3'])
+
+    def test_pinned_clients_and_writes_read_the_primary(self):
+        pinned = self.factory.get('/')
+        pinned.COOKIES[routing.PIN_COOKIE] = '1'
+        self.assertEqual(set(self.view(pinned)), {'default'})
+        self.assertEqual(set(self.view(self.factory.post('/'))), {'default'})
+        self.assertEqual(router.db_for_read(Patient), 'default')
+        self.assertEqual(router.db_for_write(Patient), 'default')
+
+    def test_writes_pin_the_client(self):
+        make_patient()
+        response = post_json(self.client, '/patients/P100/diagnostics', {'hemoglobin_level': 8}, method='patch')
+        cookie = response.cookies[routing.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+
+    def test_requests_that_write_nothing_do_not_pin(self):
+        make_patient()
+        response = post_json(self.client, '/patients/P100/what-if', {'scenarios': []})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(routing.PIN_COOKIE, response.cookies)
+        response = post_json(self.client, '/patients/P999/diagnostics', {}, method='patch')
+        self.assertNotIn(routing.PIN_COOKIE, response.cookies)
@@ -1,10 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Read-only decision endpoints, served by async views under ASGI if enabled
+decision_views = async_views if settings.ASYNC_DECISION_VIEWS else views
 
 urlpatterns = [
+    path('diagnostics:batch', views.submit_diagnostics_batch),
+    path('export', views.export_decisions),
+    path('cohort', views.cohort),
+    path('cohort/stats', views.cohort_stats),
+    path('jobs', views.create_job),
+    path('jobs/<int:job_id>', views.job_status),
+    path('jobs/<int:job_id>/result', views.job_result),
     path('<str:patient_id>/diagnostics', views.submit_diagnostics),
-    path('<str:patient_id>/next-tests', views.next_tests),
-    path('<str:patient_id>/staging', views.staging),
-    path('<str:patient_id>/treatment-recommendations', views.treatment_recommendations),
+    path('<str:patient_id>/next-tests', decision_views.next_tests),
+    path('<str:patient_id>/staging', decision_views.staging),
+    path('<str:patient_id>/treatment-recommendations', decision_views.treatment_recommendations),
     path('<str:patient_id>/monitoring', views.submit_monitoring),
+    path('<str:patient_id>/monitoring:ingest', views.ingest_monitoring),
+    path('<str:patient_id>/monitoring/trend', views.monitoring_trend),
+    path('<str:patient_id>/summary', views.summary),
+    path('<str:patient_id>/what-if', views.what_if),
 ]
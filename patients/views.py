@@ -1,95 +1,121 @@
-from django.http import JsonResponse
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.http import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-from .models import Patient, Diagnostic, Monitoring
+from django.views.decorators.http import condition, require_http_methods
+from . import analytics, decisions, jobs, schemas
+from .instrumentation import JsonResponse, timed
+from .routing import replica_reads
+from .engine import crab_slim, cytogenetics, kinetics, staging, units
+from .models import STAGE_FIELDS, DecisionKind, Job, JobStatus, Patient, PatientCytogeneticMarker, Monitoring, MonitoringSummary
 import json
 
+MAX_BATCH_SIZE = 5000
+BULK_UPDATE_BATCH_SIZE = 500
+
+INGEST_BATCH_SIZE = 1000
+INGEST_MAX_LINE_LENGTH = 64 * 1024
+INGEST_MAX_ERRORS = 100
+
+COHORT_PAGE_SIZE = 1000
+COHORT_MAX_PAGE_SIZE = 10000
+COHORT_LAB_LOOKUPS = ('gt', 'gte', 'lt', 'lte')
+COHORT_STATS_FILTERS = ('country', 'region', 'disease', 'stage')
+# Values of the stored stage filters, e.g. ?r_iss_stage=III
+COHORT_STAGES = {
+    **staging.NUMERALS,
+    **{str(stage): stage for stage in staging.LABELS},
+    staging.UNSTAGED.upper(): None,
+}
+
+MAX_WHAT_IF_SCENARIOS = 1000
+
+
+def _evaluate_crab_slim(patient):
+    """Compute the CRAB and SLiM criteria for ``patient`` and store the flags on it."""
+    with timed('rules'):
+        result = crab_slim.evaluate({name: getattr(patient, name) for name in crab_slim.FIELDS})
+    patient.meets_crab = result['meets_crab']
+    patient.meets_slim = result['meets_slim']
+    return result['crab_criteria'], result['slim_criteria']
+
+
+def _version_etag(variant):
+    """``condition`` ETag function of a per-patient GET endpoint.
+
+    ``variant(request)`` names the response (endpoint and framework). A
+    matching ``If-None-Match`` is answered with a 304 after the version
+    lookup alone; unknown patients get no ETag and reach the view.
+    """
+    def etag(request, patient_id):
+        version = decisions.current_version(patient_id)
+        return version and decisions.etag(patient_id, version, variant(request))
+    return etag
+
+
+def _framework_variant(name):
+    return lambda request: f'{name}-{decisions.framework_label(request.GET.get("framework", "").lower())}'
+
+
+def _store_monitoring(patient, batch):
+    # bulk_create sends no signals, so update the summary and version explicitly
+    with transaction.atomic():
+        Monitoring.objects.bulk_create(batch)
+        MonitoringSummary.record(patient.pk, [(m.date, m.m_protein) for m in batch])
+        Patient.bump_versions([patient.pk])
+
+
+def _iter_lines(stream):
+    """Yield ``(number, line)`` for the lines of ``stream`` without reading it whole.
+
+    Lines longer than ``INGEST_MAX_LINE_LENGTH`` are yielded as ``None``
+    and their remainder is skipped.
+    """
+    number = 0
+    while True:
+        line = stream.readline(INGEST_MAX_LINE_LENGTH + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > INGEST_MAX_LINE_LENGTH and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(INGEST_MAX_LINE_LENGTH)
+            yield number, None
+        else:
+            yield number, line
+
+
 @csrf_exempt
-@require_http_methods(["POST"])
+@require_http_methods(["POST", "PATCH"])
 def submit_diagnostics(request, patient_id):
-    data = json.loads(request.body)
+    """Replace (POST) or update (PATCH) a patient's diagnostics.
+
+    POST sets every diagnostics field, to its default or null if missing
+    from the body; PATCH only changes the fields present. Either way only
+    the columns whose value changed are written.
+    """
+    try:
+        values = schemas.DIAGNOSTICS.decode(json.loads(request.body), partial=request.method == 'PATCH')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
     try:
         patient = Patient.objects.get(patient_id=patient_id)
     except Patient.DoesNotExist:
         return JsonResponse({'error': 'Patient not found'}, status=404)
 
-    try:
-        # Retrieve or create the patient by patient_id
-        patient, created = Patient.objects.get_or_create(patient_id=patient_id)
-    except Patient.DoesNotExist:
-        return JsonResponse({'error': 'Patient not found'}, status=404)
+    for name, value in values.items():
+        setattr(patient, name, value)
+    patient.derive_fields()
+    crab_criteria, slim_criteria = _evaluate_crab_slim(patient)
+    meets_crab = patient.meets_crab
+    meets_slim = patient.meets_slim
 
-    # Update fields with incoming data
-    patient.karnofsky_performance_score = data.get('karnofsky_performance_score')
-    patient.ecog_performance_status = data.get('ecog_performance_status')
-    patient.stem_cell_transplant_history = data.get('stem_cell_transplant_history')
-    patient.cytogenic_markers = data.get('cytogenic_markers')
-    patient.peripheral_neuropathy_grade = data.get('peripheral_neuropathy_grade')
-
-    patient.serum_creatinine_level = data.get('serum_creatinine_level')
-    patient.creatinine_clearance_rate = data.get('creatinine_clearance_rate')
-    patient.serum_calcium_level = data.get('serum_calcium_level')
-    patient.hemoglobin_level = data.get('hemoglobin_level')
-
-    patient.bone_lesions = data.get('bone_lesions')
-    patient.bone_imaging_result = data.get('bone_imaging_result')
-
-    patient.clonal_bone_marrow_plasma_cells_percentage = data.get('clonal_bone_marrow_plasma_cells_percentage')
-    patient.kappa_flc = data.get('kappa_flc')
-    patient.lambda_flc = data.get('lambda_flc')
-
-    patient.treatment_refractory_status = data.get('treatment_refractory_status')
-    patient.progression = data.get('progression')
-
-    patient.beta2_microglobulin = data.get('beta2_microglobulin')
-    patient.albumin = data.get('albumin')
-    patient.lactate_dehydrogenase_level = data.get('lactate_dehydrogenase_level')
-
-    # --------
-    # Compute meets_crab
-    # --------
-    meets_crab = False
-    crab_criteria = {
-        'C': patient.serum_calcium_level is not None and patient.serum_calcium_level > 11,
-        'R': (
-            (patient.serum_creatinine_level is not None and patient.serum_creatinine_level > 2) or
-            (patient.creatinine_clearance_rate is not None and patient.creatinine_clearance_rate < 40)
-        ),
-        'A': patient.hemoglobin_level is not None and patient.hemoglobin_level < 10,
-        'B': patient.bone_lesions is not None and str(patient.bone_lesions).lower() not in ['0', 'none']
-    }
-
-    # If ANY CRAB criterion is met, set meets_crab = True
-    meets_crab = any(crab_criteria.values())
-    patient.meets_crab = meets_crab
-
-    # --------
-    # Compute meets_slim
-    # --------
-    meets_slim = False
-    slim_criteria = {
-        'S': patient.clonal_bone_marrow_plasma_cells_percentage is not None and patient.clonal_bone_marrow_plasma_cells_percentage >= 60,
-        'Li': (
-            patient.kappa_flc is not None and patient.lambda_flc is not None and
-            (
-                (patient.kappa_flc / max(patient.lambda_flc, 1)) >= 100 or
-                (patient.lambda_flc / max(patient.kappa_flc, 1)) >= 100
-            )
-        ),
-        'M': (
-            patient.bone_imaging_result is not None and patient.bone_imaging_result.lower() == 'yes' and
-            patient.bone_lesions is not None and (
-                str(patient.bone_lesions) in ['2', 'more than 2']
-            )
-        )
-    }
-
-    # If ANY SLiM criterion is met, set meets_slim = True
-    meets_slim = any(slim_criteria.values())
-    patient.meets_slim = meets_slim
-
-    # Save the patient record
-    patient.save()
+    # Save the patient record; nothing to write or re-evaluate if unchanged
+    if patient.changed_fields():
+        patient.save()
+        decisions.refresh(patient)
 
     return JsonResponse({
         'message': 'Patient diagnostics successfully updated.',
@@ -100,203 +126,464 @@ def submit_diagnostics(request, patient_id):
         'slim_criteria': slim_criteria
     }, status=200)
 
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def submit_diagnostics_batch(request):
+    """Apply diagnostics to many patients at once.
+
+    Expects ``{"patients": [{"patient_id": ..., <diagnostic fields>}, ...]}``.
+    Only the fields present in an item are updated. Items that fail are
+    reported in ``errors`` and do not prevent the rest of the batch from
+    being written.
+    """
+    try:
+        items = json.loads(request.body).get('patients')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    if not isinstance(items, list):
+        return JsonResponse({'error': '"patients" must be a list'}, status=400)
+    if len(items) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f'At most {MAX_BATCH_SIZE} patients per batch'}, status=400)
+
+    patient_ids = {
+        item.get('patient_id') for item in items
+        if isinstance(item, dict) and isinstance(item.get('patient_id'), str)
+    }
+    patients = Patient.objects.in_bulk(patient_ids, field_name='patient_id')
+
+    results = []
+    errors = []
+    updated = {}
+    for index, item in enumerate(items):
+        patient_id = item.get('patient_id') if isinstance(item, dict) else None
+        if not patient_id or not isinstance(patient_id, str):
+            errors.append({'index': index, 'patient_id': patient_id, 'error': 'Missing patient_id'})
+            continue
+        patient = patients.get(patient_id)
+        if patient is None:
+            errors.append({'index': index, 'patient_id': patient_id, 'error': 'Patient not found'})
+            continue
+        try:
+            values = schemas.DIAGNOSTICS_BATCH_ITEM.decode(item, partial=True)
+        except ValidationError as e:
+            errors.append({'index': index, 'patient_id': patient_id, 'error': ' '.join(e.messages)})
+            continue
+
+        del values['patient_id']
+        for name, value in values.items():
+            setattr(patient, name, value)
+        patient.derive_fields()
+        crab_criteria, slim_criteria = _evaluate_crab_slim(patient)
+        updated[patient.pk] = patient
+        results.append({
+            'patient_id': patient_id,
+            'meets_crab': patient.meets_crab,
+            'meets_slim': patient.meets_slim,
+            'crab_criteria': crab_criteria,
+            'slim_criteria': slim_criteria
+        })
+
+    # Write only the patients and columns that changed
+    changed = {pk: patient.changed_fields() for pk, patient in updated.items()}
+    changed_patients = [updated[pk] for pk, names in changed.items() if names]
+    for patient in changed_patients:
+        patient.version = models.F('version') + 1
+    with transaction.atomic():
+        if changed_patients:
+            Patient.objects.bulk_update(
+                changed_patients,
+                sorted({name for names in changed.values() for name in names} | {'version'}),
+                batch_size=BULK_UPDATE_BATCH_SIZE
+            )
+        PatientCytogeneticMarker.sync({
+            pk: updated[pk].cytogenetic_mask for pk, names in changed.items() if 'cytogenetic_mask' in names
+        })
+        decisions.refresh_many(changed_patients)
+
     return JsonResponse({
-        'message': 'Diagnostics uploaded successfully.',
-        'nextStep': f'/patients/{patient_id}/next-tests'
-    })
+        'message': f'{len(updated)} patients updated.',
+        'updated': len(updated),
+        'results': results,
+        'errors': errors
+    }, status=200)
 
+@replica_reads
 @require_http_methods(["GET"])
+@condition(etag_func=_version_etag(lambda request: 'next-tests'))
 def next_tests(request, patient_id):
-    try:
-        patient = Patient.objects.get(patient_id=patient_id)
-        latest_diag = Diagnostic.objects.filter(patient=patient).latest('date')
-    except (Patient.DoesNotExist, Diagnostic.DoesNotExist):
+    payload = decisions.get(patient_id, DecisionKind.NEXT_TESTS)
+    if payload is None:
         return JsonResponse({'error': 'Patient or diagnostics not found'}, status=404)
+    return JsonResponse(payload)
 
-    recommended_tests = []
-    rationale = []
+@replica_reads
+@require_http_methods(["GET"])
+@condition(etag_func=_version_etag(lambda request: 'staging'))
+def staging(request, patient_id):
+    payload = decisions.get(patient_id, DecisionKind.STAGING)
+    if payload is None:
+        return JsonResponse({'error': 'Patient or diagnostics not found'}, status=404)
+    return JsonResponse(payload)
 
-    if not latest_diag.biomarkers.get('cytogenetics'):
-        recommended_tests.append("FISH for t(4;14) and t(14;16)")
-        rationale.append("High-risk cytogenetics not fully assessed.")
+@replica_reads
+@require_http_methods(["GET"])
+@condition(etag_func=_version_etag(_framework_variant('treatment')))
+def treatment_recommendations(request, patient_id):
+    framework = request.GET.get("framework", "").lower()
+    payload = decisions.get(patient_id, decisions.framework_kind(framework))
+    if payload is None:
+        return JsonResponse({'error': 'Patient or diagnostics not found'}, status=404)
 
-    if latest_diag.beta2_microglobulin and latest_diag.beta2_microglobulin > 5.5:
-        recommended_tests.append("Bone Marrow Biopsy")
-        rationale.append("Elevated beta-2 microglobulin requires marrow confirmation.")
+    # Any unknown framework is served by the consensus rules under its own name
+    payload['framework'] = decisions.framework_label(framework)
+    return JsonResponse(payload, status=200)
 
-    return JsonResponse({'patientId': patient_id,'nextRecommendedTests': recommended_tests,'rationale': rationale})
 
+@replica_reads
 @require_http_methods(["GET"])
-def staging(request, patient_id):
-    try:
-        patient = Patient.objects.get(patient_id=patient_id)
-        latest_diag = Diagnostic.objects.filter(patient=patient).latest('date')
-    except (Patient.DoesNotExist, Diagnostic.DoesNotExist):
+@condition(etag_func=_version_etag(_framework_variant('summary')))
+def summary(request, patient_id):
+    """Staging, next tests and treatment recommendations in one response."""
+    framework = request.GET.get("framework", "").lower()
+    kind = decisions.framework_kind(framework)
+    payloads = decisions.get_many(patient_id, [DecisionKind.STAGING, DecisionKind.NEXT_TESTS, kind])
+    if payloads is None:
         return JsonResponse({'error': 'Patient or diagnostics not found'}, status=404)
 
-    iss_stage = "Stage I"
-    rIss_stage = "Stage I"
-    prognosis = "Standard risk disease"
-
-    if latest_diag.beta2_microglobulin > 5.5:
-        iss_stage = "Stage III"
+    recommendations = payloads[kind]
+    recommendations['framework'] = decisions.framework_label(framework)
+    return JsonResponse({
+        'patientId': patient_id,
+        'staging': payloads[DecisionKind.STAGING],
+        'nextTests': payloads[DecisionKind.NEXT_TESTS],
+        'treatmentRecommendations': recommendations,
+    })
 
-    if latest_diag.ldh and latest_diag.ldh > 250:
-        rIss_stage = "Stage III"
-        prognosis = "High-risk disease with poor prognosis"
 
-    if "del(17p)" in latest_diag.biomarkers.get('cytogenetics', []):
-        prognosis = "High-risk disease due to cytogenetics"
+@csrf_exempt
+@require_http_methods(["POST"])
+def what_if(request, patient_id):
+    """Decisions under hypothetical diagnostics, without storing anything.
+
+    Expects ``{"scenarios": [{"name": ..., "overrides": {<diagnostic fields>}}, ...]}``,
+    with overrides validated like a PATCH to ``diagnostics``. Returns the
+    evaluation of the stored record as ``baseline`` and, per scenario, the
+    same evaluation plus the names of the parts that differ from it.
+    """
+    try:
+        scenarios = json.loads(request.body).get('scenarios')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    if not isinstance(scenarios, list):
+        return JsonResponse({'error': '"scenarios" must be a list'}, status=400)
+    if len(scenarios) > MAX_WHAT_IF_SCENARIOS:
+        return JsonResponse({'error': f'At most {MAX_WHAT_IF_SCENARIOS} scenarios per request'}, status=400)
+
+    overrides = []
+    for index, scenario in enumerate(scenarios):
+        try:
+            if not isinstance(scenario, dict):
+                raise ValidationError('Expected a JSON object.')
+            overrides.append(schemas.DIAGNOSTICS.decode(scenario.get('overrides', {}), partial=True))
+        except ValidationError as e:
+            return JsonResponse({'error': ' '.join(e.messages), 'index': index}, status=400)
+
+    patient = Patient.objects.filter(patient_id=patient_id).first()
+    if patient is None:
+        return JsonResponse({'error': 'Patient not found'}, status=404)
 
+    baseline, *results = decisions.what_if(patient, [{}, *overrides])
     return JsonResponse({
         'patientId': patient_id,
-        'issStage': iss_stage,
-        'rIssStage': rIss_stage,
-        'prognosis': prognosis
+        'baseline': baseline,
+        'scenarios': [
+            {
+                'name': scenario.get('name'),
+                'overrides': scenario.get('overrides', {}),
+                'changed': [name for name, value in result.items() if value != baseline[name]],
+                **result,
+            }
+            for scenario, result in zip(scenarios, results)
+        ],
     })
 
-@require_http_methods(["GET"])
-def treatment_recommendations(request, patient_id):
 
+def _stage_filters(request):
+    """Filters on the stored stages from ``iss_stage``, ``r_iss_stage`` and ``r2_iss_stage``.
+
+    Raises ValueError naming the first parameter with an unknown stage.
+    """
+    filters = {}
+    for name in STAGE_FIELDS:
+        if name not in request.GET:
+            continue
+        value = request.GET[name].strip().upper()
+        if value not in COHORT_STAGES:
+            raise ValueError(f'{name} must be one of I, II, III, IV (or 1-4) or unstaged')
+        stage = COHORT_STAGES[value]
+        if stage is None:
+            filters[f'{name}__isnull'] = True
+        else:
+            filters[name] = stage
+    return filters
+
+
+@replica_reads
+@require_http_methods(["GET"])
+def cohort(request):
+    """Patients carrying cytogenetic markers, e.g. ``?marker=t(4;14)&marker=del17p``.
+
+    ``match=all`` requires every marker instead of any; ``high_risk=true``
+    selects patients with any high-risk marker. Lab values can be filtered
+    in canonical units, e.g. ``?serum_creatinine_level__gt=2`` (mg/dL)
+    whatever unit they were reported in, and stages with ``iss_stage``,
+    ``r_iss_stage`` and ``r2_iss_stage``. Results are ordered by patient_id
+    and paged with ``limit`` and ``after`` (the previous page's ``next``).
+    """
+    codes = request.GET.getlist('marker')
+    high_risk = request.GET.get('high_risk', '').lower() in ('1', 'true', 'yes')
+    match = request.GET.get('match', 'any').lower()
+    if match not in ('any', 'all'):
+        return JsonResponse({'error': 'match must be "any" or "all"'}, status=400)
+    lab_filters = {}
+    for key, value in request.GET.items():
+        name, _, lookup = key.partition('__')
+        if name in units.LAB_FIELDS and lookup in COHORT_LAB_LOOKUPS:
+            try:
+                lab_filters[f'{units.canonical_field(name)}__{lookup}'] = float(value)
+            except ValueError:
+                return JsonResponse({'error': f'{key} must be a number'}, status=400)
     try:
-        patient = Patient.objects.get(patient_id=patient_id)
-        latest_diag = Diagnostic.objects.filter(patient=patient).latest('date')
-    except (Patient.DoesNotExist, Diagnostic.DoesNotExist):
-        return JsonResponse({'error': 'Patient or diagnostics not found'}, status=404)
+        stage_filters = _stage_filters(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not codes and not high_risk and not lab_filters and not stage_filters:
+        return JsonResponse({'error': 'Give at least one marker, lab or stage filter or high_risk=true'}, status=400)
+    try:
+        mask = cytogenetics.mask_of(codes)
+    except KeyError as e:
+        vocabulary = ', '.join(marker.code for marker in cytogenetics.VOCABULARY)
+        return JsonResponse({'error': f'Unknown marker {e.args[0]!r}; known markers: {vocabulary}'}, status=400)
+    try:
+        limit = int(request.GET.get('limit', COHORT_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    if not 1 <= limit <= COHORT_MAX_PAGE_SIZE:
+        return JsonResponse({'error': f'limit must be between 1 and {COHORT_MAX_PAGE_SIZE}'}, status=400)
+
+    patients = Patient.objects.filter(**lab_filters, **stage_filters)
+    if mask:
+        bits = cytogenetics.bits(mask)
+        carriers = PatientCytogeneticMarker.objects.filter(marker__in=bits).values('patient')
+        if match == 'all':
+            carriers = carriers.annotate(n=models.Count('marker')).filter(n=len(bits)).values('patient')
+        patients = patients.filter(pk__in=carriers)
+    if high_risk:
+        high_risk_carriers = PatientCytogeneticMarker.objects.filter(
+            marker__in=cytogenetics.bits(cytogenetics.HIGH_RISK_MASK)
+        ).values('patient')
+        patients = patients.filter(pk__in=high_risk_carriers)
+    if request.GET.get('after'):
+        patients = patients.filter(patient_id__gt=request.GET['after'])
+
+    rows = list(patients.order_by('patient_id').values_list('patient_id', 'cytogenetic_mask')[:limit])
+    return JsonResponse({
+        'patients': [
+            {'patient_id': patient_id, 'markers': cytogenetics.codes(value)} for patient_id, value in rows
+        ],
+        'next': rows[-1][0] if len(rows) == limit else None,
+    })
 
-    recommendations = []
-    notes = []
 
-    framework = request.GET.get("framework", "").lower()
-    # Convert framework to lowercase safely
-    framework = (framework or "").lower()
-
-    # === ✅ NICE FRAMEWORK PATH ===
-    if framework == "nice":
-        # 1️⃣ Fit vs frail
-        if patient.karnofsky_performance_score and patient.karnofsky_performance_score >= 70:
-            recommendations.append("NICE: Fit for intensive treatment → Offer bortezomib + thalidomide + dexamethasone (VTD).")
-        else:
-            recommendations.append("NICE: Frail or transplant-ineligible → Offer lenalidomide + dexamethasone (Rd) or VMP if fit enough.")
-
-        # 2️⃣ Stem cell transplant
-        if not patient.stem_cell_transplant_history:
-            if patient.karnofsky_performance_score and patient.karnofsky_performance_score >= 70:
-                recommendations.append("NICE: Consider autologous stem cell transplant following induction with VTD.")
-            else:
-                notes.append("Not eligible for stem cell transplant under NICE criteria.")
-        else:
-            notes.append("Stem cell transplant already performed.")
+@replica_reads
+@require_http_methods(["GET"])
+def cohort_stats(request):
+    """CRAB/SLiM counts, stage distributions and high-risk share by region.
+
+    Computed in the database; narrow the cohort with ``country``,
+    ``region``, ``disease`` and ``stage`` (exact matches) and with the
+    stage filters of ``cohort``.
+    """
+    filters = {name: request.GET[name] for name in COHORT_STATS_FILTERS if name in request.GET}
+    try:
+        stage_filters = _stage_filters(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    patients = Patient.objects.filter(**filters, **stage_filters)
+    filters.update((name, request.GET[name]) for name in STAGE_FIELDS if name in request.GET)
+    return JsonResponse({'filters': filters, **analytics.stats(patients)})
 
-        # 3️⃣ Disease activity
-        if patient.meets_crab or patient.meets_slim:
-            recommendations.append("NICE: Meets SLiM-CRAB criteria → Initiate systemic therapy.")
 
-        # 4️⃣ Relapsed/Refractory
-        if patient.treatment_refractory_status or (patient.progression and "progression" in patient.progression.lower()):
-            recommendations.append("NICE: Relapse → Offer daratumumab + lenalidomide + dexamethasone (DRd), or carfilzomib-based regimen if previously treated.")
+@require_http_methods(["GET"])
+def export_decisions(request):
+    """Stream staging, next tests and recommendations for every patient as NDJSON."""
+    framework = request.GET.get("framework", "").lower()
+    response = StreamingHttpResponse(decisions.iter_cohort_ndjson(framework), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="decisions.ndjson"'
+    return response
 
-        # 5️⃣ Renal Impairment
-        if patient.serum_creatinine_level and patient.serum_creatinine_level > 2.0:
-            recommendations.append("NICE: Renal impairment → Consider bortezomib-based treatment (VCD or VMP). Dose-adjust lenalidomide.")
 
-        # 6️⃣ Cytogenetics
-        high_risk_markers = ["del17p", "t(4;14)", "t(14;16)"]
-        if patient.cytogenic_markers:
-            markers = [m.strip().lower() for m in patient.cytogenic_markers.split(',')]
-            if any(marker in markers for marker in high_risk_markers):
-                recommendations.append("NICE: High-risk cytogenetics → Consider clinical trial or more aggressive triplet/quadruplet regimen.")
+@csrf_exempt
+@require_http_methods(["POST"])
+def create_job(request):
+    """Queue a background job: ``{"kind": ..., "params": {...}}``.
 
-        # 7️⃣ Peripheral neuropathy
-        if patient.peripheral_neuropathy_grade and patient.peripheral_neuropathy_grade >= 2:
-            recommendations.append("NICE: Avoid thalidomide and bortezomib due to neuropathy — consider lenalidomide-based regimens.")
+    Answers 202 with the job; poll its ``Location`` for status and
+    progress, then fetch ``/result`` once it succeeded.
+    """
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    kind = body.get('kind') if isinstance(body, dict) else None
+    if kind not in jobs.PARAMS:
+        return JsonResponse({'error': f'kind must be one of: {", ".join(jobs.PARAMS)}.'}, status=400)
+    try:
+        job = jobs.enqueue(kind, body.get('params'))
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    response = JsonResponse(jobs.describe(job), status=202)
+    response['Location'] = f'{request.path.rstrip("/")}/{job.pk}'
+    return response
 
-        # Default note
-        if not recommendations:
-            recommendations.append("NICE: No specific recommendation found — refer to haematology MDT.")
 
-    # === ✅ DEFAULT LOGIC from consensus practice and literature ===
-    else:
-        if patient.ecog_performance_status is not None and patient.ecog_performance_status <= 2:
-            recommendations.append("Eligible for aggressive treatment options (VRd, KRd).")
-        elif patient.karnofsky_performance_score is not None and patient.karnofsky_performance_score >= 70:
-            recommendations.append("Consider standard induction therapy with lenalidomide-based regimens.")
-        else:
-            recommendations.append("Consider less intensive therapy (Rd-lite, DRd).")
+@require_http_methods(["GET"])
+def job_status(request, job_id):
+    try:
+        job = Job.objects.get(pk=job_id)
+    except Job.DoesNotExist:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(jobs.describe(job))
 
-        if not patient.stem_cell_transplant_history:
-            transplant_eligible = (
-                (patient.karnofsky_performance_score and patient.karnofsky_performance_score >= 70) or
-                (patient.ecog_performance_status and patient.ecog_performance_status <= 2)
-            )
-            if transplant_eligible:
-                recommendations.append("Transplant Eligible → Induction therapy with Daratumumab + VRd (preferred).")
-            else:
-                recommendations.append("Transplant Ineligible → Consider DRd or lenalidomide + dexamethasone (Rd).")
-        else:
-            notes.append("Stem cell transplant already performed.")
-
-        high_risk_markers = ["del17p", "t(4;14)", "t(14;16)"]
-        if patient.cytogenic_markers:
-            markers = [m.strip().lower() for m in patient.cytogenic_markers.split(',')]
-            if any(marker in markers for marker in high_risk_markers):
-                recommendations.append("High-risk cytogenetics: consider quadruplet regimens (Dara-KRd).")
-            else:
-                notes.append("Standard-risk cytogenetics detected.")
-
-        if patient.meets_crab or patient.meets_slim:
-            recommendations.append("Initiate systemic therapy per IMWG criteria (meets SLiM-CRAB).")
-        else:
-            recommendations.append("Consider observation or clinical trial enrollment.")
 
-        if patient.peripheral_neuropathy_grade and patient.peripheral_neuropathy_grade >= 2:
-            recommendations.append("Avoid bortezomib; consider carfilzomib or ixazomib instead.")
+@require_http_methods(["GET"])
+def job_result(request, job_id):
+    """The output of a succeeded job: its stored chunks, streamed, or else its result."""
+    try:
+        job = Job.objects.get(pk=job_id)
+    except Job.DoesNotExist:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    if job.status != JobStatus.SUCCEEDED:
+        return JsonResponse({'error': f'Job is {job.status}.', 'status': job.status}, status=409)
+    if not job.chunks.exists():
+        return JsonResponse(job.result, safe=False)
+    response = StreamingHttpResponse(jobs.iter_result(job), content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="job-{job.pk}.ndjson"'
+    return response
 
-        if patient.serum_creatinine_level and patient.serum_creatinine_level > 2.0:
-            recommendations.append("Renal impairment detected: dose-adjust lenalidomide and avoid nephrotoxic agents.")
 
-        if patient.treatment_refractory_status:
-            notes.append(f"Refractory to: {patient.treatment_refractory_status}. Consider next-line salvage regimens (DPd, IsaPd, Selinexor combinations).")
+@csrf_exempt
+@require_http_methods(["POST"])
+def submit_monitoring(request, patient_id):
+    try:
+        values = schemas.MONITORING.decode(json.loads(request.body))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    try:
+        patient = Patient.objects.get(patient_id=patient_id)
+    except Patient.DoesNotExist:
+        return JsonResponse({'error': 'Patient not found'}, status=404)
 
-        if patient.progression and "progression" in patient.progression.lower():
-            recommendations.append("Disease progression detected: initiate relapse/refractory regimen.")
+    # The MonitoringSummary is updated by a post_save signal
+    Monitoring.objects.create(patient=patient, **values)
+    decisions.refresh(patient)
+    summary = MonitoringSummary.objects.filter(pk=patient.pk).first()
+    state = summary.kinetics if summary else kinetics.EMPTY
 
-        if patient.karnofsky_performance_score and patient.karnofsky_performance_score < 60:
-            recommendations.append("Consider frailty-adapted treatment: low-dose dexamethasone, avoid triplet regimens.")
+    return JsonResponse({
+        'message': 'Monitoring data uploaded.',
+        'recommendation': kinetics.recommendation(state),
+        'progression': kinetics.trend(state)['progression'],
+    })
 
-        if not recommendations:
-            recommendations.append("No immediate treatment recommendation. Recommend multidisciplinary board discussion.")
 
-    # Final response
-    response = {
-        'patient_id': patient_id,
-        'framework': framework.upper() if framework else "CONSENSUS",
-        'recommendations': recommendations,
-        'notes': notes,
-        'nextStep': 'Schedule follow-up consultation in 4 weeks or sooner based on lab results.'
-    }
+@replica_reads
+@require_http_methods(["GET"])
+@condition(etag_func=_version_etag(lambda request: 'monitoring-trend'))
+def monitoring_trend(request, patient_id):
+    """M-protein nadir, latest value, slope and IMWG progression status."""
+    summary = MonitoringSummary.objects.filter(patient__patient_id=patient_id).first()
+    if summary is None:
+        if not Patient.objects.filter(patient_id=patient_id).exists():
+            return JsonResponse({'error': 'Patient not found'}, status=404)
+        state = kinetics.EMPTY
+    else:
+        state = summary.kinetics
+    trend = kinetics.trend(state)
 
-    return JsonResponse(response, status=200)
+    return JsonResponse({
+        'patientId': patient_id,
+        'results': state.count,
+        'nadir': {'mProtein': state.nadir, 'date': state.nadir_date},
+        'last': {'mProtein': state.last, 'date': state.last_date},
+        'slopePer30Days': state.slope,
+        'changeFromNadir': trend['change_from_nadir'],
+        'percentChangeFromNadir': trend['percent_change_from_nadir'],
+        'progression': trend['progression'],
+        'progressionConfirmed': trend['progression_confirmed'],
+        'recommendation': kinetics.recommendation(state),
+    })
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def submit_monitoring(request, patient_id):
-    data = json.loads(request.body)
+def ingest_monitoring(request, patient_id):
+    """Store many monitoring results for a patient from an NDJSON body.
+
+    Each line holds one payload in the format of ``submit_monitoring``.
+    The body is read line by line and written in batches of
+    ``INGEST_BATCH_SIZE``, so uploads of any size use bounded memory.
+    Invalid lines are reported in ``errors`` (up to ``INGEST_MAX_ERRORS``)
+    and do not stop the rest of the upload.
+    """
     try:
         patient = Patient.objects.get(patient_id=patient_id)
     except Patient.DoesNotExist:
         return JsonResponse({'error': 'Patient not found'}, status=404)
 
-    Monitoring.objects.create(
-        patient=patient,
-        date=data.get('date'),
-        m_protein=data.get('mProtein'),
-        mrD_status=data.get('mrDStatus'),
-        symptoms=data.get('symptoms', [])
-    )
+    accepted = rejected = 0
+    errors = []
+    batch = []
+
+    def reject(number, message):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < INGEST_MAX_ERRORS:
+            errors.append({'line': number, 'error': message})
+
+    for number, line in _iter_lines(request):
+        if line is None:
+            reject(number, f'Line longer than {INGEST_MAX_LINE_LENGTH} bytes.')
+            continue
+        if not line.strip():
+            continue
+        try:
+            values = schemas.MONITORING.decode(json.loads(line))
+        except ValueError:
+            reject(number, 'Invalid JSON.')
+            continue
+        except ValidationError as e:
+            reject(number, ' '.join(e.messages))
+            continue
+        batch.append(Monitoring(patient=patient, **values))
+        if len(batch) == INGEST_BATCH_SIZE:
+            _store_monitoring(patient, batch)
+            accepted += len(batch)
+            batch = []
+    if batch:
+        _store_monitoring(patient, batch)
+        accepted += len(batch)
+
+    if accepted:
+        decisions.refresh(patient)
 
     return JsonResponse({
-        'message': 'Monitoring data uploaded.',
-        'recommendation': 'Continue maintenance therapy. Next assessment in 3 months.'
-    })
\ No newline at end of file
+        'message': f'{accepted} monitoring results stored.',
+        'accepted': accepted,
+        'rejected': rejected,
+        'errors': errors,
+        'errorsTruncated': rejected > len(errors),
+    }, status=200)